@@ -1,52 +1,250 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, redirect, url_for, flash
+from flask import Blueprint, Flask, current_app, render_template, request, jsonify, send_from_directory, redirect, url_for, flash
+from flask.cli import with_appcontext
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from flask_sqlalchemy import SQLAlchemy
-from flask_wtf.csrf import CSRFProtect
-from PIL import Image
+from sqlalchemy.exc import IntegrityError
+from jinja2 import FileSystemBytecodeCache
+from io import BytesIO
 import os
+import hashlib
+import mimetypes
 import logging
-import json
+import math
+import re
+import click
+from contextlib import ExitStack
+from datetime import datetime
 from urllib.parse import urlparse
+from fractional_index import key_between, keys_between
+from outbox import OutboxDispatcher, make_transport
+from storage import StorageError, make_storage
+from derivatives import crop_box_for, delete_derivatives, encode_image, ensure_derivative, save_derivatives
+from profiling import RequestProfiler
+from reconcile import Reconciler
+from locks import ImageLocks
+from critical_css import CriticalCSS
+from login_guard import LoginGuard, Overloaded, PasswordVerifier, TokenBuckets
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Initialize Flask app
-app = Flask(__name__)
-
-# Configure app
-app.config.update(
-    SECRET_KEY='your-secret-key-here',  # Change this in production!
-    SQLALCHEMY_DATABASE_URI='sqlite:///portfolio.db',
-    SQLALCHEMY_TRACK_MODIFICATIONS=False,
-    MAX_CONTENT_LENGTH=16 * 1024 * 1024,  # 16MB max file size
-    WTF_CSRF_ENABLED=True,
-    WTF_CSRF_TIME_LIMIT=None  # No time limit for CSRF tokens
-)
-
-# Configure upload folder
-UPLOAD_FOLDER = os.path.join(app.static_folder, 'uploads')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-
 # Configure allowed extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
-# Initialize extensions
-db = SQLAlchemy(app)
-csrf = CSRFProtect(app)
+# Extensions are bound to the app in create_app()
+db = SQLAlchemy()
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'main.login'
 login_manager.login_message = 'Please log in to access this page.'
 login_manager.login_message_category = 'error'
+profiler = RequestProfiler()
+
+# Views, request hooks and error handlers; registered on each app in create_app()
+bp = Blueprint('main', __name__)
+
+def create_app(test_config=None):
+    """Build and configure the application."""
+    app = Flask(__name__)
+
+    # Configure app
+    app.config.update(
+        SECRET_KEY='your-secret-key-here',  # Change this in production!
+        SQLALCHEMY_DATABASE_URI='sqlite:///portfolio.db',
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        MAX_CONTENT_LENGTH=16 * 1024 * 1024,  # 16MB max file size
+        WTF_CSRF_ENABLED=True,
+        WTF_CSRF_TIME_LIMIT=None  # No time limit for CSRF tokens
+    )
+
+    # Configure upload folder (created on first write)
+    app.config['UPLOAD_FOLDER'] = os.path.join(app.static_folder, 'uploads')
+
+    # Configure image storage ('local' or 's3')
+    app.config.update(
+        STORAGE_BACKEND=os.environ.get('STORAGE_BACKEND', 'local'),
+        S3_BUCKET=os.environ.get('S3_BUCKET'),
+        S3_PREFIX=os.environ.get('S3_PREFIX', ''),
+        S3_ENDPOINT_URL=os.environ.get('S3_ENDPOINT_URL'),
+        S3_REGION=os.environ.get('S3_REGION'),
+        S3_PUBLIC_URL=os.environ.get('S3_PUBLIC_URL'),
+        STORAGE_FSYNC=os.environ.get('STORAGE_FSYNC', 'file'),  # 'none', 'file' or 'full'
+        LOCK_FOLDER=os.path.join(app.instance_path, 'locks'),
+        LOCK_TIMEOUT=10  # Seconds to wait for another worker editing the same image
+    )
+
+    # Configure on-demand profiling (see profiling.py for the triggers)
+    app.config.update(
+        PROFILE_ALWAYS=os.environ.get('PROFILE_ALWAYS') == '1',
+        PROFILE_SAMPLE_RATE=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+        PROFILE_MODE=os.environ.get('PROFILE_MODE', 'cprofile'),
+        PROFILE_ENDPOINTS=['main.index', 'main.admin', 'main.upload_file', 'main.get_gallery', 'main.rotate_image']
+    )
+
+    # Configure gallery pagination and static export
+    app.config['GALLERY_PAGE_SIZE'] = 24
+    app.config['ADMIN_PAGE_SIZE'] = 48
+
+    # Configure above-the-fold rendering of the landing page
+    app.config.update(
+        CRITICAL_CSS=True,
+        # Added by main.js before first paint, so not visible in the template
+        CRITICAL_CSS_CLASSES=['gallery-virtual', 'gallery-tile', 'loaded'],
+        GALLERY_FIRST_ROW=3,
+        EARLY_HINTS_ENVIRON_KEY='wsgi.early_hints'
+    )
+    app.config['EXPORT_FOLDER'] = os.path.join(app.root_path, 'build')
+
+    # Configure contact message delivery ('debug' logs instead of sending)
+    app.config.update(
+        CONTACT_TRANSPORT=os.environ.get('CONTACT_TRANSPORT', 'debug'),
+        CONTACT_SENDER=os.environ.get('CONTACT_SENDER', 'portfolio@localhost'),
+        CONTACT_RECIPIENT=os.environ.get('CONTACT_RECIPIENT', 'contact@swethakulkarni.com'),
+        MAIL_SERVER=os.environ.get('MAIL_SERVER', 'localhost'),
+        MAIL_PORT=int(os.environ.get('MAIL_PORT', 25)),
+        MAIL_USERNAME=os.environ.get('MAIL_USERNAME'),
+        MAIL_PASSWORD=os.environ.get('MAIL_PASSWORD'),
+        MAIL_USE_TLS=os.environ.get('MAIL_USE_TLS') == '1',
+        OUTBOX_BATCH_SIZE=50,
+        OUTBOX_MAX_ATTEMPTS=5,
+        OUTBOX_POLL_INTERVAL=5
+    )
+
+    # Run the outbox dispatcher and the reconciler inside the web process.
+    # Only for single-process deployments; otherwise run `flask dispatch-outbox`
+    # and `flask reconcile --watch` as separate processes
+    app.config['BACKGROUND_TASKS'] = os.environ.get('BACKGROUND_TASKS') == '1'
+
+    # Configure the storage/catalog reconciler
+    app.config.update(
+        RECONCILE_BATCH_SIZE=200,
+        RECONCILE_PAUSE=0.05,      # Seconds to sleep between batches
+        RECONCILE_INTERVAL=3600,   # Seconds between background passes
+        RECONCILE_SPOOL_MAX_AGE=3600,
+        RECONCILE_MAX_REMOVE=0.1   # Largest fraction of the catalog one pass may remove
+    )
+
+    # Configure login throttling (see login_guard.py)
+    app.config.update(
+        LOGIN_IP_BURST=10,
+        LOGIN_IP_PER_MINUTE=10,        # Failed attempts per client IP
+        LOGIN_USERNAME_BURST=5,
+        LOGIN_USERNAME_PER_MINUTE=5,   # Failed attempts per username, from any IP
+        LOGIN_THROTTLE_MAX_KEYS=10000,
+        LOGIN_VERIFY_WORKERS=2,        # Password checks running at once
+        LOGIN_VERIFY_QUEUE=8,          # ...and waiting; more are refused with a 503
+        LOGIN_VERIFY_TIMEOUT=5
+    )
+
+    # Largest palette distance (CIELAB) that still counts as a colour match
+    app.config['COLOR_MAX_DISTANCE'] = 30
+
+    # Configure library recompression (see optimize.py)
+    app.config.update(
+        OPTIMIZE_CHECKPOINT=os.path.join(app.instance_path, 'optimize-checkpoint.json'),
+        OPTIMIZE_WORKERS=None,       # Defaults to the number of CPUs
+        OPTIMIZE_QUALITY_MIN=60,
+        OPTIMIZE_QUALITY_MAX=90,
+        OPTIMIZE_MIN_SCORE=0.985     # SSIM against the current encoding
+    )
+
+    # Threads running the app under the ASGI serving mode (see asgi.py)
+    app.config['ASGI_THREADS'] = int(os.environ.get('ASGI_THREADS', 8))
+
+    # Compiled templates are cached on disk so new workers skip the Jinja compile
+    app.config['TEMPLATE_CACHE_FOLDER'] = os.path.join(app.instance_path, 'jinja_cache')
+
+    if test_config:
+        app.config.update(test_config)
+
+    # Initialize extensions
+    from flask_wtf.csrf import CSRFProtect
+    db.init_app(app)
+    CSRFProtect(app)
+    login_manager.init_app(app)
+    profiler.init_app(app)
+
+    os.makedirs(app.config['TEMPLATE_CACHE_FOLDER'], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_FOLDER'])
+
+    app.register_blueprint(bp)
+    for command in (export_command, dispatch_outbox_command, reconcile_command, precompile_templates_command,
+                    optimize_library_command, index_colors_command):
+        app.cli.add_command(command)
+    return app
+
+def __getattr__(name):
+    # ``from app import app`` builds the default app on first use only
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def get_storage():
+    # Rebuilt when the backend or upload folder changes (e.g. in tests)
+    key = (current_app.config['STORAGE_BACKEND'], current_app.config['UPLOAD_FOLDER'], current_app.config['STORAGE_FSYNC'])
+    cached = current_app.extensions.get('storage')
+    if cached is None or cached[0] != key:
+        cached = current_app.extensions['storage'] = (key, make_storage(current_app.config))
+    return cached[1]
+
+def image_lock(filename):
+    """Exclusive lock on one image, shared by every worker process."""
+    return ImageLocks(current_app.config['LOCK_FOLDER']).lock(filename, timeout=current_app.config['LOCK_TIMEOUT'])
+
+def scan_images():
+    """Return ``(filename, size, mtime_ns)`` for uploaded images in gallery order."""
+    return [entry for entry in get_storage().scan() if allowed_file(entry[0])]
+
+def list_images():
+    """Return the uploaded image filenames in gallery order."""
+    return [entry[0] for entry in scan_images()]
+
+def gallery_version(entries):
+    # Changes whenever an image is uploaded, rotated or deleted
+    digest = hashlib.sha1()
+    for filename, size, mtime_ns in entries:
+        digest.update(f'{filename}:{size}:{mtime_ns}\n'.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def image_entry(filename, mtime_ns=None):
+    url = get_storage().url(filename)
+    if mtime_ns is not None:
+        # Versioned URLs change when the image does, so they can be cached for good
+        url = f'{url}?v={mtime_ns:x}'
+    entry = {
+        'filename': filename,
+        'url': url
+    }
+    if mtime_ns is not None:
+        entry['tile_url'] = tile_url(filename, mtime_ns)
+    return entry
+
+def thumbnail_url(filename, mtime_ns):
+    # Keyed on the original's mtime so a rotate yields a fresh thumbnail URL
+    return url_for('main.thumbnail', filename=filename, v=f'{mtime_ns:x}')
+
+def tile_url(filename, mtime_ns):
+    return url_for('main.tile', filename=filename, v=f'{mtime_ns:x}')
+
+def paginate_images(images, page, per_page):
+    total = len(images)
+    pages = max(1, math.ceil(total / per_page))
+    page = min(max(page, 1), pages)
+    start = (page - 1) * per_page
+    return {
+        'images': images[start:start + per_page],
+        'page': page,
+        'pages': pages,
+        'per_page': per_page,
+        'total': total
+    }
+
 # User Model
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -59,6 +257,196 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+# Album Models
+class Album(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(120), nullable=False)
+    slug = db.Column(db.String(120), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    items = db.relationship('AlbumImage', backref='album', lazy='dynamic',
+                            cascade='all, delete-orphan')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'slug': self.slug,
+            'count': self.items.count()
+        }
+
+class AlbumImage(db.Model):
+    # position is a fractional index (see fractional_index.py): moving an
+    # image only rewrites its own row.
+    __tablename__ = 'album_image'
+    __table_args__ = (
+        # Also the index behind ORDER BY position and the keyset cursors
+        db.UniqueConstraint('album_id', 'position', name='uq_album_image_position'),
+        db.UniqueConstraint('album_id', 'filename', name='uq_album_image_filename'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    album_id = db.Column(db.Integer, db.ForeignKey('album.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    position = db.Column(db.String(64), nullable=False)
+    # Catalog row of the image, loaded with the item for its thumbnail URL
+    photo = db.relationship('Photo', primaryjoin='foreign(AlbumImage.filename) == Photo.filename',
+                            viewonly=True, lazy='joined')
+
+    def to_dict(self):
+        data = {
+            'id': self.id,
+            'filename': self.filename,
+            'url': get_storage().url(self.filename),
+            'position': self.position
+        }
+        # Images not catalogued yet (see reconcile.py) fall back to the original
+        if self.photo is not None:
+            data['thumbnail_url'] = thumbnail_url(self.filename, self.photo.mtime_ns)
+        return data
+
+# Contact outbox: one insert per submission, delivered by OutboxDispatcher
+class ContactMessage(db.Model):
+    __tablename__ = 'contact_message'
+    __table_args__ = (
+        db.Index('ix_contact_message_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    email = db.Column(db.String(254), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    status = db.Column(db.String(16), default='pending', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_error = db.Column(db.Text)
+    sent_at = db.Column(db.DateTime)
+
+class Photo(db.Model):
+    """Catalog row for an image in storage."""
+    __tablename__ = 'photo'
+
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), unique=True, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    mtime_ns = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Square tile crop as "left,top,right,bottom", valid for crop_mtime_ns
+    crop_box = db.Column(db.String(64))
+    crop_mtime_ns = db.Column(db.BigInteger)
+    # Packed dominant-colour palette (see palette.py)
+    palette = db.Column(db.LargeBinary)
+
+    @property
+    def crop(self):
+        # A crop computed for an older version of the image no longer applies
+        if self.crop_box and self.crop_mtime_ns == self.mtime_ns:
+            return tuple(int(value) for value in self.crop_box.split(','))
+        return None
+
+    def set_crop(self, box):
+        self.crop_box = ','.join(str(value) for value in box)
+        self.crop_mtime_ns = self.mtime_ns
+
+def record_image(storage, filename, crop_box=None, palette=None):
+    """Create or refresh the catalog row for a freshly written image."""
+    size, mtime_ns = storage.stat(filename)
+    photo = Photo.query.filter_by(filename=filename).first()
+    if photo is None:
+        photo = Photo(filename=filename)
+        db.session.add(photo)
+    photo.size, photo.mtime_ns = size, mtime_ns
+    if crop_box is not None:
+        photo.set_crop(crop_box)
+    if palette is not None:
+        photo.palette = palette
+    db.session.commit()
+    return photo
+
+def tile_crop_box(storage, filename):
+    """Return the cached tile crop of an image, computing and caching it if needed."""
+    size, mtime_ns = storage.stat(filename)
+    photo = Photo.query.filter_by(filename=filename).first()
+    if photo is not None and photo.mtime_ns == mtime_ns and photo.crop:
+        return photo.crop
+
+    from PIL import Image
+    with Image.open(BytesIO(storage.read(filename))) as img:
+        box = crop_box_for(img, 'tile')
+    if photo is None:
+        photo = Photo(filename=filename)
+        db.session.add(photo)
+    photo.size, photo.mtime_ns = size, mtime_ns
+    photo.set_crop(box)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Catalogued concurrently; the crop is still good for this request
+        db.session.rollback()
+    return box
+
+def forget_catalog(filenames):
+    """Drop the catalog rows of missing images; the caller commits.
+
+    Album entries are kept, so they come back if the file does.
+    """
+    Photo.query.filter(Photo.filename.in_(filenames)).delete(synchronize_session=False)
+
+def forget_images(filenames):
+    """Drop the database rows of deleted images; the caller commits."""
+    forget_catalog(filenames)
+    AlbumImage.query.filter(AlbumImage.filename.in_(filenames)).delete(synchronize_session=False)
+
+def get_reconciler():
+    if 'reconciler' not in current_app.extensions:
+        current_app.extensions['reconciler'] = Reconciler(
+            current_app._get_current_object(), db, Photo, get_storage, allowed_file, forget_catalog,
+            batch_size=current_app.config['RECONCILE_BATCH_SIZE'],
+            pause=current_app.config['RECONCILE_PAUSE'],
+            interval=current_app.config['RECONCILE_INTERVAL'],
+            spool_max_age=current_app.config['RECONCILE_SPOOL_MAX_AGE'],
+            max_remove=current_app.config['RECONCILE_MAX_REMOVE'])
+    return current_app.extensions['reconciler']
+
+def get_login_guard():
+    if 'login_guard' not in current_app.extensions:
+        config = current_app.config
+        current_app.extensions['login_guard'] = LoginGuard(
+            TokenBuckets(config['LOGIN_IP_BURST'], config['LOGIN_IP_PER_MINUTE'],
+                         config['LOGIN_THROTTLE_MAX_KEYS']),
+            TokenBuckets(config['LOGIN_USERNAME_BURST'], config['LOGIN_USERNAME_PER_MINUTE'],
+                         config['LOGIN_THROTTLE_MAX_KEYS']),
+            PasswordVerifier(config['LOGIN_VERIFY_WORKERS'], config['LOGIN_VERIFY_QUEUE'],
+                             config['LOGIN_VERIFY_TIMEOUT']))
+    return current_app.extensions['login_guard']
+
+def login_rejected(message, status, retry_after):
+    flash(message, 'error')
+    response = current_app.make_response((render_template('login.html'), status))
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+def get_palette_index():
+    from palette import PaletteIndex
+    if 'palette_index' not in current_app.extensions:
+        current_app.extensions['palette_index'] = PaletteIndex()
+    index = current_app.extensions['palette_index']
+    # Any upload, rewrite, delete or backfill changes one of these
+    version = tuple(db.session.query(db.func.count(Photo.id), db.func.count(Photo.palette),
+                                     db.func.max(Photo.mtime_ns)).one())
+    index.refresh(version, lambda: db.session.query(Photo.filename, Photo.mtime_ns, Photo.palette)
+                  .filter(Photo.palette.isnot(None)).order_by(Photo.filename))
+    return index
+
+def get_outbox():
+    if 'outbox' not in current_app.extensions:
+        current_app.extensions['outbox'] = OutboxDispatcher(
+            current_app._get_current_object(), db, ContactMessage, make_transport(current_app.config),
+            batch_size=current_app.config['OUTBOX_BATCH_SIZE'],
+            max_attempts=current_app.config['OUTBOX_MAX_ATTEMPTS'],
+            poll_interval=current_app.config['OUTBOX_POLL_INTERVAL'])
+    return current_app.extensions['outbox']
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -78,44 +466,75 @@ def create_admin_user():
         logger.error(f"Error creating admin user: {str(e)}")
         db.session.rollback()
 
-@app.route('/')
+def get_critical_css(template):
+    if not current_app.config['CRITICAL_CSS']:
+        return None
+    if 'critical_css' not in current_app.extensions:
+        current_app.extensions['critical_css'] = CriticalCSS(
+            os.path.join(current_app.static_folder, 'css', 'style.css'),
+            url_for('static', filename='css/style.css'),
+            current_app.config['CRITICAL_CSS_CLASSES'])
+    return current_app.extensions['critical_css'].for_template(
+        os.path.join(current_app.root_path, current_app.template_folder, template))
+
+def preload_links(resources):
+    return ', '.join(f'<{url}>; rel=preload; as={kind}' for url, kind in resources)
+
+def send_early_hints(resources):
+    # Only some servers expose 103 Early Hints; the final Link header covers the rest
+    early_hints = request.environ.get(current_app.config['EARLY_HINTS_ENVIRON_KEY'])
+    if callable(early_hints):
+        try:
+            early_hints([('Link', preload_links(resources))])
+        except Exception as e:
+            logger.warning(f"Could not send early hints: {str(e)}")
+
+def gallery_page_url():
+    # The static export swaps this for its pre-rendered page files
+    return current_app.config.get('GALLERY_PAGE_URL') or \
+        url_for('main.get_gallery') + '?page={page}&per_page={per_page}'
+
+@bp.route('/')
 def index():
-    # Get all images from the uploads folder
+    # Only the first page is rendered; main.js fetches the rest on scroll
+    page_size = current_app.config['GALLERY_PAGE_SIZE']
+    # Known before touching storage, so hint them while the listing runs
+    resources = [(url_for('static', filename='images/hero-bg.jpg'), 'image'),
+                 (url_for('static', filename='css/style.css'), 'style')]
+    send_early_hints(resources)
+
     images = []
+    total = 0
+    version = ''
     try:
-        logger.info(f"Upload folder path: {app.config['UPLOAD_FOLDER']}")
-        if os.path.exists(app.config['UPLOAD_FOLDER']):
-            for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-                if allowed_file(filename):
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    if os.path.isfile(file_path):
-                        image_url = url_for('static', filename=f'uploads/{filename}')
-                        logger.info(f"Adding image: {filename} with URL: {image_url}")
-                        images.append({
-                            'filename': filename,
-                            'url': image_url
-                        })
-                    else:
-                        logger.warning(f"File not found: {file_path}")
-                else:
-                    logger.warning(f"Skipping non-allowed file: {filename}")
-        else:
-            logger.warning(f"Upload folder does not exist: {app.config['UPLOAD_FOLDER']}")
+        entries = scan_images()
+        total = len(entries)
+        version = gallery_version(entries)
+        for filename, _, mtime_ns in entries[:page_size]:
+            images.append(image_entry(filename, mtime_ns))
+            logger.debug(f"Adding image: {filename} with URL: {images[-1]['url']}")
         
-        logger.info(f"Total images to display: {len(images)}")
-        return render_template('index.html', images=images)
+        logger.info(f"Total images to display: {total}")
     except Exception as e:
         logger.error(f"Error loading images: {str(e)}")
-        return render_template('index.html', images=[])
+        images, total = [], 0
+
+    preload_images = [image['tile_url'] for image in images[:current_app.config['GALLERY_FIRST_ROW']]]
+    response = current_app.make_response(render_template(
+        'index.html', images=images, total=total, version=version,
+        page_size=page_size, page_url=gallery_page_url(),
+        critical_css=get_critical_css('index.html'), preload_images=preload_images))
+    response.headers['Link'] = preload_links(resources + [(url, 'image') for url in preload_images])
+    return response
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     logger.info(f"Login request received. Method: {request.method}")
     try:
         # If user is already authenticated, redirect to admin
         if current_user.is_authenticated:
             logger.info("User is already authenticated, redirecting to admin")
-            return redirect(url_for('admin'))
+            return redirect(url_for('main.admin'))
 
         if request.method == 'POST':
             username = request.form.get('username')
@@ -128,10 +547,28 @@ def login():
                 flash('Please provide both username and password', 'error')
                 return render_template('login.html')
             
+            # Throttled attempts are turned away before any database or hashing work
+            ip = request.remote_addr or 'unknown'
+            username = username[:80]
+            guard = get_login_guard()
+            wait = guard.admit(ip, username)
+            if wait:
+                logger.warning(f"Throttled login attempt for username: {username} from {ip}")
+                return login_rejected('Too many login attempts. Please try again later.', 429, wait)
+
             logger.debug(f"Login attempt for username: {username}")
             user = User.query.filter_by(username=username).first()
             
-            if user and user.check_password(password):
+            try:
+                # Hashing runs on a bounded pool so it can't take every worker
+                valid = user is not None and guard.verifier.verify(
+                    check_password_hash, user.password_hash, password)
+            except Overloaded as e:
+                logger.warning(f"Login attempt for username: {username} refused: {str(e)}")
+                return login_rejected('The server is busy. Please try again in a moment.', 503, 1)
+
+            if valid:
+                guard.succeeded(ip, username)
                 login_user(user, remember=True)
                 logger.info(f"User {username} logged in successfully")
                 flash('Logged in successfully!', 'success')
@@ -139,7 +576,7 @@ def login():
                 # Get the next page from args or default to admin
                 next_page = request.args.get('next')
                 if not next_page or urlparse(next_page).netloc != '':
-                    next_page = url_for('admin')
+                    next_page = url_for('main.admin')
                 
                 logger.info(f"Redirecting to: {next_page}")
                 return redirect(next_page)
@@ -154,57 +591,40 @@ def login():
         flash('An error occurred. Please try again.')
         return render_template('login.html')
 
-@app.route('/admin')
+@bp.route('/admin')
 @login_required
 def admin():
     try:
         logger.info(f"Admin route accessed by user: {current_user.username}")
         
-        # Get all images
+        # Only the current page is rendered, as thumbnails
+        per_page = min(max(request.args.get('per_page', current_app.config['ADMIN_PAGE_SIZE'], type=int), 1), 200)
+        pagination = paginate_images(scan_images(), request.args.get('page', 1, type=int), per_page)
         images = []
-        upload_folder = app.config['UPLOAD_FOLDER']
-        logger.info(f"Admin route - Checking upload folder: {upload_folder}")
+        for filename, _, mtime_ns in pagination.pop('images'):
+            image = image_entry(filename, mtime_ns)
+            image['thumbnail_url'] = thumbnail_url(filename, mtime_ns)
+            images.append(image)
         
-        if os.path.exists(upload_folder):
-            files = sorted(os.listdir(upload_folder))
-            logger.info(f"Admin route - Found {len(files)} files in upload folder")
-            
-            for filename in files:
-                if allowed_file(filename):
-                    file_path = os.path.join(upload_folder, filename)
-                    if os.path.isfile(file_path):
-                        image_url = url_for('static', filename=f'uploads/{filename}')
-                        logger.debug(f"Admin route - Processing image: {filename}")
-                        logger.debug(f"Admin route - Generated URL: {image_url}")
-                        images.append({
-                            'filename': filename,
-                            'url': image_url
-                        })
-                    else:
-                        logger.warning(f"Admin route - File not found: {file_path}")
-                else:
-                    logger.warning(f"Admin route - Skipping non-allowed file: {filename}")
-        else:
-            logger.warning(f"Admin route - Upload folder does not exist: {upload_folder}")
-            os.makedirs(upload_folder, exist_ok=True)
-            logger.info(f"Admin route - Created upload folder: {upload_folder}")
-        
-        logger.info(f"Admin route - Total images to display: {len(images)}")
+        logger.info(f"Admin route - Showing {len(images)} of {pagination['total']} images")
+        albums = Album.query.order_by(Album.created_at, Album.id).all()
         return render_template('admin.html', 
                              images=images,
+                             pagination=pagination,
+                             albums=albums,
                              username=current_user.username)
     except Exception as e:
         logger.error(f"Error in admin route: {str(e)}", exc_info=True)
         flash('An error occurred while loading the admin page.', 'error')
         return render_template('error.html', error=str(e)), 500
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/delete-image', methods=['POST'])
+@bp.route('/delete-image', methods=['POST'])
 @login_required
 def delete_image():
     try:
@@ -213,24 +633,66 @@ def delete_image():
             return jsonify({'success': False, 'message': 'No filename provided'}), 400
 
         filename = data['filename']
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        storage = get_storage()
         
         logger.info(f"Attempting to delete image: {filename}")
-        logger.info(f"Full file path: {file_path}")
         
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            logger.info(f"Successfully deleted image: {filename}")
-            return jsonify({'success': True, 'message': 'Image deleted successfully'})
-        else:
-            logger.warning(f"File not found for deletion: {file_path}")
-            return jsonify({'success': False, 'message': 'File not found'}), 404
+        with image_lock(filename):
+            if storage.exists(filename):
+                storage.delete(filename)
+                delete_derivatives(storage, [filename])
+                forget_images([filename])
+                db.session.commit()
+                logger.info(f"Successfully deleted image: {filename}")
+                return jsonify({'success': True, 'message': 'Image deleted successfully'})
+            else:
+                logger.warning(f"File not found for deletion: {filename}")
+                return jsonify({'success': False, 'message': 'File not found'}), 404
             
+    except StorageError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except TimeoutError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
     except Exception as e:
         logger.error(f"Error deleting image: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
-@app.route('/upload', methods=['POST'])
+@bp.route('/delete-images', methods=['POST'])
+@login_required
+def delete_images():
+    try:
+        data = request.get_json()
+        if not data or not data.get('filenames'):
+            return jsonify({'success': False, 'message': 'No filenames provided'}), 400
+
+        filenames = [filename for filename in data['filenames'] if allowed_file(filename)]
+        storage = get_storage()
+        with ExitStack() as stack:
+            # Always taken in the same order so two batches cannot deadlock
+            for filename in sorted(set(filenames)):
+                stack.enter_context(image_lock(filename))
+            deleted = storage.delete_many(filenames)
+            if deleted:
+                delete_derivatives(storage, deleted)
+                forget_images(deleted)
+                db.session.commit()
+
+        logger.info(f"Deleted {len(deleted)} of {len(data['filenames'])} requested images")
+        return jsonify({
+            'success': True,
+            'deleted': deleted,
+            'message': f'Deleted {len(deleted)} images'
+        })
+    except StorageError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except TimeoutError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    except Exception as e:
+        logger.error(f"Error deleting images: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
     if 'images' not in request.files:
@@ -249,13 +711,25 @@ def upload_file():
         
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             
             try:
                 # Save and optimize image
+                from PIL import Image
+                from palette import extract_palette
                 img = Image.open(file)
                 img.thumbnail((1920, 1920))  # Max dimension 1920px
-                img.save(filepath, optimize=True, quality=85)
+                encoded = encode_image(img, filename, optimize=True, quality=85)
+                crop_box = crop_box_for(img, 'tile')
+                palette = extract_palette(img)
+                storage = get_storage()
+                with image_lock(filename):
+                    storage.save(filename, encoded)
+                    record_image(storage, filename, crop_box, palette)
+                    try:
+                        save_derivatives(storage, img, filename, crop_box)
+                    except Exception as e:
+                        # Regenerated on demand by the thumbnail route
+                        logger.warning(f"Error generating derivatives for {filename}: {str(e)}")
                 uploaded_files.append(filename)
             except Exception as e:
                 errors.append(f"Error processing {filename}: {str(e)}")
@@ -271,41 +745,87 @@ def upload_file():
         'errors': errors if errors else None
     })
 
-@app.route('/gallery')
+@bp.route('/gallery')
 def get_gallery():
-    images = []
     try:
         logger.info("Loading gallery images...")
-        if not os.path.exists(app.config['UPLOAD_FOLDER']):
-            logger.warning(f"Upload folder does not exist: {app.config['UPLOAD_FOLDER']}")
-            return jsonify([])
-
-        for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-            if allowed_file(filename):
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                if os.path.isfile(file_path):
-                    image_url = f'/static/uploads/{filename}'
-                    logger.info(f"Adding image: {filename} with URL: {image_url}")
-                    images.append({
-                        'filename': filename,
-                        'url': image_url
-                    })
-                else:
-                    logger.warning(f"File not found: {file_path}")
-        
-        logger.info(f"Found {len(images)} images: {json.dumps(images)}")
-        return jsonify(images)
+        # Sorted so that pages are stable between requests
+        entries = scan_images()
+        version = gallery_version(entries)
+        if 'page' in request.args:
+            # Only the requested page is turned into entries
+            per_page = min(max(request.args.get('per_page', current_app.config['GALLERY_PAGE_SIZE'], type=int), 1), 200)
+            page = paginate_images(entries, request.args.get('page', 1, type=int), per_page)
+            page['images'] = [image_entry(filename, mtime_ns) for filename, _, mtime_ns in page['images']]
+            logger.info(f"Gallery page {page['page']}/{page['pages']}: {len(page['images'])} of {page['total']} images")
+            response = jsonify(page)
+        else:
+            images = [image_entry(filename, mtime_ns) for filename, _, mtime_ns in entries]
+            logger.info(f"Found {len(images)} images")
+            response = jsonify(images)
+        # Lets the service worker revalidate its cached copy cheaply
+        response.headers['X-Gallery-Version'] = version
+        return response
     except Exception as e:
         logger.error(f"Error loading gallery: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
-@app.route('/contact', methods=['POST'])
+@bp.route('/colors')
+def images_by_color():
+    # Served from the in-memory palette index; no image is decoded here
+    try:
+        from palette import palette_hex, parse_color
+        index = get_palette_index()
+        color = request.args.get('color')
+        if color:
+            try:
+                rgb = parse_color(color)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            max_distance = request.args.get('max_distance', current_app.config['COLOR_MAX_DISTANCE'], type=float)
+            matches = index.nearest(rgb, max_distance)
+        else:
+            matches = [(entry, None) for entry in index.by_hue()]
+
+        per_page = min(max(request.args.get('per_page', current_app.config['GALLERY_PAGE_SIZE'], type=int), 1), 200)
+        page = paginate_images(matches, request.args.get('page', 1, type=int), per_page)
+        images = []
+        for (filename, mtime_ns, packed), distance in page['images']:
+            image = image_entry(filename, mtime_ns)
+            image['palette'] = palette_hex(packed)
+            if distance is not None:
+                image['distance'] = round(distance, 2)
+            images.append(image)
+        page['images'] = images
+        return jsonify(page)
+    except Exception as e:
+        logger.error(f"Error browsing by color: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/contact', methods=['POST'])
 def contact():
-    data = request.json
-    # Here you would typically send an email or store the contact form data
-    return jsonify({'success': True, 'message': 'Message sent successfully'})
+    try:
+        data = request.get_json(silent=True) or {}
+        name = str(data.get('name', '')).strip()
+        email = str(data.get('email', '')).strip()
+        message = str(data.get('message', '')).strip()
+        if not name or not email or not message:
+            return jsonify({'success': False, 'message': 'Please provide name, email and message'}), 400
+        # Both end up in email headers
+        if any(char in name + email for char in '\r\n'):
+            return jsonify({'success': False, 'message': 'Name and email must be on one line'}), 400
+
+        # Only queue the message here; delivery happens in the outbox dispatcher
+        db.session.add(ContactMessage(name=name[:120], email=email[:254], message=message[:5000]))
+        db.session.commit()
+        get_outbox().notify()
+        return jsonify({'success': True, 'message': 'Message sent successfully'})
+    except Exception as e:
+        logger.error(f"Error queueing contact message: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Failed to send message'}), 500
 
-@app.route('/rotate-image', methods=['POST'])
+@bp.route('/rotate-image', methods=['POST'])
 @login_required
 def rotate_image():
     try:
@@ -319,32 +839,220 @@ def rotate_image():
         if not filename or degrees is None:
             return jsonify({'success': False, 'message': 'Missing filename or degrees'}), 400
 
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if not os.path.exists(file_path):
+        storage = get_storage()
+        if not storage.exists(filename):
             return jsonify({'success': False, 'message': 'Image not found'}), 404
 
         try:
-            with Image.open(file_path) as img:
+            from PIL import Image
+            # Read-modify-write: a concurrent edit of the same image must wait
+            with image_lock(filename), Image.open(BytesIO(storage.read(filename))) as img:
                 # Rotate the image
                 rotated_img = img.rotate(-degrees, expand=True)  # Negative degrees for clockwise rotation
                 # Save the rotated image, overwriting the original
-                rotated_img.save(file_path, quality=95, optimize=True)
-                
+                storage.save(filename, encode_image(rotated_img, filename, quality=95, optimize=True))
+                photo = record_image(storage, filename, crop_box_for(rotated_img, 'tile'))
+
             return jsonify({
                 'success': True,
                 'message': 'Image rotated successfully',
-                'url': url_for('static', filename=f'uploads/{filename}')
+                'url': storage.url(filename),
+                'thumbnail_url': thumbnail_url(filename, photo.mtime_ns),
+                'tile_url': tile_url(filename, photo.mtime_ns)
             })
             
+        except TimeoutError as e:
+            return jsonify({'success': False, 'message': str(e)}), 409
         except Exception as e:
             logger.error(f"Error rotating image: {str(e)}")
             return jsonify({'success': False, 'message': 'Failed to rotate image'}), 500
             
+    except StorageError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         logger.error(f"Error in rotate_image route: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
 
-@app.route('/debug-login')
+def slugify(title):
+    slug = re.sub(r'[^a-z0-9]+', '-', title.lower()).strip('-') or 'album'
+    candidate = slug
+    suffix = 2
+    while Album.query.filter_by(slug=candidate).first():
+        candidate = f'{slug}-{suffix}'
+        suffix += 1
+    return candidate
+
+@bp.route('/albums')
+def list_albums():
+    albums = Album.query.order_by(Album.created_at, Album.id).all()
+    return jsonify({'success': True, 'albums': [album.to_dict() for album in albums]})
+
+@bp.route('/albums', methods=['POST'])
+@login_required
+def create_album():
+    try:
+        data = request.get_json()
+        title = (data or {}).get('title', '').strip()
+        if not title:
+            return jsonify({'success': False, 'message': 'Missing album title'}), 400
+
+        album = Album(title=title, slug=slugify(title))
+        db.session.add(album)
+        db.session.commit()
+        logger.info(f"Created album: {album.slug}")
+        return jsonify({'success': True, 'album': album.to_dict()})
+    except Exception as e:
+        logger.error(f"Error creating album: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/albums/<slug>')
+def album_page(slug):
+    # Keyset pagination over the (album_id, position) index: each page is a
+    # single range scan regardless of how deep into the album it starts.
+    album = Album.query.filter_by(slug=slug).first()
+    if not album:
+        return jsonify({'success': False, 'message': 'Album not found'}), 404
+
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    after = request.args.get('after')
+
+    query = AlbumImage.query.filter_by(album_id=album.id)
+    if after:
+        query = query.filter(AlbumImage.position > after)
+    items = query.order_by(AlbumImage.position).limit(limit + 1).all()
+
+    has_more = len(items) > limit
+    items = items[:limit]
+    return jsonify({
+        'success': True,
+        'album': album.to_dict(),
+        'images': [item.to_dict() for item in items],
+        'next': items[-1].position if has_more else None
+    })
+
+@bp.route('/albums/<int:album_id>/images', methods=['POST'])
+@login_required
+def add_album_images(album_id):
+    try:
+        album = db.session.get(Album, album_id)
+        if not album:
+            return jsonify({'success': False, 'message': 'Album not found'}), 404
+
+        data = request.get_json()
+        if not data or not data.get('filenames'):
+            return jsonify({'success': False, 'message': 'No filenames provided'}), 400
+
+        existing = {item.filename for item in album.items}
+        filenames = []
+        for filename in data['filenames']:
+            if filename in existing or filename in filenames:
+                continue
+            if not allowed_file(filename) or not get_storage().exists(filename):
+                return jsonify({'success': False, 'message': f'Image not found: {filename}'}), 404
+            filenames.append(filename)
+
+        # Append after the current last item
+        last = album.items.order_by(AlbumImage.position.desc()).first()
+        positions = keys_between(last.position if last else None, None, len(filenames))
+        added = [AlbumImage(album_id=album.id, filename=filename, position=position)
+                 for filename, position in zip(filenames, positions)]
+        db.session.add_all(added)
+        db.session.commit()
+
+        logger.info(f"Added {len(added)} images to album: {album.slug}")
+        return jsonify({'success': True, 'images': [item.to_dict() for item in added]})
+    except IntegrityError:
+        # Another request added to the album at the same time
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Album changed, reload the album'}), 409
+    except Exception as e:
+        logger.error(f"Error adding images to album: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/albums/<int:album_id>/reorder', methods=['POST'])
+@login_required
+def reorder_album_image(album_id):
+    """Move one album image between two neighbours.
+
+    Expects ``{"item_id": ..., "prev_id": ..., "next_id": ...}`` where the
+    neighbour ids may be null at either end of the album. Only the moved
+    row is updated.
+    """
+    try:
+        data = request.get_json()
+        if not data or 'item_id' not in data:
+            return jsonify({'success': False, 'message': 'No item provided'}), 400
+
+        def load_item(item_id):
+            if item_id is None:
+                return None
+            item = db.session.get(AlbumImage, item_id)
+            if not item or item.album_id != album_id:
+                raise LookupError(item_id)
+            return item
+
+        try:
+            item = load_item(data['item_id'])
+            prev_item = load_item(data.get('prev_id'))
+            next_item = load_item(data.get('next_id'))
+        except LookupError as e:
+            return jsonify({'success': False, 'message': f'Album image not found: {e}'}), 404
+
+        prev_position = prev_item.position if prev_item else None
+        next_position = next_item.position if next_item else None
+        stale = jsonify({'success': False, 'message': 'Invalid neighbours, reload the album'}), 409
+        if item in (prev_item, next_item) or (
+                prev_position is not None and next_position is not None
+                and prev_position >= next_position):
+            # The client's view of the album is stale
+            return stale
+        # ...as it is if another image has been moved in between since
+        between = AlbumImage.query.filter(AlbumImage.album_id == album_id, AlbumImage.id != item.id)
+        if prev_position is not None:
+            between = between.filter(AlbumImage.position > prev_position)
+        if next_position is not None:
+            between = between.filter(AlbumImage.position < next_position)
+        if between.first() is not None:
+            return stale
+
+        item.position = key_between(prev_position, next_position)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent move took the same key
+            db.session.rollback()
+            return stale
+
+        logger.info(f"Moved album image {item.id} to position {item.position}")
+        return jsonify({'success': True, 'image': item.to_dict()})
+    except Exception as e:
+        logger.error(f"Error reordering album: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/albums/<int:album_id>/remove', methods=['POST'])
+@login_required
+def remove_album_image(album_id):
+    try:
+        data = request.get_json()
+        if not data or 'item_id' not in data:
+            return jsonify({'success': False, 'message': 'No item provided'}), 400
+
+        item = db.session.get(AlbumImage, data['item_id'])
+        if not item or item.album_id != album_id:
+            return jsonify({'success': False, 'message': 'Album image not found'}), 404
+
+        db.session.delete(item)
+        db.session.commit()
+        return jsonify({'success': True, 'message': 'Image removed from album'})
+    except Exception as e:
+        logger.error(f"Error removing album image: {str(e)}")
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route('/debug-login')
 def debug_login():
     try:
         logger.info("Debug: Attempting to render login template")
@@ -353,82 +1061,133 @@ def debug_login():
         logger.error(f"Debug: Error rendering login template: {str(e)}", exc_info=True)
         return f"Error: {str(e)}", 500
 
-@app.route('/debug-templates')
+@bp.route('/debug-templates')
 def debug_templates():
     try:
-        template_list = app.jinja_loader.list_templates()
+        template_list = current_app.jinja_loader.list_templates()
         return jsonify({
             'templates': list(template_list),
-            'template_folder': app.template_folder
+            'template_folder': current_app.template_folder
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/debug-db')
+@bp.route('/debug-db')
 def debug_db():
     try:
         user_count = User.query.count()
         admin_user = User.query.filter_by(username='admin').first()
         return jsonify({
-            'database_uri': app.config['SQLALCHEMY_DATABASE_URI'],
+            'database_uri': current_app.config['SQLALCHEMY_DATABASE_URI'],
             'user_count': user_count,
             'admin_exists': admin_user is not None
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/get-images')
+@bp.route('/get-images')
 @login_required
 def get_images():
     try:
-        images = []
-        if os.path.exists(app.config['UPLOAD_FOLDER']):
-            for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-                if allowed_file(filename):
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    if os.path.isfile(file_path):
-                        images.append({
-                            'filename': filename,
-                            'url': f'/static/uploads/{filename}'
-                        })
-        logger.info(f"Found {len(images)} images in the uploads folder")
+        images = [image_entry(filename) for filename in list_images()]
+        logger.info(f"Found {len(images)} images in storage")
         return jsonify({'images': images, 'success': True})
     except Exception as e:
         logger.error(f"Error loading images: {str(e)}")
         return jsonify({'error': str(e), 'success': False}), 500
 
-@app.route('/test-static')
+@bp.route('/reconcile-status')
+@login_required
+def reconcile_status():
+    # Drift found by the most recent reconciler pass, if any
+    return jsonify({'success': True, 'report': get_reconciler().last_report})
+
+@bp.route('/test-static')
 def test_static():
     try:
-        # Test if we can list files in the uploads directory
-        upload_path = app.config['UPLOAD_FOLDER']
-        if os.path.exists(upload_path):
-            files = os.listdir(upload_path)
-            urls = [url_for('static', filename=f'uploads/{f}') for f in files if allowed_file(f)]
-            return jsonify({
-                'status': 'success',
-                'upload_path': upload_path,
-                'files': files,
-                'urls': urls
-            })
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': f'Upload path does not exist: {upload_path}'
-            })
+        # Test if we can list files in storage
+        storage = get_storage()
+        files = storage.list()
+        urls = [storage.url(f) for f in files if allowed_file(f)]
+        return jsonify({
+            'status': 'success',
+            'upload_path': current_app.config['UPLOAD_FOLDER'],
+            'storage_backend': current_app.config['STORAGE_BACKEND'],
+            'files': files,
+            'urls': urls
+        })
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': str(e)
         })
 
-@app.before_request
+@bp.route('/sw.js')
+def service_worker():
+    # Served from the root so that the worker's scope covers the whole site
+    response = send_from_directory(os.path.join(current_app.static_folder, 'js'), 'sw.js', max_age=0)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def send_stored(storage, name):
+    path = storage.path(name)
+    if path is not None:
+        return send_from_directory(os.path.dirname(path), os.path.basename(path))
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    return current_app.response_class(storage.stream(name), mimetype=mimetype)
+
+@bp.route('/static/uploads/<path:filename>')
+def uploaded_file(filename):
+    # Takes precedence over the generic static route so uploads are always
+    # served from the configured storage, wherever it lives.
+    storage = get_storage()
+    if not allowed_file(filename):
+        return render_template('error.html', error='Page not found'), 404
+    try:
+        if storage.path(filename) is None and not storage.exists(filename):
+            return render_template('error.html', error='Page not found'), 404
+        return send_stored(storage, filename)
+    except StorageError:
+        return render_template('error.html', error='Page not found'), 404
+
+@bp.route('/thumbnails/<path:filename>')
+def thumbnail(filename):
+    storage = get_storage()
+    if not allowed_file(filename):
+        return render_template('error.html', error='Page not found'), 404
+    try:
+        name, _ = ensure_derivative(storage, filename, 'thumb')
+        return send_stored(storage, name)
+    except (StorageError, FileNotFoundError):
+        return render_template('error.html', error='Page not found'), 404
+
+@bp.route('/tiles/<path:filename>')
+def tile(filename):
+    # Square gallery tile, cropped around the subject (see smart_crop.py)
+    storage = get_storage()
+    if not allowed_file(filename):
+        return render_template('error.html', error='Page not found'), 404
+    try:
+        name, _ = ensure_derivative(storage, filename, 'tile', tile_crop_box(storage, filename))
+        return send_stored(storage, name)
+    except (StorageError, FileNotFoundError):
+        return render_template('error.html', error='Page not found'), 404
+
+@bp.before_app_request
 def log_request_info():
     logger.info(f"Request URL: {request.url}")
     logger.info(f"Request Headers: {dict(request.headers)}")
     logger.info(f"Request Method: {request.method}")
 
-@app.after_request
+@bp.before_app_request
+def start_background_tasks():
+    # Started on the first request of each process, so a pre-forking server
+    # gets its threads in the worker rather than the parent
+    if current_app.config['BACKGROUND_TASKS']:
+        get_outbox().start()
+        get_reconciler().start()
+
+@bp.after_app_request
 def add_header(response):
     try:
         logger.info(f"Response Status: {response.status_code}")
@@ -437,59 +1196,144 @@ def add_header(response):
         # Add MIME types for images
         if response.headers.get('Content-Type', '').startswith('image/'):
             logger.info("Setting cache headers for image response")
-            response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
-            response.headers['Pragma'] = 'no-cache'
-            response.headers['Expires'] = '-1'
+            if request.args.get('v'):
+                # Versioned gallery URLs never change content
+                response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+            else:
+                response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
+                response.headers['Pragma'] = 'no-cache'
+                response.headers['Expires'] = '-1'
         return response
     except Exception as e:
         logger.error(f"Error in add_header: {str(e)}", exc_info=True)
         raise
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found_error(error):
     return render_template('error.html', error='Page not found'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
     return render_template('error.html', error='Internal server error'), 500
 
-@app.errorhandler(Exception)
+@bp.app_errorhandler(Exception)
 def handle_exception(e):
     logger.error(f"Unhandled exception: {str(e)}", exc_info=True)
     db.session.rollback()
     return render_template('error.html', error='An unexpected error occurred'), 500
 
-@app.route('/health-check')
+@bp.route('/health-check')
 def health_check():
     return jsonify({'status': 'ok'})
 
+@click.command('export')
+@with_appcontext
+@click.option('--output', '-o', default=None, help='Directory to write the static site to.')
+@click.option('--per-page', default=None, type=int, help='Images per gallery JSON page.')
+def export_command(output, per_page):
+    """Export the public gallery as a static site."""
+    from export import export_site
+    stats = export_site(current_app._get_current_object(), output or current_app.config['EXPORT_FOLDER'],
+                        per_page or current_app.config['GALLERY_PAGE_SIZE'])
+    click.echo(f"Exported to {stats['output']}: {stats['written']} written, "
+               f"{stats['unchanged']} unchanged, {stats['removed']} removed")
+
+@click.command('dispatch-outbox')
+@with_appcontext
+@click.option('--once', is_flag=True, help='Deliver one batch and exit.')
+def dispatch_outbox_command(once):
+    """Deliver queued contact messages."""
+    outbox = get_outbox()
+    if once:
+        click.echo(f"Attempted {outbox.dispatch_once()} messages")
+        return
+    try:
+        outbox.run()
+    except KeyboardInterrupt:
+        pass
+
+@click.command('reconcile')
+@with_appcontext
+@click.option('--watch', is_flag=True, help='Keep reconciling every RECONCILE_INTERVAL seconds.')
+def reconcile_command(watch):
+    """Reconcile storage with the image catalog and report drift."""
+    reconciler = get_reconciler()
+    if watch:
+        try:
+            reconciler.run()
+        except KeyboardInterrupt:
+            pass
+        return
+    report = reconciler.reconcile_once()
+    for key, value in report.items():
+        click.echo(f"{key}: {value}")
+
+@click.command('precompile-templates')
+@with_appcontext
+def precompile_templates_command():
+    """Compile every template into the bytecode cache."""
+    for name in current_app.jinja_env.list_templates():
+        current_app.jinja_env.get_template(name)
+    click.echo(f"Compiled templates into {current_app.config['TEMPLATE_CACHE_FOLDER']}")
+
+@click.command('optimize-library')
+@with_appcontext
+@click.option('--workers', '-j', default=None, type=int, help='Encoder processes (default: one per CPU).')
+@click.option('--checkpoint', default=None, help='Progress file used to resume an interrupted run.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint and process every file again.')
+def optimize_library_command(workers, checkpoint, restart):
+    """Recompress originals and derivatives, keeping smaller results."""
+    from optimize import optimize_library
+    checkpoint = checkpoint or current_app.config['OPTIMIZE_CHECKPOINT']
+    policy = {
+        'quality_min': current_app.config['OPTIMIZE_QUALITY_MIN'],
+        'quality_max': current_app.config['OPTIMIZE_QUALITY_MAX'],
+        'min_score': current_app.config['OPTIMIZE_MIN_SCORE']
+    }
+    try:
+        stats = optimize_library(checkpoint, workers or current_app.config['OPTIMIZE_WORKERS'],
+                                 policy, restart)
+    except KeyboardInterrupt:
+        click.echo(f"Interrupted; progress saved to {checkpoint}, run again to resume")
+        return
+    click.echo(f"Optimized {stats['optimized']} of {stats['files']} files "
+               f"({stats['unchanged']} unchanged, {stats['failed']} failed): "
+               f"{stats['bytes_saved']} bytes saved")
+
+@click.command('index-colors')
+@with_appcontext
+def index_colors_command():
+    """Compute colour palettes for catalogued images that lack one."""
+    from PIL import Image
+    from palette import extract_palette
+    storage = get_storage()
+    indexed = 0
+    for photo in Photo.query.filter(Photo.palette.is_(None)).order_by(Photo.filename).all():
+        try:
+            with Image.open(BytesIO(storage.read(photo.filename))) as img:
+                photo.palette = extract_palette(img)
+        except (StorageError, OSError) as e:
+            logger.warning(f"Could not index colors of {photo.filename}: {str(e)}")
+            continue
+        indexed += 1
+        if indexed % 50 == 0:
+            db.session.commit()
+    db.session.commit()
+    click.echo(f"Indexed colors of {indexed} images")
+
 if __name__ == '__main__':
-    # Create error.html template if it doesn't exist
-    error_template_path = os.path.join(app.template_folder, 'error.html')
-    if not os.path.exists(error_template_path):
-        with open(error_template_path, 'w') as f:
-            f.write('''
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Error</title>
-    <link rel="stylesheet" href="{{ url_for('static', filename='css/style.css') }}">
-</head>
-<body>
-    <div class="error-container">
-        <h1>Error</h1>
-        <p>{{ error }}</p>
-        <a href="{{ url_for('index') }}" class="btn">Return to Home</a>
-    </div>
-</body>
-</html>
-            ''')
+    app = create_app()
 
     # Create database if it doesn't exist
     with app.app_context():
         db.create_all()
         create_admin_user()
+
+        # Deliver contact messages and reconcile storage in the background (only in the reloader child)
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            get_outbox().start()
+            get_reconciler().start()
     
     # Run the application
     app.run(
@@ -0,0 +1,240 @@
+"""ASGI serving mode.
+
+    pip install uvicorn
+    uvicorn asgi:app --workers 2
+
+Serves the same Flask app, but every byte sent to or received from a
+client moves on the event loop, so a slow client costs a coroutine
+rather than a worker thread:
+
+- the request body is read asynchronously and spooled (in memory, then
+  to a temporary file) before the app sees it, so a slow upload holds no
+  thread while it trickles in,
+- the app then runs on a bounded thread pool with the complete request,
+  exactly as under WSGI, so Flask-Login sessions, CSRF checks and every
+  view behave the same,
+- the response is sent asynchronously; files (image delivery) are read
+  a chunk at a time on the pool, so a slow download holds no thread
+  between chunks.
+
+Only the time spent in Python (a gallery listing, decoding an upload)
+and in short disk reads and writes occupies a thread.
+"""
+
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from tempfile import SpooledTemporaryFile
+
+CHUNK_SIZE = 64 * 1024
+# Request bodies above this are spooled to disk
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+
+class FileWrapper:
+    """``wsgi.file_wrapper``: lets the bridge read the file itself, off the loop."""
+
+    def __init__(self, file, block_size=CHUNK_SIZE):
+        self.file = file
+        self.block_size = block_size
+
+    def __iter__(self):
+        while True:
+            chunk = self.file.read(self.block_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+
+def _latin1(value):
+    return value.encode('utf-8').decode('latin-1')
+
+
+def build_environ(scope, body):
+    """Return the WSGI environ for an ASGI HTTP ``scope`` and a spooled ``body``."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': _latin1(scope.get('root_path', '')),
+        'PATH_INFO': _latin1(scope['path']),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': FileWrapper
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+        environ['REMOTE_PORT'] = str(scope['client'][1])
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        if name in environ:
+            value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+        environ[name] = value
+    return environ
+
+
+class AsgiBridge:
+    def __init__(self, wsgi_app, max_threads=8, max_body_size=None):
+        self.wsgi_app = wsgi_app
+        self.max_body_size = max_body_size
+        self.executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='asgi')
+
+    def _run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _send_plain(self, send, status, text):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+        await send({'type': 'http.response.body', 'body': text.encode('utf-8')})
+
+    async def _read_body(self, receive):
+        """Spool the request body; return ``None`` if the client left.
+
+        Raises OverflowError past ``max_body_size``.
+        """
+        body = SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if self.max_body_size is not None and size > self.max_body_size:
+                body.close()
+                raise OverflowError
+            if chunk:
+                await self._run(body.write, chunk)
+            if not message.get('more_body', False):
+                break
+        body.seek(0)
+        return body
+
+    def _early_hints(self, scope, send, loop):
+        # Lets send_early_hints() reach servers that support 103 responses
+        if 'http.response.early_hint' not in scope.get('extensions', {}):
+            return None
+
+        def early_hints(headers):
+            links = [value.encode('latin-1') for name, value in headers if name.lower() == 'link']
+            message = {'type': 'http.response.early_hint', 'links': links}
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+        return early_hints
+
+    async def _http(self, scope, receive, send):
+        headers = dict(scope.get('headers', []))
+        declared = headers.get(b'content-length')
+        try:
+            if self.max_body_size is not None and declared and int(declared) > self.max_body_size:
+                raise OverflowError
+            body = await self._read_body(receive)
+        except OverflowError:
+            await self._send_plain(send, 413, 'Request Entity Too Large')
+            return
+        except ValueError:
+            await self._send_plain(send, 400, 'Bad Request')
+            return
+        if body is None:
+            return
+
+        environ = build_environ(scope, body)
+        early_hints = self._early_hints(scope, send, asyncio.get_running_loop())
+        if early_hints is not None:
+            environ['wsgi.early_hints'] = early_hints
+
+        response = {}
+        written = []
+
+        def start_response(status, response_headers, exc_info=None):
+            if exc_info and response.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in response_headers]
+            return written.append
+
+        try:
+            iterable = await self._run(self.wsgi_app, environ, start_response)
+            try:
+                await self._send_response(send, response, written, iterable)
+            finally:
+                if hasattr(iterable, 'close'):
+                    await self._run(iterable.close)
+        finally:
+            await self._run(body.close)
+
+    async def _send_response(self, send, response, written, iterable):
+        if isinstance(iterable, FileWrapper):
+            file, block_size = iterable.file, iterable.block_size
+            read = lambda: file.read(block_size) or None
+        else:
+            read = partial(next, iter(iterable), None)
+
+        finished = False
+        if 'status' not in response:
+            # start_response may be called as late as the first chunk
+            first = await self._run(read)
+            finished = first is None
+            written.append(first or b'')
+        response['sent'] = True
+        await send({'type': 'http.response.start', 'status': response['status'],
+                    'headers': response['headers']})
+
+        for chunk in written:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        while not finished:
+            chunk = await self._run(read)
+            if chunk is None:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+def create_asgi_app(test_config=None):
+    from app import create_app
+    flask_app = create_app(test_config)
+    return AsgiBridge(flask_app, max_threads=flask_app.config['ASGI_THREADS'],
+                      max_body_size=flask_app.config['MAX_CONTENT_LENGTH'])
+
+
+def __getattr__(name):
+    # ``uvicorn asgi:app``; built on first access, like app.app
+    if name == 'app':
+        globals()['app'] = create_asgi_app()
+        return globals()['app']
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,193 @@
+"""Slow-client concurrency benchmark: threaded WSGI against the ASGI bridge.
+
+Serves the app from a child process, either from a WSGI server with a
+fixed pool of ``--threads`` threads (like a gthread worker) or from
+uvicorn through asgi.AsgiBridge with the same number of threads. Then
+``--clients`` connections each download a large image at ``--rate``
+bytes per second, like phones on a poor connection, and while they are
+connected the benchmark measures:
+
+- how many slow clients got their response headers within ``--deadline``
+  seconds (the connection capacity),
+- the latency of ordinary /gallery requests made meanwhile.
+
+    pip install uvicorn
+    python benchmarks/concurrency.py --clients 64 --threads 8
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import logging, sys
+from concurrent.futures import ThreadPoolExecutor
+logging.disable(logging.CRITICAL)
+mode, port, threads, folder = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), sys.argv[4]
+from app import create_app, db
+app = create_app({"UPLOAD_FOLDER": folder, "TESTING": True,
+                  "SQLALCHEMY_DATABASE_URI": "sqlite:///" + folder + "/bench.db"})
+with app.app_context():
+    db.create_all()
+
+if mode == "threaded":
+    from werkzeug.serving import BaseWSGIServer
+
+    class PooledWSGIServer(BaseWSGIServer):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self.process_in_pool, request, client_address)
+
+        def process_in_pool(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    PooledWSGIServer("127.0.0.1", port, app).serve_forever()
+else:
+    import uvicorn
+    from asgi import AsgiBridge
+    uvicorn.run(AsgiBridge(app, max_threads=threads), host="127.0.0.1", port=port, log_level="error")
+'''
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, threads, folder):
+    port = free_port()
+    process = subprocess.Popen([sys.executable, '-c', CHILD, mode, str(port), str(threads), folder],
+                               cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{mode} server exited: {process.stderr.read().decode()}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+async def open_slow_connection(port):
+    sock = socket.socket()
+    # A small receive window, so the server can't hand the whole file to the kernel
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', port))
+    return await asyncio.open_connection(sock=sock, limit=4096)
+
+
+async def slow_client(port, path, rate, deadline, served, stop):
+    try:
+        reader, writer = await open_slow_connection(port)
+    except OSError:
+        return
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        try:
+            await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), deadline)
+            served.append(1)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, OSError):
+            return
+        while not stop.is_set():
+            chunk = await reader.read(4096)
+            if not chunk:
+                break
+            await asyncio.sleep(len(chunk) / rate)
+    finally:
+        writer.close()
+
+
+async def timed_get(port, path, timeout):
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'.encode())
+        await asyncio.wait_for(reader.read(), timeout - (time.perf_counter() - start))
+        writer.close()
+        return (time.perf_counter() - start) * 1000
+    except (asyncio.TimeoutError, OSError):
+        return None
+
+
+async def measure(port, args):
+    served = []
+    stop = asyncio.Event()
+    clients = [asyncio.create_task(slow_client(port, '/static/uploads/large.jpg', args.rate,
+                                               args.deadline, served, stop))
+               for _ in range(args.clients)]
+    await asyncio.sleep(0.5)
+
+    latencies = []
+    for _ in range(args.probes):
+        latencies.append(await timed_get(port, '/gallery?page=1', args.deadline))
+    await asyncio.sleep(max(0.0, args.deadline - 0.5))
+
+    stop.set()
+    for client in clients:
+        client.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+    return len(served), latencies
+
+
+def report(mode, served, latencies, args):
+    ok = sorted(value for value in latencies if value is not None)
+    print(f'{mode}:')
+    print(f'  slow clients with headers within {args.deadline:g}s: {served}/{args.clients}')
+    if ok:
+        p95 = ok[min(len(ok) - 1, int(len(ok) * 0.95))]
+        print(f'  /gallery latency   median {statistics.median(ok):8.1f} ms  p95 {p95:8.1f} ms')
+    print(f'  /gallery timeouts  {len(latencies) - len(ok)}/{len(latencies)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--rate', type=int, default=64 * 1024, help='Bytes per second per slow client.')
+    parser.add_argument('--size', type=int, default=8 * 1024 * 1024, help='Bytes in the downloaded image.')
+    parser.add_argument('--deadline', type=float, default=5.0)
+    parser.add_argument('--probes', type=int, default=20)
+    parser.add_argument('--modes', nargs='+', default=['threaded', 'asgi'], choices=['threaded', 'asgi'])
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(folder, 'large.jpg'), 'wb') as f:
+            f.write(os.urandom(args.size))
+        for mode in args.modes:
+            process, port = start_server(mode, args.threads, folder)
+            try:
+                served, latencies = asyncio.run(measure(port, args))
+            finally:
+                process.terminate()
+                process.wait()
+            report(mode, served, latencies, args)
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Worker start-up benchmark.
+
+Measures, in a fresh interpreter per run, how long it takes to import the
+app module, build the app with create_app(), and serve the first request.
+Each run uses its own copy of the Jinja bytecode cache directory, so the
+first run of a pair starts cold and the second one starts warm.
+
+    python benchmarks/startup.py --runs 10 --path /
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import app as module
+imported = time.perf_counter()
+app = module.create_app({"TEMPLATE_CACHE_FOLDER": sys.argv[1], "TESTING": True})
+created = time.perf_counter()
+with app.test_client() as client:
+    response = client.get(sys.argv[2])
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000,
+    "total_ms": (served - start) * 1000,
+    "status": response.status_code,
+    "pillow_loaded": "PIL" in sys.modules,
+}))
+'''
+
+
+def run_once(cache_dir, path):
+    result = subprocess.run([sys.executable, '-c', CHILD, cache_dir, path], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(label, samples):
+    print(f'{label}:')
+    for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'total_ms'):
+        values = [sample[key] for sample in samples]
+        print(f'  {key:<18} median {statistics.median(values):8.1f}  min {min(values):8.1f}')
+    print(f'  pillow loaded      {any(sample["pillow_loaded"] for sample in samples)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/')
+    args = parser.parse_args()
+
+    cold, warm = [], []
+    for _ in range(args.runs):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cold.append(run_once(cache_dir, args.path))
+            warm.append(run_once(cache_dir, args.path))
+        finally:
+            shutil.rmtree(cache_dir)
+
+    summarize(f'Cold template cache, GET {args.path}', cold)
+    summarize(f'Warm template cache, GET {args.path}', warm)
+
+
+if __name__ == '__main__':
+    main()
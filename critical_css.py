@@ -0,0 +1,140 @@
+"""Critical CSS for server-rendered pages.
+
+The critical subset of a stylesheet is the rules that can apply to the
+markup above the fold, so the browser can paint the first screen from
+CSS inlined in the page while the full stylesheet loads asynchronously.
+
+The fold is marked in a template with ``{# critical-css: fold #}``;
+everything before it is scanned for tag names, classes and ids. A rule
+is kept when one of its selectors only uses those (ignoring
+``:hover``-style interaction states), ``@media`` blocks are filtered
+recursively and ``@keyframes`` are kept when a kept rule uses them.
+Results are cached until the template or the stylesheet changes.
+"""
+
+import os
+import posixpath
+import re
+import threading
+
+FOLD_MARKER = '{# critical-css: fold #}'
+
+_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_URL = re.compile(r'''url\(\s*(['"]?)(?!data:|https?:|/|#)([^'")]+)\1\s*\)''')
+_INTERACTIVE = re.compile(r':(hover|focus|focus-within|focus-visible|active|visited|checked|disabled)\b')
+_PSEUDO = re.compile(r'::?[\w-]+(\([^)]*\))?')
+_ATTRIBUTE = re.compile(r'\[[^\]]*\]')
+
+
+def _parse(css):
+    """Split CSS into ``(prelude, body)`` pairs and bare ``@import``-style statements."""
+    items = []
+    pos = 0
+    while True:
+        start = css.find('{', pos)
+        if start == -1:
+            break
+        prelude = css[pos:start]
+        if ';' in prelude:
+            statements, prelude = prelude.rsplit(';', 1)
+            items.extend((statement.strip() + ';', None)
+                         for statement in statements.split(';') if statement.strip())
+        depth = 1
+        end = start + 1
+        while depth and end < len(css):
+            if css[end] == '{':
+                depth += 1
+            elif css[end] == '}':
+                depth -= 1
+            end += 1
+        items.append((prelude.strip(), css[start + 1:end - 1]))
+        pos = end
+    return items
+
+
+def _minify(css):
+    css = re.sub(r'\s+', ' ', css)
+    return re.sub(r'\s*([{};])\s*', r'\1', css).strip()
+
+
+def fold_tokens(html):
+    """Return the tag names, classes and ids used in ``html``."""
+    tags = {tag.lower() for tag in re.findall(r'<([a-zA-Z][\w-]*)', html)} | {'html', 'body'}
+    classes = {name for value in re.findall(r'class="([^"]*)"', html) for name in value.split()}
+    ids = set(re.findall(r'id="([^"{]*)"', html))
+    return tags, classes, ids
+
+
+def _selector_matches(selector, tokens):
+    tags, classes, ids = tokens
+    if _INTERACTIVE.search(selector):
+        return False
+    selector = _ATTRIBUTE.sub('', _PSEUDO.sub('', selector))
+    for part in re.split(r'[\s>+~]+', selector.strip()):
+        tag = re.match(r'[a-zA-Z][\w-]*', part)
+        if tag and tag.group().lower() not in tags:
+            return False
+        if not classes.issuperset(re.findall(r'\.([\w-]+)', part)):
+            return False
+        if not ids.issuperset(re.findall(r'#([\w-]+)', part)):
+            return False
+    return True
+
+
+def _filter(items, tokens, keyframes):
+    kept = []
+    for prelude, body in items:
+        if body is None:
+            if prelude.startswith('@import'):
+                kept.append(prelude)
+        elif prelude.startswith('@keyframes'):
+            keyframes[prelude.split()[-1]] = f'{prelude}{{{body}}}'
+        elif prelude.startswith('@font-face'):
+            kept.append(f'{prelude}{{{body}}}')
+        elif prelude.startswith('@'):
+            inner = _filter(_parse(body), tokens, keyframes)
+            if inner:
+                kept.append(f'{prelude}{{{"".join(inner)}}}')
+        elif any(_selector_matches(selector, tokens) for selector in prelude.split(',')):
+            kept.append(f'{prelude}{{{body}}}')
+    return kept
+
+
+def extract_critical_css(css, html, stylesheet_url='/', extra_classes=()):
+    """Return the rules of ``css`` needed to render ``html``, minified."""
+    tags, classes, ids = fold_tokens(html)
+    tokens = (tags, classes | set(extra_classes), ids)
+    css = _COMMENT.sub('', css)
+    # The rules move into the page, so relative URLs must be resolved here
+    base = posixpath.dirname(stylesheet_url)
+    css = _URL.sub(lambda m: f"url('{posixpath.normpath(posixpath.join(base, m.group(2)))}')", css)
+
+    keyframes = {}
+    kept = _filter(_parse(css), tokens, keyframes)
+    used = ''.join(kept)
+    kept.extend(rule for name, rule in keyframes.items() if re.search(rf'\b{re.escape(name)}\b', used))
+    return _minify(''.join(kept))
+
+
+class CriticalCSS:
+    def __init__(self, stylesheet_path, stylesheet_url, extra_classes=()):
+        self.stylesheet_path = stylesheet_path
+        self.stylesheet_url = stylesheet_url
+        self.extra_classes = tuple(extra_classes)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def for_template(self, template_path):
+        """Return the critical CSS for a template, recomputing it only when an input changed."""
+        version = (os.stat(template_path).st_mtime_ns, os.stat(self.stylesheet_path).st_mtime_ns)
+        cached = self._cache.get(template_path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        with self._lock:
+            with open(template_path, encoding='utf-8') as f:
+                html = f.read().split(FOLD_MARKER, 1)[0]
+            with open(self.stylesheet_path, encoding='utf-8') as f:
+                css = extract_critical_css(f.read(), html, self.stylesheet_url, self.extra_classes)
+            self._cache[template_path] = (version, css)
+        return css
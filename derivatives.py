@@ -0,0 +1,109 @@
+"""Resized copies of uploaded images.
+
+Derivatives are stored next to the originals, in the same storage, under
+``derivatives/<kind>/<filename>``. Storage listings only return direct
+children, so they never show up as gallery images. A derivative is
+regenerated whenever its original has been modified since it was made,
+which keeps them correct after a rotate without any extra bookkeeping.
+
+Kinds listed in ``CROPPED`` are cut to the aspect ratio of their box
+first, around the most salient part of the image (see smart_crop.py),
+so gallery tiles neither waste pixels nor lose the subject.
+"""
+
+import logging
+import os
+from io import BytesIO
+
+from storage import StorageError
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_PREFIX = 'derivatives'
+
+# Bounding boxes; admin tiles are at most ~400 CSS px wide, gallery tiles
+# at most ~390 CSS px square
+SIZES = {
+    'thumb': (480, 480),
+    'tile': (600, 600)
+}
+
+# Kinds that fill their box exactly instead of fitting inside it
+CROPPED = {'tile'}
+
+# Renders of an original that keeps changing underneath, before giving up
+GENERATE_ATTEMPTS = 3
+
+
+def derivative_name(kind, filename):
+    return f'{DERIVATIVE_PREFIX}/{kind}/{filename}'
+
+
+def encode_image(img, filename, **options):
+    # Encode in the format implied by the filename, ready for storage.save()
+    from PIL import Image  # Imported on first use to keep worker start-up cheap
+    extension = os.path.splitext(filename)[1].lower()
+    image_format = Image.registered_extensions().get(extension, img.format)
+    buffer = BytesIO()
+    img.save(buffer, format=image_format, **options)
+    buffer.seek(0)
+    return buffer
+
+
+def crop_box_for(img, kind):
+    """Return the crop a ``CROPPED`` kind uses for ``img``."""
+    from smart_crop import find_crop  # NumPy is only needed when rendering
+    width, height = SIZES[kind]
+    return find_crop(img, width / height)
+
+
+def render(img, kind, filename, crop_box=None):
+    """Encode the ``kind`` derivative of an already decoded image."""
+    if kind in CROPPED:
+        copy = img.crop(crop_box or crop_box_for(img, kind))
+    else:
+        copy = img.copy()
+    copy.thumbnail(SIZES[kind])
+    return encode_image(copy, filename, optimize=True, quality=80)
+
+
+def save_derivatives(storage, img, filename, crop_box=None):
+    """Write every derivative of ``img``, e.g. right after an upload."""
+    for kind in SIZES:
+        storage.save(derivative_name(kind, filename), render(img, kind, filename, crop_box))
+
+
+def ensure_derivative(storage, filename, kind='thumb', crop_box=None):
+    """Return ``(name, mtime_ns)`` of an up-to-date derivative, generating it if needed.
+
+    ``crop_box`` is used by ``CROPPED`` kinds; when omitted it is computed.
+    """
+    name = derivative_name(kind, filename)
+    source = storage.stat(filename)
+    try:
+        mtime_ns = storage.stat(name)[1]
+        if mtime_ns >= source[1]:
+            return name, mtime_ns
+    except FileNotFoundError:
+        pass
+
+    from PIL import Image
+    for _ in range(GENERATE_ATTEMPTS):
+        logger.info(f"Generating {kind} for {filename}")
+        with Image.open(BytesIO(storage.read(filename))) as img:
+            storage.save(name, render(img, kind, filename, crop_box))
+        # The original may have been rewritten (e.g. rotated) while this copy
+        # was rendered from the old one; being written later, the stale copy
+        # would otherwise pass the mtime check for good
+        current = storage.stat(filename)
+        if current == source:
+            return name, storage.stat(name)[1]
+        source, crop_box = current, None
+
+    storage.delete(name)
+    raise StorageError(f"{filename} kept changing while its {kind} was generated")
+
+
+def delete_derivatives(storage, filenames):
+    return storage.delete_many([derivative_name(kind, filename)
+                                for filename in filenames for kind in SIZES])
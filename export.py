@@ -0,0 +1,180 @@
+"""Incremental static export of the public gallery.
+
+The exported tree mirrors the URLs the Flask app serves, so it can be
+put behind any static file server or CDN:
+
+    index.html
+    sw.js                        # service worker, same as GET /sw.js
+    gallery.json                 # unpaginated list, same as GET /gallery
+    gallery/page-<n>.json        # same as GET /gallery?page=<n>
+    static/...                   # css, js, images and uploads
+    tiles/<filename>             # cropped gallery tiles, same as GET /tiles/...
+
+Every output is recorded in ``.export-manifest.json`` together with a
+fingerprint of its inputs. On re-runs only outputs whose fingerprint
+changed (an upload, rotate or delete) are rebuilt, and outputs whose
+inputs disappeared are removed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = '.export-manifest.json'
+MANIFEST_VERSION = 1
+
+
+def _file_fingerprint(path):
+    stat = os.stat(path)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def _digest(*parts):
+    sha = hashlib.sha256()
+    for part in parts:
+        sha.update(str(part).encode('utf-8'))
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+def _load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest['outputs']
+    except (OSError, ValueError, KeyError):
+        pass
+    return {}
+
+
+def _save_manifest(output_dir, outputs):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'outputs': outputs}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _write_bytes(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _copy_file(source):
+    def build(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copy2(source, path)
+    return build
+
+
+def _copy_stored(storage, name):
+    def build(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            for chunk in storage.stream(name):
+                f.write(chunk)
+    return build
+
+
+def _render(client, url):
+    def build(path):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f'Export of {url} failed with status {response.status_code}')
+        _write_bytes(path, response.data)
+    return build
+
+
+def _walk_files(root, skip=()):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames
+                             if os.path.join(dirpath, d) not in skip)
+        for filename in sorted(filenames):
+            yield os.path.join(dirpath, filename)
+
+
+def plan_outputs(app, client, per_page):
+    """Return ``{relative_path: (fingerprint, builder)}`` for the whole site."""
+    from app import get_storage, scan_images
+
+    outputs = {}
+    static_folder = app.static_folder
+
+    # Static assets, excluding the upload folder which is handled below
+    uploads_in_static = os.path.join(static_folder, 'uploads')
+    for source in _walk_files(static_folder, skip={uploads_in_static, app.config['UPLOAD_FOLDER']}):
+        rel = os.path.join('static', os.path.relpath(source, static_folder))
+        outputs[rel] = (_file_fingerprint(source), _copy_file(source))
+
+    # Uploaded images, in the same order the gallery endpoint uses
+    storage = get_storage()
+    images = []
+    for filename, size, mtime_ns in scan_images():
+        fingerprint = f'{size}:{mtime_ns}'
+        images.append((filename, fingerprint))
+        outputs[os.path.join('static', 'uploads', filename)] = (fingerprint, _copy_stored(storage, filename))
+        outputs[os.path.join('tiles', filename)] = (fingerprint, _render(client, f'/tiles/{filename}'))
+
+    # Pages only depend on the image listing and their template (plus the
+    # stylesheet, whose critical rules are inlined into the landing page)
+    listing = _digest(*(f'{name}={fp}' for name, fp in images))
+    template = os.path.join(app.root_path, app.template_folder, 'index.html')
+    stylesheet = os.path.join(app.static_folder, 'css', 'style.css')
+    outputs['index.html'] = (_digest(listing, per_page, _file_fingerprint(template), _file_fingerprint(stylesheet)),
+                             _render(client, '/'))
+    outputs['gallery.json'] = (listing, _render(client, '/gallery'))
+    # The service worker must be served from the root to control the whole site
+    outputs['sw.js'] = (outputs[os.path.join('static', 'js', 'sw.js')][0], _render(client, '/sw.js'))
+
+    pages = max(1, -(-len(images) // per_page))
+    for page in range(1, pages + 1):
+        # A page is rebuilt only when its own slice (or the page count) changes
+        chunk = images[(page - 1) * per_page:page * per_page]
+        fingerprint = _digest(pages, len(images), per_page, *(f'{name}={fp}' for name, fp in chunk))
+        outputs[os.path.join('gallery', f'page-{page}.json')] = (
+            fingerprint, _render(client, f'/gallery?page={page}&per_page={per_page}'))
+
+    return outputs
+
+
+def export_site(app, output_dir, per_page):
+    """Export the public site to ``output_dir``, rebuilding only what changed."""
+    output_dir = os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    previous = _load_manifest(output_dir)
+
+    stats = {'output': output_dir, 'written': 0, 'unchanged': 0, 'removed': 0}
+    current = {}
+    # Point the client-side gallery at the pre-rendered page files
+    saved_config = {key: app.config.get(key) for key in ('GALLERY_PAGE_URL', 'GALLERY_PAGE_SIZE')}
+    app.config.update(GALLERY_PAGE_URL='/gallery/page-{page}.json', GALLERY_PAGE_SIZE=per_page)
+    try:
+        with app.test_client() as client:
+            for rel, (fingerprint, build) in plan_outputs(app, client, per_page).items():
+                path = os.path.join(output_dir, rel)
+                if previous.get(rel) == fingerprint and os.path.exists(path):
+                    stats['unchanged'] += 1
+                else:
+                    logger.info(f"Exporting {rel}")
+                    build(path)
+                    stats['written'] += 1
+                current[rel] = fingerprint
+    finally:
+        app.config.update(saved_config)
+
+    for rel in sorted(set(previous) - set(current)):
+        path = os.path.join(output_dir, rel)
+        if os.path.exists(path):
+            logger.info(f"Removing stale export {rel}")
+            os.remove(path)
+        stats['removed'] += 1
+
+    _save_manifest(output_dir, current)
+    return stats
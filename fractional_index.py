@@ -0,0 +1,191 @@
+"""Fractional (lexicographic) position keys for user-ordered lists.
+
+Keys compare as plain strings, so ``ORDER BY position`` on a regular
+indexed column returns the curated order, and moving an item only needs
+a new key between its two new neighbours -- no other row is rewritten.
+
+A key is a variable-length integer followed by an optional fraction:
+
+- the integer is a head character giving its digit count, then that
+  many base-36 digits. Heads ``i``-``z`` hold 1-18 digits and count up
+  from ``i0`` (zero); heads ``h``-``0`` hold 1-18 digits and count down,
+  so ``hz`` sorts just below ``i0``.
+- the fraction is base-36 digits that never end in ``0``.
+
+Appending or prepending steps the integer, so a key only grows by a
+digit every time the list grows by a power of 36; the fraction is only
+used to insert between two neighbours.
+
+Only ``0-9a-z`` is used so that the ordering is the same under SQLite's
+binary collation and under the usual case-insensitive collations of
+other databases.
+"""
+
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+BASE = len(DIGITS)
+
+# Heads at or above this index count up from zero; heads below count down
+_ZERO_HEAD = BASE // 2
+INTEGER_ZERO = DIGITS[_ZERO_HEAD] + DIGITS[0]
+SMALLEST_INTEGER = DIGITS[0] * (_ZERO_HEAD + 1)
+
+
+def _digit(char):
+    index = DIGITS.find(char)
+    if index < 0:
+        raise ValueError(f"Invalid position key character: {char!r}")
+    return index
+
+
+def _integer_length(head):
+    """Return the length of the integer part, head included, for ``head``."""
+    index = _digit(head)
+    if index >= _ZERO_HEAD:
+        return index - _ZERO_HEAD + 2
+    return _ZERO_HEAD - index + 1
+
+
+def _integer_part(key):
+    length = _integer_length(key[0])
+    if length > len(key):
+        raise ValueError(f"Invalid position key: {key!r}")
+    return key[:length]
+
+
+def validate_key(key):
+    if not key or key == SMALLEST_INTEGER:
+        raise ValueError(f"Invalid position key: {key!r}")
+    for char in key:
+        _digit(char)
+    fraction = key[len(_integer_part(key)):]
+    if fraction.endswith(DIGITS[0]):
+        raise ValueError(f"Invalid position key: {key!r}")
+
+
+def _increment(integer):
+    """Return the next integer, or None past the largest one."""
+    head, digits = integer[0], [_digit(char) for char in integer[1:]]
+    for i in reversed(range(len(digits))):
+        if digits[i] < BASE - 1:
+            digits[i] += 1
+            return head + ''.join(DIGITS[d] for d in digits)
+        digits[i] = 0
+    # Every digit carried over: move to the next head
+    index = _digit(head)
+    if index == BASE - 1:
+        return None
+    # Heads either side of zero both hold one digit
+    if index + 1 > _ZERO_HEAD:
+        digits.append(0)
+    elif index + 1 < _ZERO_HEAD:
+        digits.pop()
+    return DIGITS[index + 1] + ''.join(DIGITS[d] for d in digits)
+
+
+def _decrement(integer):
+    """Return the previous integer, or None below the smallest one."""
+    head, digits = integer[0], [_digit(char) for char in integer[1:]]
+    for i in reversed(range(len(digits))):
+        if digits[i] > 0:
+            digits[i] -= 1
+            return head + ''.join(DIGITS[d] for d in digits)
+        digits[i] = BASE - 1
+    index = _digit(head)
+    if index == 0:
+        return None
+    if index - 1 < _ZERO_HEAD - 1:
+        digits.append(BASE - 1)
+    elif index - 1 >= _ZERO_HEAD:
+        digits.pop()
+    return DIGITS[index - 1] + ''.join(DIGITS[d] for d in digits)
+
+
+def _midpoint(a, b):
+    """Return a digit string strictly between ``a`` and ``b``.
+
+    ``a`` may be empty (the lowest possible value) and ``b`` may be None
+    (unbounded above). Neither may end in ``0``.
+    """
+    if b is not None:
+        # Copy the shared prefix, treating a missing digit in ``a`` as 0.
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else DIGITS[0]) == b[n]:
+            n += 1
+        if n > 0:
+            return b[:n] + _midpoint(a[n:], b[n:])
+
+    digit_a = _digit(a[0]) if a else 0
+    digit_b = _digit(b[0]) if b is not None else BASE
+    if digit_b - digit_a > 1:
+        return DIGITS[(digit_a + digit_b + 1) // 2]
+    # Adjacent digits: shorten b if that is enough, otherwise go one level deeper.
+    if b is not None and len(b) > 1:
+        return b[:1]
+    return DIGITS[digit_a] + _midpoint(a[1:], None)
+
+
+def _key_between(before, after):
+    if before is None and after is None:
+        return INTEGER_ZERO
+    if before is None:
+        integer = _integer_part(after)
+        if integer == SMALLEST_INTEGER:
+            return integer + _midpoint('', after[len(integer):])
+        if integer < after:
+            return integer
+        key = _decrement(integer)
+        if key is None:
+            raise ValueError("Cannot insert before the smallest position key")
+        return key
+    integer = _integer_part(before)
+    fraction = before[len(integer):]
+    if after is None:
+        return _increment(integer) or integer + _midpoint(fraction, None)
+    if integer == _integer_part(after):
+        return integer + _midpoint(fraction, after[len(integer):])
+    key = _increment(integer)
+    if key is not None and key < after:
+        return key
+    return integer + _midpoint(fraction, None)
+
+
+def key_between(before=None, after=None):
+    """Return a position key that sorts strictly between ``before`` and ``after``.
+
+    Either bound may be None to mean "start of list" / "end of list".
+    """
+    if before is not None:
+        validate_key(before)
+    if after is not None:
+        validate_key(after)
+    if before is not None and after is not None and before >= after:
+        raise ValueError(f"Position keys out of order: {before!r} >= {after!r}")
+    return _key_between(before, after)
+
+
+def keys_between(before, after, count):
+    """Return ``count`` ascending keys between ``before`` and ``after``.
+
+    Keys at either end of the list are consecutive integers; keys between
+    two neighbours are generated by bisection, so bulk inserts stay short
+    instead of growing by one digit per item.
+    """
+    if count <= 0:
+        return []
+    if count == 1:
+        return [key_between(before, after)]
+    if after is None:
+        keys = [key_between(before, None)]
+        while len(keys) < count:
+            keys.append(key_between(keys[-1], None))
+        return keys
+    if before is None:
+        keys = [key_between(None, after)]
+        while len(keys) < count:
+            keys.append(key_between(None, keys[-1]))
+        return keys[::-1]
+    middle = key_between(before, after)
+    half = count // 2
+    return (keys_between(before, middle, half)
+            + [middle]
+            + keys_between(middle, after, count - half - 1))
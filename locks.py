@@ -0,0 +1,69 @@
+"""Per-image advisory locks that work across threads and processes.
+
+Each image name maps to its own lock file under ``directory``, so writers
+of different images never wait for each other while two workers editing
+the same image take turns. Locks are advisory: they only exclude other
+code that takes the same lock.
+"""
+
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _try_lock(fd):
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class ImageLocks:
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, name):
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f'{digest}.lock')
+
+    @contextmanager
+    def lock(self, name, timeout=None):
+        """Hold the lock for ``name``; raise TimeoutError after ``timeout`` seconds."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(self.path(name), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if timeout is None and fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while not _try_lock(fd):
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise TimeoutError(f'Timed out waiting for the lock on {name}')
+                    time.sleep(self.POLL_INTERVAL)
+            try:
+                yield
+            finally:
+                _unlock(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,143 @@
+"""Keeps login attempts from crowding out the rest of the site.
+
+Password hashes are deliberately expensive (Werkzeug's default scrypt
+costs tens of milliseconds of CPU and 32 MB of memory per check), so a
+burst of login attempts can tie up every worker. Two guards run before
+any hash is checked:
+
+- ``TokenBuckets`` throttle attempts per client IP and per username,
+  in memory. An attempt takes a token up front; a successful login
+  gives it back, so only failures count against the budget.
+- ``PasswordVerifier`` runs checks on a small thread pool with a bounded
+  queue. When the queue is full the attempt is refused at once instead
+  of waiting, which caps the CPU and memory hashing can take.
+"""
+
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+
+class Overloaded(Exception):
+    pass
+
+
+class TokenBuckets:
+    """Per-key token buckets, at most ``max_keys`` of them.
+
+    A bucket that has refilled is the same as no bucket, so a new key
+    evicts the one that refilled first, found on a heap keyed by refill
+    time. A bucket that is still draining is never evicted, or spraying
+    new keys would reset the throttle on the one under attack; while none
+    has refilled, new keys share a single overflow bucket.
+    """
+
+    def __init__(self, capacity, per_minute, max_keys=10000):
+        self.capacity = capacity
+        self.rate = per_minute / 60
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> (tokens, updated)
+        # (full_at, key) for every bucket, plus stale entries left by later updates
+        self._refills = []
+        self._overflow = None
+        self._lock = threading.Lock()
+
+    def _tokens(self, bucket, now):
+        tokens, updated = bucket
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def _full_at(self, bucket):
+        tokens, updated = bucket
+        return updated + (self.capacity - tokens) / self.rate
+
+    def _store(self, key, bucket):
+        self._buckets[key] = bucket
+        heapq.heappush(self._refills, (self._full_at(bucket), key))
+        if len(self._refills) > 2 * self.max_keys:
+            # Drop the stale entries; amortised over the pushes that made them
+            self._refills = [(self._full_at(bucket), key) for key, bucket in self._buckets.items()]
+            heapq.heapify(self._refills)
+
+    def _make_room(self, now):
+        """Evict a bucket that has refilled if needed; return whether a new key fits."""
+        while len(self._buckets) >= self.max_keys:
+            if not self._refills or self._refills[0][0] > now:
+                return False
+            full_at, key = heapq.heappop(self._refills)
+            bucket = self._buckets.get(key)
+            if bucket is not None and self._full_at(bucket) == full_at:
+                del self._buckets[key]
+        return True
+
+    def _spend(self, bucket, now):
+        """Return the bucket after taking a token, and 0 or the seconds until one is available."""
+        tokens = self.capacity if bucket is None else self._tokens(bucket, now)
+        if tokens >= 1:
+            return (tokens - 1, now), 0
+        return (tokens, now), (1 - tokens) / self.rate
+
+    def take(self, key, now=None):
+        """Take a token for ``key``; return 0, or the seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if key in self._buckets or self._make_room(now):
+                # A key we don't track has a full bucket
+                bucket, wait = self._spend(self._buckets.get(key), now)
+                self._store(key, bucket)
+            else:
+                self._overflow, wait = self._spend(self._overflow, now)
+        return wait
+
+    def give_back(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            # Untracked keys are full already, or took from the overflow bucket
+            if bucket is not None:
+                self._store(key, (min(self.capacity, self._tokens(bucket, now) + 1), now))
+
+
+class PasswordVerifier:
+    def __init__(self, workers=2, queue_limit=8, timeout=5):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-verify')
+        # Running plus queued checks
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+
+    def verify(self, check, *args):
+        """Return ``check(*args)`` run on the pool; raise Overloaded if it is full or too slow."""
+        if not self._slots.acquire(blocking=False):
+            raise Overloaded('Too many login attempts in progress')
+        try:
+            future = self._executor.submit(check, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is held until the check finishes, even if we stop waiting
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise Overloaded('Password check timed out') from None
+
+
+class LoginGuard:
+    def __init__(self, ip_buckets, username_buckets, verifier):
+        self.ip_buckets = ip_buckets
+        self.username_buckets = username_buckets
+        self.verifier = verifier
+
+    def admit(self, ip, username):
+        """Take a token for the IP and the username; return 0 or the seconds to wait."""
+        wait = self.ip_buckets.take(ip)
+        if wait:
+            return wait
+        wait = self.username_buckets.take(username.lower())
+        if wait:
+            self.ip_buckets.give_back(ip)
+        return wait
+
+    def succeeded(self, ip, username):
+        self.ip_buckets.give_back(ip)
+        self.username_buckets.give_back(username.lower())
@@ -0,0 +1,275 @@
+"""Batch recompression of the image library.
+
+Originals were saved at quality 85 on upload and 95 after a rotate, and
+derivatives at 80, none of them progressive. ``optimize_library`` walks
+every original and derivative in storage and re-encodes it to one
+policy:
+
+- JPEG: progressive, optimized Huffman tables, 4:2:0 chroma subsampling,
+  at the lowest quality in ``[quality_min, quality_max]`` whose SSIM
+  against the current image is at least ``min_score``,
+- WebP: the same quality search,
+- PNG: lossless re-compression,
+
+and keeps the result only when it is smaller. Encoding runs in a process
+pool; the parent only reads and writes storage, taking the image's lock
+and skipping files that changed while they were being encoded.
+
+Progress is written to a checkpoint file, so an interrupted run resumes
+where it stopped. A file is skipped while its size and mtime match the
+checkpoint, which also keeps re-runs from re-encoding (and slowly
+degrading) files that were already optimized.
+"""
+
+import json
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from io import BytesIO
+
+import numpy as np
+
+from derivatives import SIZES, derivative_name
+from storage import SPOOL_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_VERSION = 1
+CHECKPOINT_EVERY = 20
+
+DEFAULT_POLICY = {
+    'quality_min': 60,
+    'quality_max': 90,
+    'min_score': 0.985,
+    'subsampling': '4:2:0'
+}
+
+
+def ssim(a, b, block=8):
+    """Mean SSIM of two equally sized grayscale arrays over ``block`` x ``block`` tiles."""
+    block = max(1, min(block, a.shape[0], a.shape[1]))
+    h = a.shape[0] // block * block
+    w = a.shape[1] // block * block
+    shape = (h // block, block, w // block, block)
+    a = a[:h, :w].astype(np.float64).reshape(shape)
+    b = b[:h, :w].astype(np.float64).reshape(shape)
+
+    mu_a = a.mean(axis=(1, 3))
+    mu_b = b.mean(axis=(1, 3))
+    var_a = a.var(axis=(1, 3))
+    var_b = b.var(axis=(1, 3))
+    cov = (a * b).mean(axis=(1, 3)) - mu_a * mu_b
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    scores = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)
+              / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2)))
+    return float(scores.mean())
+
+
+def _luma(img):
+    return np.asarray(img.convert('L'), dtype=np.float32)
+
+
+def _encode(img, image_format, options):
+    buffer = BytesIO()
+    img.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def _quality_search(img, image_format, options, policy):
+    """Return the smallest encoding that still scores ``min_score``, or ``None``."""
+    from PIL import Image
+    reference = _luma(img)
+    best = None
+    low, high = policy['quality_min'], policy['quality_max']
+    while low <= high:
+        quality = (low + high) // 2
+        data = _encode(img, image_format, dict(options, quality=quality))
+        with Image.open(BytesIO(data)) as candidate:
+            score = ssim(reference, _luma(candidate))
+        if score >= policy['min_score']:
+            best = data
+            high = quality - 1
+        else:
+            low = quality + 1
+    return best
+
+
+def recompress(data, policy):
+    """Re-encode one image file; return the new bytes, or ``None`` to keep ``data``.
+
+    Runs in a worker process, so it only deals in bytes.
+    """
+    from PIL import Image
+    with Image.open(BytesIO(data)) as img:
+        image_format = img.format
+        if getattr(img, 'n_frames', 1) > 1:
+            return None  # Animations are left alone
+        img.load()
+        options = {key: img.info[key] for key in ('icc_profile', 'exif') if img.info.get(key)}
+
+        if image_format == 'JPEG':
+            options.update(optimize=True, progressive=True, subsampling=policy['subsampling'])
+            result = _quality_search(img, image_format, options, policy)
+        elif image_format == 'WEBP':
+            options.update(method=6)
+            result = _quality_search(img, image_format, options, policy)
+        elif image_format == 'PNG':
+            result = _encode(img, image_format, dict(options, optimize=True))
+        else:
+            return None
+
+    if result is not None and len(result) < len(data):
+        return result
+    return None
+
+
+def _load_checkpoint(path):
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('version') == CHECKPOINT_VERSION:
+            return checkpoint['files']
+    except (OSError, ValueError, KeyError):
+        pass
+    return {}
+
+
+def _save_checkpoint(path, files):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': CHECKPOINT_VERSION, 'files': files}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _originals(storage, is_image):
+    yield from (entry for entry in storage.iter_scan() if is_image(entry[0]))
+
+
+def _derivatives(storage):
+    for kind in SIZES:
+        yield from (entry for entry in storage.iter_scan(derivative_name(kind, ''))
+                    if not entry[0].endswith(SPOOL_SUFFIX))
+
+
+def _library(storage, is_image):
+    """Return the phases of a run: the originals, then the derivatives.
+
+    Each phase yields ``(name, size, mtime_ns)`` and is only listed once the
+    previous one has finished: rewriting an original makes its derivatives
+    look stale, and rewriting those afterwards makes them current again.
+    """
+    return _originals(storage, is_image), _derivatives(storage)
+
+
+def _original_of(name):
+    """Return the original a derivative was made from, or None for an original."""
+    for kind in SIZES:
+        prefix = derivative_name(kind, '')
+        if name.startswith(prefix):
+            return name[len(prefix):]
+    return None
+
+
+def _summarize(files):
+    stats = {'files': len(files), 'optimized': 0, 'unchanged': 0, 'failed': 0,
+             'bytes_before': 0, 'bytes_after': 0}
+    for entry in files.values():
+        stats[entry['status']] += 1
+        stats['bytes_before'] += entry['before']
+        stats['bytes_after'] += entry['after']
+    stats['bytes_saved'] = stats['bytes_before'] - stats['bytes_after']
+    return stats
+
+
+def optimize_library(checkpoint_path, workers=None, policy=None, restart=False):
+    """Recompress the whole library, resuming from ``checkpoint_path``; return totals."""
+    from app import Photo, allowed_file, get_storage, image_lock, record_image
+
+    policy = dict(DEFAULT_POLICY, **(policy or {}))
+    files = {} if restart else _load_checkpoint(checkpoint_path)
+    storage = get_storage()
+
+    def is_stale(name, mtime_ns):
+        original = _original_of(name)
+        if original is None:
+            return False
+        try:
+            return storage.stat(original)[1] > mtime_ns
+        except FileNotFoundError:
+            return False
+
+    def finish(name, size, mtime_ns, result):
+        entry = {'before': size, 'after': size, 'status': 'unchanged'}
+        if result is None and is_stale(name, mtime_ns):
+            # Not smaller, but older than its rewritten original: save it again
+            # as it is, or it would be regenerated without the policy
+            result = storage.read(name)
+        if result is not None:
+            try:
+                with image_lock(name):
+                    # Edited (or deleted) since it was read; the next run picks it up
+                    if storage.stat(name) != (size, mtime_ns):
+                        return
+                    photo = Photo.query.filter_by(filename=name).first()
+                    crop_box = photo.crop if photo is not None else None
+                    storage.save(name, result)
+                    if photo is not None:
+                        # Same dimensions, so the cached crop still applies
+                        record_image(storage, name, crop_box)
+                    size, mtime_ns = storage.stat(name)
+            except (FileNotFoundError, TimeoutError) as e:
+                logger.warning(f"Skipping {name}: {str(e)}")
+                return
+            if size < entry['before']:
+                entry.update(after=size, status='optimized')
+                logger.info(f"Optimized {name}: {entry['before']} -> {size} bytes")
+        entry['fingerprint'] = f'{size}:{mtime_ns}'
+        files[name] = entry
+
+    def collect(future, job):
+        name, size, mtime_ns = job
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.warning(f"Could not optimize {name}: {str(e)}")
+            files[name] = {'before': size, 'after': size, 'status': 'failed',
+                           'fingerprint': f'{size}:{mtime_ns}'}
+            return
+        finish(name, size, mtime_ns, result)
+
+    workers = workers or os.cpu_count() or 1
+    pending = {}
+    unsaved = 0
+
+    def drain(limit):
+        # Wait until at most ``limit`` files are in flight
+        nonlocal unsaved
+        while len(pending) > limit:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                collect(future, pending.pop(future))
+                unsaved += 1
+        if unsaved >= CHECKPOINT_EVERY:
+            _save_checkpoint(checkpoint_path, files)
+            unsaved = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            for phase in _library(storage, allowed_file):
+                for name, size, mtime_ns in phase:
+                    if files.get(name, {}).get('fingerprint') == f'{size}:{mtime_ns}':
+                        continue
+                    # Only a couple of files per worker are held in memory at a time
+                    drain(workers * 2 - 1)
+                    pending[executor.submit(recompress, storage.read(name), policy)] = (name, size, mtime_ns)
+                # Every original is rewritten before its derivatives are looked at
+                drain(0)
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            _save_checkpoint(checkpoint_path, files)
+
+    return _summarize(files)
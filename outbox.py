@@ -0,0 +1,206 @@
+"""Durable outbox for contact form messages.
+
+The ``/contact`` endpoint only inserts a row; delivery happens here, off
+the request path. An :class:`OutboxDispatcher` polls for due messages,
+hands them to a transport in batches and reschedules failures with
+exponential backoff until ``max_attempts`` is reached.
+
+Run a single dispatcher per database: delivery is at-least-once and
+rows are not claimed between concurrent dispatchers.
+"""
+
+import logging
+import random
+import smtplib
+import threading
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+
+def build_email(message, sender, recipient):
+    email = EmailMessage()
+    email['Subject'] = f'Portfolio contact from {message.name}'
+    email['From'] = sender
+    email['To'] = recipient
+    email['Reply-To'] = message.email
+    email.set_content(f'{message.message}\n\n-- \n{message.name} <{message.email}>\n'
+                      f'Received {message.created_at:%Y-%m-%d %H:%M} UTC')
+    return email
+
+
+class Transport:
+    """Delivers a batch of contact messages.
+
+    ``send_batch`` returns one entry per message: None on success or an
+    error string. Raising means the whole batch failed.
+    """
+
+    def __init__(self, sender, recipient):
+        self.sender = sender
+        self.recipient = recipient
+
+    def send_batch(self, messages):
+        raise NotImplementedError
+
+
+class SMTPTransport(Transport):
+    """Sends every message of a batch over one SMTP connection."""
+
+    def __init__(self, sender, recipient, host='localhost', port=25,
+                 username=None, password=None, use_tls=False, timeout=10):
+        super().__init__(sender, recipient)
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+
+    def send_batch(self, messages):
+        results = []
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for message in messages:
+                # A message that can't be built or sent fails on its own, not the batch
+                try:
+                    smtp.send_message(build_email(message, self.sender, self.recipient))
+                    results.append(None)
+                except (smtplib.SMTPException, ValueError) as e:
+                    results.append(str(e))
+        return results
+
+
+class DebugTransport(Transport):
+    """Logs messages and keeps them in memory instead of sending them."""
+
+    def __init__(self, sender, recipient):
+        super().__init__(sender, recipient)
+        self.sent = []
+
+    def send_batch(self, messages):
+        results = []
+        for message in messages:
+            try:
+                email = build_email(message, self.sender, self.recipient)
+            except ValueError as e:
+                results.append(str(e))
+                continue
+            logger.info(f"Debug transport - {email['Subject']} (reply to {email['Reply-To']})")
+            self.sent.append(email)
+            results.append(None)
+        return results
+
+
+def make_transport(config):
+    sender = config['CONTACT_SENDER']
+    recipient = config['CONTACT_RECIPIENT']
+    if config['CONTACT_TRANSPORT'] == 'smtp':
+        return SMTPTransport(sender, recipient,
+                             host=config['MAIL_SERVER'],
+                             port=config['MAIL_PORT'],
+                             username=config.get('MAIL_USERNAME'),
+                             password=config.get('MAIL_PASSWORD'),
+                             use_tls=config.get('MAIL_USE_TLS', False))
+    if config['CONTACT_TRANSPORT'] == 'debug':
+        return DebugTransport(sender, recipient)
+    raise ValueError(f"Unknown contact transport: {config['CONTACT_TRANSPORT']}")
+
+
+class OutboxDispatcher:
+    def __init__(self, app, db, model, transport, batch_size=50, max_attempts=5,
+                 base_delay=30, max_delay=3600, poll_interval=5):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.transport = transport
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def backoff(self, attempts):
+        """Seconds to wait before retry number ``attempts``, with jitter."""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def dispatch_once(self, now=None):
+        """Deliver one batch of due messages; return how many were attempted."""
+        with self.app.app_context():
+            now = now or datetime.utcnow()
+            messages = (self.model.query
+                        .filter(self.model.status == STATUS_PENDING,
+                                self.model.next_attempt_at <= now)
+                        .order_by(self.model.next_attempt_at, self.model.id)
+                        .limit(self.batch_size)
+                        .all())
+            if not messages:
+                return 0
+
+            try:
+                results = self.transport.send_batch(messages)
+            except Exception as e:
+                logger.warning(f"Outbox batch of {len(messages)} failed: {str(e)}")
+                results = [str(e)] * len(messages)
+
+            for message, error in zip(messages, results):
+                message.attempts += 1
+                if error is None:
+                    message.status = STATUS_SENT
+                    message.sent_at = now
+                    message.last_error = None
+                elif message.attempts >= self.max_attempts:
+                    message.status = STATUS_FAILED
+                    message.last_error = error
+                    logger.error(f"Giving up on contact message {message.id}: {error}")
+                else:
+                    message.next_attempt_at = now + timedelta(seconds=self.backoff(message.attempts))
+                    message.last_error = error
+            self.db.session.commit()
+
+            sent = sum(1 for error in results if error is None)
+            logger.info(f"Outbox delivered {sent}/{len(messages)} messages")
+            return len(messages)
+
+    def notify(self):
+        """Wake the dispatcher thread so a new message goes out promptly."""
+        self._wakeup.set()
+
+    def run(self):
+        """Dispatch until :meth:`stop` is called."""
+        while not self._stopping.is_set():
+            try:
+                attempted = self.dispatch_once()
+            except Exception as e:
+                logger.error(f"Outbox dispatcher error: {str(e)}", exc_info=True)
+                attempted = 0
+            if attempted < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.run, name='outbox-dispatcher', daemon=True)
+        self._thread.start()
+        logger.info("Outbox dispatcher started")
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
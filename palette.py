@@ -0,0 +1,186 @@
+"""Dominant-colour palettes and an in-memory index for colour browsing.
+
+Each image gets a small k-means palette, computed once at ingest from a
+downsampled copy and stored on its catalog row as a packed byte string:
+``PALETTE_SIZE`` entries of ``(r, g, b, weight)``, heaviest first, with
+the weight being the share of pixels scaled to 0-255.
+
+``PaletteIndex`` keeps every palette as CIELAB NumPy arrays, so finding
+the images closest to a colour, or ordering the whole library by hue, is
+a handful of vectorized operations instead of a decode per image.
+"""
+
+import threading
+
+import numpy as np
+
+PALETTE_SIZE = 5
+ANALYSIS_SIZE = 64
+ITERATIONS = 12
+
+# Clusters closer than this (CIELAB distance) are reported as one colour
+MERGE_DISTANCE = 10
+# Colours below this CIELAB chroma count as greys when ordering by hue
+GREY_CHROMA = 12
+# How much a colour that covers little of the image is pushed down the results
+WEIGHT_PENALTY = 20
+
+_SRGB_TO_XYZ = np.array([[0.4124, 0.3576, 0.1805],
+                         [0.2126, 0.7152, 0.0722],
+                         [0.0193, 0.1192, 0.9505]], dtype=np.float32)
+_WHITE = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+
+
+def rgb_to_lab(rgb):
+    """Convert ``(..., 3)`` sRGB values in 0-255 to CIELAB (D65)."""
+    c = np.asarray(rgb, dtype=np.float32) / 255
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ _SRGB_TO_XYZ.T / _WHITE
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([116 * f[..., 1] - 16,
+                     500 * (f[..., 0] - f[..., 1]),
+                     200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def parse_color(value):
+    """Parse ``'rrggbb'`` or ``'#rgb'`` into an ``(r, g, b)`` tuple; raise ValueError otherwise."""
+    value = value.strip().lstrip('#')
+    if len(value) == 3:
+        value = ''.join(ch * 2 for ch in value)
+    if len(value) != 6:
+        raise ValueError(f'Invalid colour: {value!r}')
+    return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def extract_palette(img, k=PALETTE_SIZE):
+    """Return the packed k-means palette of a PIL image."""
+    small = img.convert('RGB')
+    small.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    pixels = np.asarray(small, dtype=np.float32).reshape(-1, 3)
+    lab = rgb_to_lab(pixels)
+
+    # Deterministic start: pixels spread evenly over the lightness range
+    order = np.argsort(lab[:, 0], kind='stable')
+    centers = lab[order[np.linspace(0, len(lab) - 1, k).astype(int)]]
+    for _ in range(ITERATIONS):
+        distances = ((lab[:, None, :] - centers[None, :, :]) ** 2).sum(axis=-1)
+        labels = distances.argmin(axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.stack([np.bincount(labels, weights=lab[:, channel], minlength=k)
+                         for channel in range(3)], axis=-1)
+        updated = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+        if np.allclose(updated, centers, atol=0.1):
+            break
+        centers = updated
+
+    # Fold clusters that are barely distinguishable (often just resampled
+    # edges) into the larger one, heaviest first
+    counts = counts.astype(np.float64)
+    rgb_sums = np.stack([np.bincount(labels, weights=pixels[:, channel], minlength=k)
+                         for channel in range(3)], axis=-1)
+    kept = []
+    for i in np.argsort(-counts, kind='stable'):
+        if not counts[i]:
+            continue
+        for j in kept:
+            if np.linalg.norm(centers[i] - centers[j]) < MERGE_DISTANCE:
+                counts[j] += counts[i]
+                rgb_sums[j] += rgb_sums[i]
+                break
+        else:
+            kept.append(i)
+
+    # Report each cluster as the average of its pixels in sRGB
+    kept.sort(key=lambda i: -counts[i])
+    colors = rgb_sums[kept] / counts[kept][:, None]
+    return pack_palette(colors, counts[kept] / len(pixels))
+
+
+def pack_palette(colors, weights):
+    rows = np.column_stack([np.round(colors), np.round(np.asarray(weights) * 255)])
+    return np.clip(rows, 0, 255).astype(np.uint8).tobytes()
+
+
+def unpack_palette(blob):
+    """Return ``(colors, weights)``: an ``(n, 3)`` uint8 array and ``n`` fractions."""
+    rows = np.frombuffer(blob, dtype=np.uint8).reshape(-1, 4)
+    return rows[:, :3], rows[:, 3] / 255
+
+
+def palette_hex(blob):
+    return ['#{:02x}{:02x}{:02x}'.format(*color) for color in unpack_palette(blob)[0]]
+
+
+class PaletteIndex:
+    """Colour lookups over every catalogued palette, rebuilt when the catalog changes."""
+
+    def __init__(self):
+        self.version = None
+        self._data = ([], np.zeros((0, PALETTE_SIZE, 3), dtype=np.float32),
+                      np.zeros((0, PALETTE_SIZE), dtype=np.float32))
+        self._lock = threading.Lock()
+
+    @property
+    def entries(self):
+        return self._data[0]
+
+    def refresh(self, version, load):
+        """Rebuild from ``load()`` unless already built for ``version``.
+
+        ``load`` returns ``(filename, mtime_ns, packed_palette)`` rows.
+        """
+        if version == self.version:
+            return
+        with self._lock:
+            if version == self.version:
+                return
+            entries = []
+            lab = np.zeros((0, PALETTE_SIZE, 3), dtype=np.float32)
+            weights = np.zeros((0, PALETTE_SIZE), dtype=np.float32)
+            rows = list(load())
+            if rows:
+                # Pad short palettes with zero-weight copies of their first colour
+                packed = np.zeros((len(rows), PALETTE_SIZE, 4), dtype=np.uint8)
+                for i, (filename, mtime_ns, blob) in enumerate(rows):
+                    palette = np.frombuffer(blob, dtype=np.uint8).reshape(-1, 4)[:PALETTE_SIZE]
+                    packed[i] = palette[0]
+                    packed[i, :, 3] = 0
+                    packed[i, :len(palette)] = palette
+                    entries.append((filename, mtime_ns, blob))
+                lab = rgb_to_lab(packed[..., :3])
+                weights = packed[..., 3] / np.float32(255)
+            # Swapped in one go so readers never see a half-built index
+            self._data = (entries, lab, weights)
+            self.version = version
+
+    def nearest(self, color, max_distance=None):
+        """Return ``(entry, distance)`` pairs, closest first, for an ``(r, g, b)`` colour.
+
+        The distance is the CIELAB distance to the nearest colour of an
+        image's palette, plus a penalty for colours covering little of it.
+        """
+        entries, lab, weights = self._data
+        if not entries:
+            return []
+        target = rgb_to_lab(np.asarray(color, dtype=np.float32))
+        distances = np.sqrt(((lab - target) ** 2).sum(axis=-1)) + WEIGHT_PENALTY * (1 - weights)
+        # Padding never matches
+        distances[weights == 0] = np.inf
+        scores = distances.min(axis=1)
+        order = np.argsort(scores, kind='stable')
+        if max_distance is not None:
+            order = order[scores[order] <= max_distance]
+        return [(entries[i], float(scores[i])) for i in order]
+
+    def by_hue(self):
+        """Return every entry ordered by the hue of its dominant colour, greys last."""
+        entries, lab, _ = self._data
+        if not entries:
+            return []
+        dominant = lab[:, 0]
+        chroma = np.hypot(dominant[:, 1], dominant[:, 2])
+        hue = np.mod(np.arctan2(dominant[:, 2], dominant[:, 1]), 2 * np.pi)
+        grey = chroma < GREY_CHROMA
+        # Colours by hue, then greys from light to dark
+        order = np.lexsort((np.where(grey, -dominant[:, 0], hue), grey))
+        return [entries[i] for i in order]
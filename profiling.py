@@ -0,0 +1,188 @@
+"""Opt-in per-request profiling.
+
+A request to one of ``PROFILE_ENDPOINTS`` is profiled when any trigger
+fires:
+
+- ``PROFILE_ALWAYS`` is set,
+- an authenticated user sends the ``PROFILE_HEADER`` header (``X-Profile: 1``),
+- a random draw falls under ``PROFILE_SAMPLE_RATE``.
+
+Each profiled request writes ``<id>.json`` with route and timing
+metadata to ``PROFILE_DIR``, plus either ``<id>.pstats`` (cProfile,
+``PROFILE_MODE = 'cprofile'``) or ``<id>.collapsed`` (stack samples in
+the collapsed format read by flamegraph.pl and speedscope,
+``PROFILE_MODE = 'sample'``). The id is returned in the ``X-Profile-Id``
+response header. Only the newest ``PROFILE_KEEP`` profiles are kept.
+
+Python 3.12+ allows one cProfile session per process, so a request that
+overlaps another cProfile'd request is stack-sampled instead.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, request
+from flask_login import current_user
+
+logger = logging.getLogger(__name__)
+
+
+class StackSampler:
+    """Samples one thread's call stack at a fixed interval."""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    @staticmethod
+    def _frame_label(frame):
+        code = frame.f_code
+        return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class RequestProfiler:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILE_ENDPOINTS', ['main.admin', 'main.upload_file'])
+        app.config.setdefault('PROFILE_ALWAYS', False)
+        app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+        app.config.setdefault('PROFILE_HEADER', 'X-Profile')
+        app.config.setdefault('PROFILE_MODE', 'cprofile')
+        app.config.setdefault('PROFILE_SAMPLE_INTERVAL', 0.005)
+        app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+        app.config.setdefault('PROFILE_KEEP', 200)
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        app.extensions['profiler'] = self
+
+    def _should_profile(self, config):
+        if request.endpoint not in config['PROFILE_ENDPOINTS']:
+            return False
+        if config['PROFILE_ALWAYS']:
+            return True
+        if request.headers.get(config['PROFILE_HEADER']) == '1' and current_user.is_authenticated:
+            return True
+        rate = config['PROFILE_SAMPLE_RATE']
+        return rate > 0 and random.random() < rate
+
+    def _start(self):
+        config = current_app.config
+        if not self._should_profile(config):
+            return
+
+        profiler = None
+        if config['PROFILE_MODE'] != 'sample':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another request holds the process-wide profiler
+                logger.debug(f"cProfile busy, sampling {request.endpoint} instead")
+                profiler = None
+        if profiler is None:
+            profiler = StackSampler(threading.get_ident(), config['PROFILE_SAMPLE_INTERVAL'])
+            profiler.start()
+        g._profile = {
+            'profiler': profiler,
+            'started_at': datetime.utcnow(),
+            'start': time.perf_counter(),
+            'directory': config['PROFILE_DIR'],
+            'keep': config['PROFILE_KEEP']
+        }
+
+    def _finish(self, response):
+        profile = g.pop('_profile', None)
+        if profile is not None:
+            response.headers['X-Profile-Id'] = self._write(profile, response.status_code)
+        return response
+
+    def _teardown(self, error):
+        # after_request does not run when the view raised
+        profile = g.pop('_profile', None)
+        if profile is not None:
+            self._write(profile, 500)
+
+    def _write(self, profile, status_code):
+        profiler = profile['profiler']
+        duration_ms = (time.perf_counter() - profile['start']) * 1000
+        if isinstance(profiler, StackSampler):
+            profiler.stop()
+        else:
+            profiler.disable()
+
+        profile_id = (f"{profile['started_at']:%Y%m%dT%H%M%S%f}-{request.endpoint}"
+                      f"-{int(duration_ms)}ms")
+        base = os.path.join(profile['directory'], profile_id)
+        try:
+            os.makedirs(profile['directory'], exist_ok=True)
+            if isinstance(profiler, StackSampler):
+                profiler.write(base + '.collapsed')
+                output = 'collapsed'
+            else:
+                profiler.dump_stats(base + '.pstats')
+                output = 'pstats'
+            with open(base + '.json', 'w') as f:
+                json.dump({
+                    'id': profile_id,
+                    'endpoint': request.endpoint,
+                    'method': request.method,
+                    'path': request.full_path.rstrip('?'),
+                    'status': status_code,
+                    'started_at': profile['started_at'].isoformat() + 'Z',
+                    'duration_ms': round(duration_ms, 3),
+                    'output': output
+                }, f, indent=2)
+            logger.info(f"Profiled {request.endpoint} in {duration_ms:.1f}ms: {base}.{output}")
+            self._prune(profile['directory'], profile['keep'])
+        except OSError as e:
+            logger.error(f"Error writing profile {profile_id}: {str(e)}")
+        return profile_id
+
+    @staticmethod
+    def _prune(directory, keep):
+        """Delete all but the newest ``keep`` profiles; ids sort by start time."""
+        ids = sorted(name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json'))
+        for profile_id in ids[:max(0, len(ids) - keep)]:
+            for suffix in ('.json', '.pstats', '.collapsed'):
+                try:
+                    os.remove(os.path.join(directory, profile_id + suffix))
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,258 @@
+"""Background consistency check between storage and the image catalog.
+
+Uploads, rotates and deletes touch storage and the database separately,
+so a crash or a file removed by hand leaves them out of step. The
+reconciler walks both in filename order, a batch at a time, and repairs
+what it finds:
+
+- images without a catalog row get one; rows whose size or mtime no
+  longer match are refreshed,
+- rows whose image is gone are removed (via ``forget``), but no more
+  than ``max_remove`` of the catalog in one pass,
+- derivatives without an original are deleted, and missing or stale
+  derivatives are regenerated,
+- leftover spool files (``*.tmp``) older than ``spool_max_age`` are deleted.
+
+A pass is abandoned before changing anything if storage is unavailable,
+or lists no images while the catalog has some: an unmounted volume or a
+wrong bucket should not look like a library deleted by hand.
+
+Only one batch of listing entries and catalog rows is held in memory at
+a time, and the reconciler sleeps for ``pause`` seconds between batches
+so it never competes with requests for long.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy.exc import IntegrityError
+
+from derivatives import SIZES, derivative_name, ensure_derivative
+from storage import SPOOL_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Reconciler:
+    def __init__(self, app, db, model, get_storage, is_image, forget,
+                 batch_size=200, pause=0.05, interval=3600, spool_max_age=3600,
+                 max_remove=0.1):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.get_storage = get_storage
+        self.is_image = is_image
+        self.forget = forget
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self.spool_max_age = spool_max_age
+        self.max_remove = max_remove
+        self.last_report = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _throttle(self):
+        if self.pause:
+            self._stopping.wait(self.pause)
+
+    def _is_stale_spool(self, name, mtime_ns, now):
+        return name.endswith(SPOOL_SUFFIX) and now - mtime_ns / 1e9 > self.spool_max_age
+
+    def _originals(self, storage, report, now):
+        """Yield image entries in order, deleting stale spool files on the way."""
+        for batch in _batches(storage.iter_scan(), self.batch_size):
+            spool = [entry[0] for entry in batch if self._is_stale_spool(entry[0], entry[2], now)]
+            if spool:
+                report['spool_removed'] += len(storage.delete_many(spool))
+            yield from (entry for entry in batch if self.is_image(entry[0]))
+
+    def _unavailable(self, storage):
+        """Return why this pass must not run, or None."""
+        if self.model.query.first() is None:
+            # Nothing to lose, e.g. before the first upload
+            return None
+        if not storage.available():
+            return 'storage is unavailable'
+        if not any(self.is_image(entry[0]) for entry in storage.iter_scan()):
+            return 'storage lists no images but the catalog is not empty'
+        return None
+
+    def _forget(self, storage, filenames, report):
+        # The listing may predate an upload that finished since
+        gone = [filename for filename in filenames if not storage.exists(filename)]
+        budget = self._remove_budget - report['catalog_removed']
+        if len(gone) > budget:
+            if not report['removals_skipped']:
+                logger.error(f"Reconciler reached its removal limit ({self._remove_budget} rows); "
+                             f"keeping the remaining rows of missing images")
+            report['removals_skipped'] += len(gone) - budget
+            gone = gone[:budget]
+        if gone:
+            self.forget(gone)
+            report['catalog_removed'] += len(gone)
+
+    def _reconcile_catalog(self, storage, report, now):
+        model = self.model
+        previous = None
+        for batch in _batches(self._originals(storage, report, now), self.batch_size):
+            # Catalog rows in the same filename window as this batch
+            query = model.query.filter(model.filename <= batch[-1][0])
+            if previous is not None:
+                query = query.filter(model.filename > previous)
+            rows = {row.filename: row for row in query}
+            previous = batch[-1][0]
+
+            for filename, size, mtime_ns in batch:
+                report['images'] += 1
+                row = rows.pop(filename, None)
+                if row is None:
+                    self.db.session.add(model(filename=filename, size=size, mtime_ns=mtime_ns))
+                    report['catalog_added'] += 1
+                elif row.size != size or row.mtime_ns != mtime_ns:
+                    row.size, row.mtime_ns = size, mtime_ns
+                    report['catalog_updated'] += 1
+            self._forget(storage, list(rows), report)
+            try:
+                self.db.session.commit()
+            except IntegrityError:
+                # Raced with an upload of the same name; the next pass checks it
+                self.db.session.rollback()
+                report['errors'] += 1
+            self._throttle()
+
+        # Rows past the last image in storage
+        while True:
+            query = model.query.order_by(model.filename)
+            if previous is not None:
+                query = query.filter(model.filename > previous)
+            filenames = [row.filename for row in query.limit(self.batch_size)]
+            if not filenames:
+                break
+            self._forget(storage, filenames, report)
+            self.db.session.commit()
+            previous = filenames[-1]
+
+    def _reconcile_derivatives(self, storage, kind, report, now):
+        prefix = derivative_name(kind, '')
+        derivatives = storage.iter_scan(prefix)
+        current = next(derivatives, None)
+        orphans = []
+
+        def flush_orphans():
+            if orphans:
+                storage.delete_many(orphans)
+                orphans.clear()
+                self._throttle()
+
+        def skip(entry):
+            # Anything but the derivative of an image we have, unless it is
+            # a write that is still in progress
+            name, _, mtime_ns = entry
+            if not name.endswith(SPOOL_SUFFIX):
+                report['derivatives_removed'] += 1
+            elif self._is_stale_spool(name, mtime_ns, now):
+                report['spool_removed'] += 1
+            else:
+                return
+            orphans.append(name)
+            if len(orphans) >= self.batch_size:
+                flush_orphans()
+
+        for filename, _, mtime_ns in storage.iter_scan():
+            if not self.is_image(filename):
+                continue
+            derivative = None
+            while current is not None and current[0][len(prefix):] <= filename:
+                if current[0][len(prefix):] == filename:
+                    derivative = current
+                else:
+                    skip(current)
+                current = next(derivatives, None)
+
+            if derivative is None or derivative[2] < mtime_ns:
+                try:
+                    ensure_derivative(storage, filename, kind)
+                    report['derivatives_generated'] += 1
+                except Exception as e:
+                    logger.warning(f"Could not generate {kind} for {filename}: {str(e)}")
+                    report['errors'] += 1
+                self._throttle()
+
+        while current is not None:
+            skip(current)
+            current = next(derivatives, None)
+        flush_orphans()
+
+    def reconcile_once(self):
+        """Run one full pass and return its drift report."""
+        report = {
+            'started_at': datetime.utcnow().isoformat() + 'Z',
+            'images': 0,
+            'catalog_added': 0,
+            'catalog_updated': 0,
+            'catalog_removed': 0,
+            'derivatives_generated': 0,
+            'derivatives_removed': 0,
+            'spool_removed': 0,
+            'removals_skipped': 0,
+            'errors': 0,
+            'aborted': None
+        }
+        start = time.perf_counter()
+        now = time.time()
+        with self.app.app_context():
+            storage = self.get_storage()
+            report['aborted'] = self._unavailable(storage)
+            if report['aborted'] is None:
+                self._remove_budget = max(1, int(self.model.query.count() * self.max_remove))
+                self._reconcile_catalog(storage, report, now)
+                for kind in SIZES:
+                    self._reconcile_derivatives(storage, kind, report, now)
+
+        report['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        report['drift'] = sum(report[key] for key in (
+            'catalog_added', 'catalog_updated', 'catalog_removed',
+            'derivatives_generated', 'derivatives_removed', 'spool_removed'))
+        self.last_report = report
+        if report['aborted']:
+            logger.error(f"Reconciler pass abandoned: {report['aborted']}")
+            return report
+        log = logger.warning if report['drift'] else logger.info
+        log(f"Reconciled {report['images']} images in {report['duration_ms']:.0f}ms: {report}")
+        return report
+
+    def run(self):
+        """Reconcile every ``interval`` seconds until :meth:`stop` is called."""
+        while not self._stopping.is_set():
+            try:
+                self.reconcile_once()
+            except Exception as e:
+                logger.error(f"Reconciler error: {str(e)}", exc_info=True)
+            self._stopping.wait(self.interval)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.run, name='reconciler', daemon=True)
+        self._thread.start()
+        logger.info("Reconciler started")
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
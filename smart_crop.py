@@ -0,0 +1,128 @@
+"""Saliency-aware crop windows for fixed-aspect derivatives.
+
+The gallery shows images as square tiles. Rather than letting the
+browser cut the middle out of a full image with ``object-fit: cover``,
+tiles are cropped on the server around the interesting part of the
+picture:
+
+- a saliency map is computed on a small copy of the image (at most
+  ``ANALYSIS_SIZE`` px a side) from edge energy, local contrast and
+  colour distinctiveness, with a slight pull towards the centre,
+- every window of the target aspect ratio is scored at once from a
+  summed-area table of that map, and the best one is scaled back to the
+  original's coordinates.
+
+Everything is vectorized NumPy, so a crop costs a few milliseconds on
+top of decoding the image.
+"""
+
+import numpy as np
+
+ANALYSIS_SIZE = 256
+
+# Relative weight of the centre prior; enough to break ties on flat images
+CENTER_WEIGHT = 0.1
+
+# Analysis copies thinner than this (banners, strips) are centre-cropped:
+# there is too little of them to find gradients in
+MIN_ANALYSIS_SIZE = 3
+
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def summed_area_table(values):
+    """Return ``sat`` with ``sat[y, x] == values[:y, :x].sum()``."""
+    sat = np.zeros((values.shape[0] + 1, values.shape[1] + 1), dtype=np.float64)
+    np.cumsum(values, axis=0, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def window_sums(sat, width, height):
+    """Sum of every ``width`` x ``height`` window, indexed by its top-left corner."""
+    return sat[height:, width:] - sat[:-height, width:] - sat[height:, :-width] + sat[:-height, :-width]
+
+
+def _box_blur(values, radius):
+    padded = np.pad(values, radius, mode='edge')
+    size = 2 * radius + 1
+    return window_sums(summed_area_table(padded), size, size) / (size * size)
+
+
+def _normalize(values):
+    span = values.max() - values.min()
+    if span <= 1e-6:
+        return np.zeros_like(values)
+    return (values - values.min()) / span
+
+
+def saliency_map(rgb):
+    """Return a ``(h, w)`` map of how much each pixel draws the eye.
+
+    ``rgb`` is a ``(h, w, 3)`` float array scaled to ``[0, 1]``.
+    """
+    gray = rgb @ _LUMA
+    gy, gx = np.gradient(gray)
+    edges = np.hypot(gx, gy)
+
+    # Local contrast: standard deviation over a 7x7 neighbourhood
+    mean = _box_blur(gray, 3)
+    contrast = np.sqrt(np.maximum(_box_blur(gray * gray, 3) - mean * mean, 0))
+
+    # Colour distinctiveness: distance of each (slightly smoothed) pixel
+    # from the image's average colour
+    smoothed = np.stack([_box_blur(rgb[..., channel], 1) for channel in range(3)], axis=-1)
+    distinct = np.linalg.norm(smoothed - rgb.reshape(-1, 3).mean(axis=0), axis=-1)
+
+    h, w = gray.shape
+    ys = (np.arange(h, dtype=np.float32) - (h - 1) / 2) / max(h, 1)
+    xs = (np.arange(w, dtype=np.float32) - (w - 1) / 2) / max(w, 1)
+    center = 1 - np.sqrt(ys[:, None] ** 2 + xs[None, :] ** 2)
+
+    return (_normalize(edges) + _normalize(contrast) + _normalize(distinct)
+            + CENTER_WEIGHT * center)
+
+
+def best_window(saliency, width, height):
+    """Return the ``(left, top)`` of the window that holds the most saliency."""
+    sums = window_sums(summed_area_table(saliency), width, height)
+    # Among (near) ties, prefer the most central window
+    candidates = np.argwhere(sums >= sums.max() - 1e-9 * max(abs(sums.max()), 1))
+    middle = (np.array(sums.shape) - 1) / 2
+    top, left = candidates[np.argmin(((candidates - middle) ** 2).sum(axis=1))]
+    return int(left), int(top)
+
+
+def find_crop(img, aspect=1.0):
+    """Return the ``(left, top, right, bottom)`` crop of a PIL image with the given aspect ratio.
+
+    The crop is as large as the image allows, positioned over its most
+    salient region.
+    """
+    width, height = img.size
+    crop_width = min(width, round(height * aspect))
+    crop_height = min(height, round(width / aspect))
+    if (crop_width, crop_height) == (width, height):
+        return (0, 0, width, height)
+
+    small = img.convert('RGB')
+    small.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    if min(small.size) < MIN_ANALYSIS_SIZE:
+        left = (width - crop_width) // 2
+        top = (height - crop_height) // 2
+        return (left, top, left + crop_width, top + crop_height)
+
+    scale_x = width / small.width
+    scale_y = height / small.height
+    rgb = np.asarray(small, dtype=np.float32) / 255
+
+    window_width = min(small.width, max(1, round(crop_width / scale_x)))
+    window_height = min(small.height, max(1, round(crop_height / scale_y)))
+    left, top = best_window(saliency_map(rgb), window_width, window_height)
+
+    # Map the window's centre back, so rounding in the small copy doesn't shift it
+    left = round((left + window_width / 2) * scale_x - crop_width / 2)
+    top = round((top + window_height / 2) * scale_y - crop_height / 2)
+    left = min(max(left, 0), width - crop_width)
+    top = min(max(top, 0), height - crop_height)
+    return (left, top, left + crop_width, top + crop_height)
@@ -4,35 +4,217 @@ document.addEventListener('DOMContentLoaded', () => {
     const modal = document.querySelector('.modal');
     const modalImg = document.querySelector('.modal-image');
     let currentImageIndex = 0;
-    let images = [];
-
-    // Fetch and display gallery images
-    const loadGallery = async () => {
-        try {
-            const response = await fetch('/gallery');
-            images = await response.json();
-            
-            gallery.innerHTML = images.map((image, index) => `
-                <div class="gallery-item">
-                    <img src="${image.url}" 
-                         alt="Gallery image" 
-                         class="gallery-image" 
-                         loading="lazy"
-                         data-index="${index}"
-                         onclick="openModal(${index})">
-                </div>
-            `).join('');
-        } catch (error) {
-            console.error('Error loading gallery:', error);
+
+    // Gallery data is fetched a page at a time and cached by index
+    const pageSize = gallery ? Number(gallery.dataset.pageSize) || 24 : 24;
+    const pageUrl = gallery ? gallery.dataset.pageUrl : '/gallery?page={page}&per_page={per_page}';
+    const images = [];
+    let total = gallery ? Number(gallery.dataset.total) || 0 : 0;
+    let pageRequests = new Map();
+
+    const pageOf = (index) => Math.floor(index / pageSize) + 1;
+
+    const loadPage = (page) => {
+        if (!pageRequests.has(page)) {
+            const url = pageUrl.replace('{page}', page).replace('{per_page}', pageSize);
+            const request = fetch(url)
+                .then(response => response.json())
+                .then(data => {
+                    const start = (data.page - 1) * data.per_page;
+                    data.images.forEach((image, i) => {
+                        images[start + i] = image;
+                    });
+                    if (data.total !== total) {
+                        total = data.total;
+                        images.length = Math.min(images.length, total);
+                        updateLayout();
+                    }
+                    scheduleRender();
+                })
+                .catch(error => {
+                    pageRequests.delete(page);
+                    console.error('Error loading gallery:', error);
+                });
+            pageRequests.set(page, request);
+        }
+        return pageRequests.get(page);
+    };
+
+    const ensureImage = async (index) => {
+        if (!images[index]) {
+            await loadPage(pageOf(index));
+        }
+        return images[index];
+    };
+
+    // Virtualized grid: only the tiles in (or near) the viewport exist in
+    // the DOM, and tiles that scroll out are reused for the ones scrolling in.
+    const OVERSCAN_ROWS = 2;
+    const tiles = new Map();
+    const freeTiles = [];
+    let layout = null;
+    let renderPending = false;
+
+    const updateLayout = () => {
+        if (!gallery) return;
+        const narrow = window.matchMedia('(max-width: 768px)').matches;
+        const columns = window.matchMedia('(max-width: 480px)').matches ? 1 : (narrow ? 2 : 3);
+        const gap = narrow ? 15 : 20;
+        const padding = parseFloat(getComputedStyle(gallery).paddingLeft) || 0;
+        const size = (gallery.clientWidth - 2 * padding - gap * (columns - 1)) / columns;
+        layout = { columns, gap, padding, size, row: size + gap };
+
+        const rows = Math.ceil(total / columns);
+        gallery.style.height = rows ? `${rows * layout.row - gap + 2 * padding}px` : '';
+    };
+
+    const createTile = () => {
+        const tile = document.createElement('div');
+        tile.className = 'gallery-item gallery-tile';
+        const img = document.createElement('img');
+        img.className = 'gallery-image';
+        img.alt = 'Gallery image';
+        img.decoding = 'async';
+        img.addEventListener('load', () => img.classList.add('loaded'));
+        tile.appendChild(img);
+        gallery.appendChild(tile);
+        return tile;
+    };
+
+    const placeTile = (tile, index) => {
+        const column = index % layout.columns;
+        const row = Math.floor(index / layout.columns);
+        const x = layout.padding + column * (layout.size + layout.gap);
+        const y = layout.padding + row * layout.row;
+        tile.dataset.index = index;
+        tile.hidden = false;
+        tile.style.width = `${layout.size}px`;
+        tile.style.height = `${layout.size}px`;
+        tile.style.transform = `translate(${x}px, ${y}px)`;
+
+        const img = tile.firstChild;
+        const image = images[index];
+        if (!image) {
+            img.removeAttribute('src');
+            img.classList.remove('loaded');
+        } else if (img.getAttribute('src') !== (image.tile_url || image.url)) {
+            // Tiles are pre-cropped squares; the modal shows the full image
+            img.classList.remove('loaded');
+            img.src = image.tile_url || image.url;
+        }
+    };
+
+    const renderWindow = () => {
+        renderPending = false;
+        if (!layout || !total) return;
+
+        const top = gallery.getBoundingClientRect().top + layout.padding;
+        const firstRow = Math.max(0, Math.floor(-top / layout.row) - OVERSCAN_ROWS);
+        const lastRow = Math.floor((window.innerHeight - top) / layout.row) + OVERSCAN_ROWS;
+        const first = firstRow * layout.columns;
+        const last = Math.min(total - 1, (lastRow + 1) * layout.columns - 1);
+
+        tiles.forEach((tile, index) => {
+            if (index < first || index > last) {
+                tiles.delete(index);
+                tile.hidden = true;
+                freeTiles.push(tile);
+            }
+        });
+
+        for (let index = first; index <= last; index++) {
+            loadPage(pageOf(index));
+            let tile = tiles.get(index);
+            if (!tile) {
+                tile = freeTiles.pop() || createTile();
+                tiles.set(index, tile);
+            }
+            placeTile(tile, index);
+        }
+    };
+
+    const scheduleRender = () => {
+        if (!renderPending) {
+            renderPending = true;
+            requestAnimationFrame(renderWindow);
+        }
+    };
+
+    const initGallery = () => {
+        if (!gallery) return;
+
+        // Seed the cache with the server-rendered first page
+        gallery.querySelectorAll('.gallery-image').forEach((img, index) => {
+            images[index] = { filename: img.dataset.filename, url: img.dataset.full, tile_url: img.getAttribute('src') };
+        });
+        if (images.length) {
+            pageRequests.set(1, Promise.resolve());
+        }
+
+        gallery.innerHTML = '';
+        gallery.classList.add('gallery-virtual');
+        updateLayout();
+        scheduleRender();
+
+        window.addEventListener('scroll', scheduleRender, { passive: true });
+        window.addEventListener('resize', () => {
+            updateLayout();
+            tiles.forEach((tile, index) => placeTile(tile, index));
+            scheduleRender();
+        });
+        gallery.addEventListener('click', (e) => {
+            const tile = e.target.closest('.gallery-tile');
+            if (tile) openModal(Number(tile.dataset.index));
+        });
+    };
+
+    // Refetch pages, e.g. after an upload. Stale tiles stay visible until
+    // their page has been reloaded.
+    const reloadGallery = () => {
+        pageRequests = new Map();
+        loadPage(1);
+        scheduleRender();
+    };
+
+    // Modal functions: neighbouring full-size images are downloaded and
+    // decoded ahead of time so next/previous is instant.
+    const PREFETCH_DISTANCE = 2;
+    const prefetched = new Map();
+
+    const prefetch = async (index) => {
+        const image = await ensureImage((index + total) % total);
+        if (!image || prefetched.has(image.url)) return;
+
+        const img = new Image();
+        img.decoding = 'async';
+        img.src = image.url;
+        img.decode().catch(() => {});
+        prefetched.set(image.url, img);
+
+        // Keep only the most recent neighbours alive
+        while (prefetched.size > PREFETCH_DISTANCE * 2 + 1) {
+            prefetched.delete(prefetched.keys().next().value);
+        }
+    };
+
+    const showImage = async (index) => {
+        if (!total) return;
+        currentImageIndex = (index + total) % total;
+        const shown = currentImageIndex;
+        const image = await ensureImage(shown);
+        if (image && shown === currentImageIndex) {
+            modalImg.src = image.url;
+        }
+        for (let distance = 1; distance <= PREFETCH_DISTANCE; distance++) {
+            prefetch(shown + distance);
+            prefetch(shown - distance);
         }
     };
 
-    // Modal functions
     window.openModal = (index) => {
-        currentImageIndex = index;
         modal.style.display = 'block';
-        modalImg.src = images[index].url;
         document.body.style.overflow = 'hidden';
+        showImage(index);
     };
 
     window.closeModal = () => {
@@ -40,19 +222,13 @@ document.addEventListener('DOMContentLoaded', () => {
         document.body.style.overflow = 'auto';
     };
 
-    window.nextImage = () => {
-        currentImageIndex = (currentImageIndex + 1) % images.length;
-        modalImg.src = images[currentImageIndex].url;
-    };
+    window.nextImage = () => showImage(currentImageIndex + 1);
 
-    window.prevImage = () => {
-        currentImageIndex = (currentImageIndex - 1 + images.length) % images.length;
-        modalImg.src = images[currentImageIndex].url;
-    };
+    window.prevImage = () => showImage(currentImageIndex - 1);
 
     // Keyboard navigation
     document.addEventListener('keydown', (e) => {
-        if (modal.style.display === 'block') {
+        if (modal && modal.style.display === 'block') {
             if (e.key === 'Escape') closeModal();
             if (e.key === 'ArrowRight') nextImage();
             if (e.key === 'ArrowLeft') prevImage();
@@ -65,16 +241,16 @@ document.addEventListener('DOMContentLoaded', () => {
         uploadForm.addEventListener('submit', async (e) => {
             e.preventDefault();
             const formData = new FormData(uploadForm);
-            
+
             try {
                 const response = await fetch('/upload', {
                     method: 'POST',
                     body: formData
                 });
-                
+
                 const result = await response.json();
                 if (result.success) {
-                    loadGallery();
+                    reloadGallery();
                     uploadForm.reset();
                 } else {
                     alert('Upload failed: ' + result.error);
@@ -93,20 +269,24 @@ document.addEventListener('DOMContentLoaded', () => {
             e.preventDefault();
             const formData = new FormData(contactForm);
             const data = Object.fromEntries(formData.entries());
-            
+            const csrfToken = document.querySelector('meta[name="csrf-token"]');
+
             try {
                 const response = await fetch('/contact', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
+                        'X-CSRFToken': csrfToken ? csrfToken.content : ''
                     },
                     body: JSON.stringify(data)
                 });
-                
+
                 const result = await response.json();
                 if (result.success) {
                     alert('Message sent successfully!');
                     contactForm.reset();
+                } else {
+                    alert('Failed to send message. Please try again.');
                 }
             } catch (error) {
                 console.error('Error:', error);
@@ -116,7 +296,19 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // Initialize gallery
-    loadGallery();
+    initGallery();
+
+    // Offline cache for repeat visits; it tells us when the gallery changed
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register('/sw.js').catch(error => {
+            console.error('Service worker registration failed:', error);
+        });
+        navigator.serviceWorker.addEventListener('message', (e) => {
+            if (e.data && e.data.type === 'gallery-updated') {
+                reloadGallery();
+            }
+        });
+    }
 
     // Lazy loading for images
     if ('IntersectionObserver' in window) {
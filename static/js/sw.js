@@ -0,0 +1,188 @@
+// Service worker for the public gallery.
+//
+// - The app shell (CSS, JS, hero image) is precached and served
+//   stale-while-revalidate.
+// - The landing page is served network-first: it embeds the session's
+//   CSRF token, so a cached copy is only used when offline.
+// - Gallery JSON is served stale-while-revalidate. The server tags every
+//   response with X-Gallery-Version; when a revalidation sees a new
+//   version, the other cached gallery pages are dropped and open pages
+//   are told to refresh.
+// - Versioned gallery images (?v=...) never change, so they are served
+//   cache-first from an LRU cache bounded by entry count and bytes.
+
+const SHELL_CACHE = 'portfolio-shell-v2';
+const GALLERY_CACHE = 'portfolio-gallery-v1';
+const IMAGE_CACHE = 'portfolio-images-v1';
+const CURRENT_CACHES = [SHELL_CACHE, GALLERY_CACHE, IMAGE_CACHE];
+
+const SHELL_URLS = [
+    '/static/css/style.css',
+    '/static/js/main.js',
+    '/static/images/hero-bg.jpg'
+];
+
+const VERSION_HEADER = 'X-Gallery-Version';
+
+const MAX_IMAGE_ENTRIES = 500;
+const MAX_IMAGE_BYTES = 100 * 1024 * 1024;
+const LRU_INDEX_URL = '/__sw__/image-lru.json';
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(
+        caches.open(SHELL_CACHE)
+            .then(cache => cache.addAll(SHELL_URLS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(keys
+                .filter(key => key.startsWith('portfolio-') && !CURRENT_CACHES.includes(key))
+                .map(key => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+
+    const url = new URL(request.url);
+    const sameOrigin = url.origin === self.location.origin;
+
+    if (sameOrigin && url.pathname.startsWith('/gallery')) {
+        event.respondWith(staleWhileRevalidate(event, GALLERY_CACHE, request, galleryRevalidated));
+    } else if (request.destination === 'image' && url.searchParams.has('v')) {
+        event.respondWith(cachedImage(event));
+    } else if (sameOrigin && request.mode === 'navigate' && url.pathname === '/') {
+        event.respondWith(networkFirst(event, SHELL_CACHE, '/'));
+    } else if (sameOrigin && SHELL_URLS.includes(url.pathname)) {
+        event.respondWith(staleWhileRevalidate(event, SHELL_CACHE, url.pathname));
+    }
+});
+
+async function staleWhileRevalidate(event, cacheName, key, onRevalidated) {
+    const cache = await caches.open(cacheName);
+    const cached = await cache.match(key);
+
+    const network = fetch(event.request).then(async (response) => {
+        if (response.ok) {
+            await cache.put(key, response.clone());
+            if (onRevalidated) {
+                await onRevalidated(cache, key, cached, response);
+            }
+        }
+        return response;
+    });
+    event.waitUntil(network.catch(() => {}));
+
+    return cached || network;
+}
+
+async function networkFirst(event, cacheName, key) {
+    const cache = await caches.open(cacheName);
+    try {
+        const response = await fetch(event.request);
+        if (response.ok) {
+            event.waitUntil(cache.put(key, response.clone()));
+        }
+        return response;
+    } catch (error) {
+        const cached = await cache.match(key);
+        if (cached) return cached;
+        throw error;
+    }
+}
+
+async function galleryRevalidated(cache, key, cached, response) {
+    const before = cached && cached.headers.get(VERSION_HEADER);
+    const after = response.headers.get(VERSION_HEADER);
+    if (!before || !after || before === after) return;
+
+    // Every other cached page was built from the old listing
+    const keys = await cache.keys();
+    await Promise.all(keys
+        .filter(request => request.url !== key.url)
+        .map(request => cache.delete(request)));
+
+    const clients = await self.clients.matchAll({ type: 'window' });
+    clients.forEach(client => client.postMessage({ type: 'gallery-updated', version: after }));
+}
+
+// LRU bookkeeping for the image cache: url -> { size, used }
+let lruIndex = null;
+let lruSave = null;
+
+async function loadLruIndex(cache) {
+    if (!lruIndex) {
+        const stored = await cache.match(LRU_INDEX_URL);
+        const index = new Map(stored ? Object.entries(await stored.json()) : []);
+        // Entries cached before the index was last saved still count
+        (await cache.keys()).forEach(request => {
+            if (!request.url.endsWith(LRU_INDEX_URL) && !index.has(request.url)) {
+                index.set(request.url, { size: 0, used: 0 });
+            }
+        });
+        lruIndex = index;
+    }
+    return lruIndex;
+}
+
+function saveLruIndex(cache) {
+    // Coalesce bursts of hits into a single write
+    if (!lruSave) {
+        lruSave = new Promise(resolve => setTimeout(resolve, 500)).then(() => {
+            lruSave = null;
+            const body = JSON.stringify(Object.fromEntries(lruIndex));
+            return cache.put(LRU_INDEX_URL, new Response(body, {
+                headers: { 'Content-Type': 'application/json' }
+            }));
+        });
+    }
+    return lruSave;
+}
+
+async function evictImages(cache, index) {
+    let bytes = 0;
+    index.forEach(entry => { bytes += entry.size; });
+    if (index.size <= MAX_IMAGE_ENTRIES && bytes <= MAX_IMAGE_BYTES) return;
+
+    const oldestFirst = [...index.entries()].sort((a, b) => a[1].used - b[1].used);
+    for (const [url, entry] of oldestFirst) {
+        if (index.size <= MAX_IMAGE_ENTRIES && bytes <= MAX_IMAGE_BYTES) break;
+        await cache.delete(url);
+        index.delete(url);
+        bytes -= entry.size;
+    }
+}
+
+async function cachedImage(event) {
+    const request = event.request;
+    const cache = await caches.open(IMAGE_CACHE);
+    const index = await loadLruIndex(cache);
+
+    const cached = await cache.match(request);
+    if (cached) {
+        const entry = index.get(request.url) || { size: 0 };
+        index.set(request.url, { size: entry.size, used: Date.now() });
+        event.waitUntil(saveLruIndex(cache));
+        return cached;
+    }
+
+    const response = await fetch(request);
+    // Opaque cross-origin responses have unknown size and are not cached
+    if (response.ok && response.type !== 'opaque') {
+        const copy = response.clone();
+        event.waitUntil((async () => {
+            const blob = await copy.blob();
+            await cache.put(request, new Response(blob, { headers: copy.headers }));
+            index.set(request.url, { size: blob.size, used: Date.now() });
+            await evictImages(cache, index);
+            await saveLruIndex(cache);
+        })());
+    }
+    return response;
+}
@@ -0,0 +1,366 @@
+"""Image storage backends.
+
+Routes never touch the upload folder directly; they go through the
+storage returned by ``get_storage()`` in app.py, which is either a
+:class:`LocalStorage` (a directory on disk) or an :class:`S3Storage`
+(any S3-compatible object store). Names are flat, ``/``-separated keys
+such as ``photo.jpg``; ``list()`` only returns the entries directly
+under the given prefix, so derivative folders stay out of the originals
+listing.
+"""
+
+import logging
+import os
+import posixpath
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# In-progress writes; anything left with this suffix is debris from a crash
+SPOOL_SUFFIX = '.tmp'
+
+
+class StorageError(Exception):
+    pass
+
+
+def _check_name(name):
+    normalized = posixpath.normpath(name)
+    if (not name or name != normalized or normalized.startswith(('/', '../'))
+            or normalized == '..' or '\\' in name):
+        raise StorageError(f'Invalid storage name: {name!r}')
+    return normalized
+
+
+def _as_stream(data):
+    return BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+
+
+class Storage:
+    def save(self, name, data):
+        """Store ``data`` (bytes or a binary file object) under ``name``."""
+        raise NotImplementedError
+
+    def read(self, name):
+        return b''.join(self.stream(name))
+
+    def stream(self, name, chunk_size=CHUNK_SIZE):
+        """Yield the contents of ``name`` in chunks."""
+        raise NotImplementedError
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def stat(self, name):
+        """Return ``(size, mtime_ns)`` for ``name``."""
+        raise NotImplementedError
+
+    def available(self):
+        """Return whether the storage can be listed at all."""
+        return True
+
+    def delete_many(self, names):
+        """Delete ``names`` and return the ones that were removed.
+
+        Object stores cannot tell cheaply whether a key existed, so they
+        report every requested name that didn't fail to delete.
+        """
+        raise NotImplementedError
+
+    def delete(self, name):
+        return bool(self.delete_many([name]))
+
+    def scan(self, prefix=''):
+        """Return sorted ``(name, size, mtime_ns)`` tuples directly under ``prefix``."""
+        raise NotImplementedError
+
+    def iter_scan(self, prefix=''):
+        """Like :meth:`scan`, but yields entries as they are listed."""
+        return iter(self.scan(prefix))
+
+    def list(self, prefix=''):
+        """Return the sorted names directly under ``prefix``."""
+        return [entry[0] for entry in self.scan(prefix)]
+
+    def url(self, name):
+        raise NotImplementedError
+
+    def path(self, name):
+        """Return a local filesystem path for ``name`` if the backend has one."""
+        return None
+
+
+class LocalStorage(Storage):
+    """Storage in a local directory.
+
+    Writes go to a spool file next to the target and are moved into place
+    with ``os.replace``, so readers only ever see a complete old or new
+    file. ``fsync`` controls durability: ``'none'`` leaves flushing to the
+    OS, ``'file'`` syncs the data before the rename and ``'full'`` also
+    syncs the directory so the rename itself survives a power loss.
+    """
+
+    FSYNC_POLICIES = ('none', 'file', 'full')
+
+    def __init__(self, root, base_url='/static/uploads', fsync='file'):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f'Unknown fsync policy: {fsync}')
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip('/')
+        self.fsync = fsync
+
+    def available(self):
+        # An unmounted volume lists as empty rather than failing
+        return os.path.isdir(self.root)
+
+    def path(self, name):
+        return os.path.join(self.root, *_check_name(name).split('/'))
+
+    def save(self, name, data):
+        path = self.path(name)
+        directory, filename = os.path.split(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, spool = tempfile.mkstemp(prefix=f'.{filename}.', suffix=SPOOL_SUFFIX, dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(_as_stream(data), f, CHUNK_SIZE)
+                if self.fsync != 'none':
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.chmod(spool, 0o644)
+            os.replace(spool, path)
+        except BaseException:
+            try:
+                os.remove(spool)
+            except FileNotFoundError:
+                pass
+            raise
+        if self.fsync == 'full' and hasattr(os, 'O_DIRECTORY'):
+            dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def stream(self, name, chunk_size=CHUNK_SIZE):
+        with open(self.path(name), 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def exists(self, name):
+        return os.path.isfile(self.path(name))
+
+    def stat(self, name):
+        stat = os.stat(self.path(name))
+        return stat.st_size, stat.st_mtime_ns
+
+    def delete_many(self, names):
+        deleted = []
+        for name in names:
+            try:
+                os.remove(self.path(name))
+                deleted.append(name)
+            except FileNotFoundError:
+                pass
+        return deleted
+
+    def scan(self, prefix=''):
+        directory, _, start = prefix.rpartition('/')
+        folder = self.path(directory) if directory else self.root
+        try:
+            entries = os.scandir(folder)
+        except FileNotFoundError:
+            return []
+        found = []
+        with entries:
+            for entry in entries:
+                if entry.name.startswith(start) and entry.is_file():
+                    stat = entry.stat()
+                    name = f'{directory}/{entry.name}' if directory else entry.name
+                    found.append((name, stat.st_size, stat.st_mtime_ns))
+        return sorted(found)
+
+    def iter_scan(self, prefix=''):
+        # Only the names are held in memory; sizes are read as we go
+        directory, _, start = prefix.rpartition('/')
+        folder = self.path(directory) if directory else self.root
+        try:
+            names = sorted(name for name in os.listdir(folder) if name.startswith(start))
+        except FileNotFoundError:
+            return
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(folder, name))
+            except FileNotFoundError:
+                continue
+            if os.path.isfile(os.path.join(folder, name)):
+                yield (f'{directory}/{name}' if directory else name), stat.st_size, stat.st_mtime_ns
+
+    def url(self, name):
+        return f'{self.base_url}/{_check_name(name)}'
+
+
+class S3Storage(Storage):
+    """Storage in an S3-compatible bucket.
+
+    ``client`` is a boto3 S3 client (or anything with the same methods).
+    Objects larger than ``part_size`` are uploaded as multipart uploads
+    with up to ``max_workers`` parts in flight at once.
+    """
+
+    DELETE_BATCH = 1000
+
+    def __init__(self, client, bucket, prefix='', public_url=None,
+                 part_size=8 * 1024 * 1024, max_workers=4):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.public_url = (public_url or f'https://{bucket}.s3.amazonaws.com').rstrip('/')
+        self.part_size = part_size
+        self.max_workers = max_workers
+
+    def _key(self, name):
+        return self.prefix + _check_name(name)
+
+    @staticmethod
+    def _is_not_found(error):
+        response = getattr(error, 'response', None) or {}
+        return response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def save(self, name, data):
+        key = self._key(name)
+        stream = _as_stream(data)
+        first = stream.read(self.part_size)
+        second = stream.read(self.part_size)
+        if not second:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=first)
+            return
+        self._multipart_upload(key, stream, [first, second])
+
+    def _read_parts(self, stream, parts):
+        yield from parts
+        while True:
+            chunk = stream.read(self.part_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def _multipart_upload(self, key, stream, parts):
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)['UploadId']
+        # Bound read-ahead so a large upload never sits in memory all at once
+        in_flight = threading.BoundedSemaphore(self.max_workers * 2)
+
+        def upload_part(number, body):
+            try:
+                response = self.client.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                                   PartNumber=number, Body=body)
+                return {'PartNumber': number, 'ETag': response['ETag']}
+            finally:
+                in_flight.release()
+
+        try:
+            futures = []
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for number, body in enumerate(self._read_parts(stream, parts), start=1):
+                    in_flight.acquire()
+                    futures.append(pool.submit(upload_part, number, body))
+            completed = [future.result() for future in futures]
+            self.client.complete_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                                  MultipartUpload={'Parts': completed})
+            logger.info(f"Uploaded {key} in {len(completed)} parts")
+        except Exception:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+    def stream(self, name, chunk_size=CHUNK_SIZE):
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self._key(name))['Body']
+        except Exception as e:
+            if self._is_not_found(e):
+                raise FileNotFoundError(name) from e
+            raise
+        try:
+            while True:
+                chunk = body.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    def _head(self, name):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except Exception as e:
+            if self._is_not_found(e):
+                return None
+            raise
+
+    def exists(self, name):
+        return self._head(name) is not None
+
+    def stat(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['ContentLength'], int(head['LastModified'].timestamp() * 1e9)
+
+    def delete_many(self, names):
+        deleted = []
+        names = list(names)
+        for start in range(0, len(names), self.DELETE_BATCH):
+            batch = names[start:start + self.DELETE_BATCH]
+            response = self.client.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': self._key(name)} for name in batch],
+                'Quiet': True
+            })
+            # Quiet mode only reports the keys that could not be deleted
+            failed = set()
+            for error in (response or {}).get('Errors', []):
+                failed.add(error['Key'])
+                logger.warning(f"Could not delete {error['Key']}: "
+                               f"{error.get('Code')} {error.get('Message', '')}".rstrip())
+            deleted.extend(name for name in batch if self._key(name) not in failed)
+        return deleted
+
+    def scan(self, prefix=''):
+        return sorted(self.iter_scan(prefix))
+
+    def iter_scan(self, prefix=''):
+        # S3 lists keys in order, one page at a time
+        kwargs = {'Bucket': self.bucket, 'Prefix': self.prefix + prefix, 'Delimiter': '/'}
+        while True:
+            response = self.client.list_objects_v2(**kwargs)
+            for obj in response.get('Contents', []):
+                yield (obj['Key'][len(self.prefix):], obj['Size'],
+                       int(obj['LastModified'].timestamp() * 1e9))
+            if not response.get('IsTruncated'):
+                break
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+    def url(self, name):
+        return f'{self.public_url}/{self._key(name)}'
+
+
+def make_storage(config):
+    backend = config['STORAGE_BACKEND']
+    if backend == 'local':
+        return LocalStorage(config['UPLOAD_FOLDER'], fsync=config.get('STORAGE_FSYNC', 'file'))
+    if backend == 's3':
+        import boto3
+        client = boto3.client('s3',
+                              endpoint_url=config.get('S3_ENDPOINT_URL'),
+                              region_name=config.get('S3_REGION'))
+        return S3Storage(client, config['S3_BUCKET'],
+                         prefix=config.get('S3_PREFIX', ''),
+                         public_url=config.get('S3_PUBLIC_URL'))
+    raise ValueError(f'Unknown storage backend: {backend}')
@@ -1,14 +1,14 @@
 import os
 import pytest
-from app import app, db, User
+from app import create_app, db, User
 from PIL import Image
 from io import BytesIO
 
 @pytest.fixture
 def test_client():
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-    app.config['WTF_CSRF_ENABLED'] = False
+    app = create_app({'TESTING': True,
+                      'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+                      'WTF_CSRF_ENABLED': False})
     
     # Create a test upload folder
     test_upload_folder = os.path.join(app.static_folder, 'test_uploads')
@@ -0,0 +1,212 @@
+import unittest
+from sqlalchemy.exc import IntegrityError
+from app import create_app, db, User, AlbumImage, get_storage, record_image
+from fractional_index import key_between, keys_between, validate_key
+import os
+import shutil
+import tempfile
+from PIL import Image
+import json
+
+class TestFractionalIndex(unittest.TestCase):
+    def test_key_between_orders_keys(self):
+        """Test generated keys sort between their neighbours"""
+        first = key_between(None, None)
+        after = key_between(first, None)
+        before = key_between(None, first)
+        middle = key_between(first, after)
+        self.assertEqual(sorted([after, middle, before, first]), [before, first, middle, after])
+
+    def test_repeated_inserts_stay_ordered(self):
+        """Test repeatedly inserting at the same spot keeps a strict order"""
+        low, high = key_between(None, None), None
+        high = key_between(low, None)
+        keys = [low, high]
+        for _ in range(50):
+            high = key_between(low, high)
+            keys.append(high)
+        self.assertEqual(len(set(keys)), len(keys))
+        for key in keys:
+            validate_key(key)
+
+    def test_appends_and_prepends_stay_short(self):
+        """Test adding hundreds of items at either end keeps keys short"""
+        keys = [key_between(None, None)]
+        for _ in range(500):
+            keys.append(key_between(keys[-1], None))
+            keys.insert(0, key_between(None, keys[0]))
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertLessEqual(max(len(key) for key in keys), 4)
+
+    def test_keys_between_bulk(self):
+        """Test bulk key generation is ascending and short"""
+        keys = keys_between(None, None, 100)
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(len(set(keys)), 100)
+        self.assertLessEqual(max(len(key) for key in keys), 3)
+
+    def test_rejects_out_of_order_bounds(self):
+        """Test bounds must be ordered"""
+        with self.assertRaises(ValueError):
+            key_between('b', 'a')
+
+class TestAlbums(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.db_path,
+                                'TESTING': True,
+                                'WTF_CSRF_ENABLED': False})
+
+        self.test_upload_folder = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_folder
+
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            test_user = User(username='test_admin')
+            test_user.set_password('test_password')
+            db.session.add(test_user)
+            db.session.commit()
+
+        self.client.post('/login', data={
+            'username': 'test_admin',
+            'password': 'test_password'
+        })
+
+        self.filenames = [f'test{i}.jpg' for i in range(4)]
+        for filename in self.filenames:
+            img = Image.new('RGB', (10, 10), color='red')
+            img.save(os.path.join(self.test_upload_folder, filename), 'JPEG')
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+
+        shutil.rmtree(self.test_upload_folder)
+
+    def _create_album(self, title='Weddings'):
+        response = self.client.post('/albums', json={'title': title})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)['album']
+
+    def _album_filenames(self, slug, **params):
+        response = self.client.get(f'/albums/{slug}', query_string=params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)
+
+    def test_create_and_list_albums(self):
+        """Test albums can be created and listed"""
+        album = self._create_album()
+        self.assertEqual(album['slug'], 'weddings')
+        self.assertEqual(self._create_album()['slug'], 'weddings-2')
+
+        data = json.loads(self.client.get('/albums').data)
+        self.assertEqual([a['slug'] for a in data['albums']], ['weddings', 'weddings-2'])
+
+    def test_add_images_keeps_order(self):
+        """Test images are appended in the given order"""
+        album = self._create_album()
+        response = self.client.post(f"/albums/{album['id']}/images",
+                                    json={'filenames': self.filenames})
+        self.assertEqual(response.status_code, 200)
+
+        data = self._album_filenames(album['slug'])
+        self.assertEqual([i['filename'] for i in data['images']], self.filenames)
+
+    def test_album_images_link_thumbnails(self):
+        """Test catalogued album images come with a thumbnail URL"""
+        with self.app.app_context():
+            record_image(get_storage(), 'test0.jpg')
+        album = self._create_album()
+        self.client.post(f"/albums/{album['id']}/images", json={'filenames': self.filenames[:2]})
+
+        images = self._album_filenames(album['slug'])['images']
+        self.assertTrue(images[0]['thumbnail_url'].startswith('/thumbnails/test0.jpg?v='))
+        self.assertEqual(self.client.get(images[0]['thumbnail_url']).status_code, 200)
+        # Not catalogued yet: the client falls back to the original
+        self.assertNotIn('thumbnail_url', images[1])
+
+    def test_reorder_updates_single_row(self):
+        """Test moving an image only changes that image's position"""
+        album = self._create_album()
+        added = json.loads(self.client.post(f"/albums/{album['id']}/images",
+                                            json={'filenames': self.filenames}).data)['images']
+        before = {i['id']: i['position'] for i in added}
+
+        # Move the last image between the first and second
+        response = self.client.post(f"/albums/{album['id']}/reorder", json={
+            'item_id': added[3]['id'],
+            'prev_id': added[0]['id'],
+            'next_id': added[1]['id']
+        })
+        self.assertEqual(response.status_code, 200)
+
+        data = self._album_filenames(album['slug'])
+        self.assertEqual([i['filename'] for i in data['images']],
+                         ['test0.jpg', 'test3.jpg', 'test1.jpg', 'test2.jpg'])
+        with self.app.app_context():
+            changed = [item.id for item in AlbumImage.query.all()
+                       if item.position != before[item.id]]
+        self.assertEqual(changed, [added[3]['id']])
+
+    def test_reorder_rejects_stale_neighbours(self):
+        """Test reordering with neighbours in the wrong order is rejected"""
+        album = self._create_album()
+        added = json.loads(self.client.post(f"/albums/{album['id']}/images",
+                                            json={'filenames': self.filenames}).data)['images']
+        response = self.client.post(f"/albums/{album['id']}/reorder", json={
+            'item_id': added[0]['id'],
+            'prev_id': added[3]['id'],
+            'next_id': added[1]['id']
+        })
+        self.assertEqual(response.status_code, 409)
+
+    def test_reorder_rejects_gap_taken_since(self):
+        """Test two moves into the same gap can't share a position"""
+        album = self._create_album()
+        added = json.loads(self.client.post(f"/albums/{album['id']}/images",
+                                            json={'filenames': self.filenames}).data)['images']
+        move = {'prev_id': added[0]['id'], 'next_id': added[1]['id']}
+        response = self.client.post(f"/albums/{album['id']}/reorder", json=dict(move, item_id=added[3]['id']))
+        self.assertEqual(response.status_code, 200)
+        # Made from the same stale view, so test3 now sits in that gap
+        response = self.client.post(f"/albums/{album['id']}/reorder", json=dict(move, item_id=added[2]['id']))
+        self.assertEqual(response.status_code, 409)
+
+        with self.app.app_context():
+            positions = [item.position for item in AlbumImage.query.all()]
+            self.assertEqual(len(set(positions)), len(positions))
+            duplicate = AlbumImage(album_id=album['id'], filename='other.jpg', position=positions[0])
+            db.session.add(duplicate)
+            self.assertRaises(IntegrityError, db.session.commit)
+            db.session.rollback()
+
+    def test_album_page_pagination(self):
+        """Test the album page query follows the keyset cursor"""
+        album = self._create_album()
+        self.client.post(f"/albums/{album['id']}/images", json={'filenames': self.filenames})
+
+        first = self._album_filenames(album['slug'], limit=3)
+        self.assertEqual(len(first['images']), 3)
+        self.assertIsNotNone(first['next'])
+
+        second = self._album_filenames(album['slug'], limit=3, after=first['next'])
+        self.assertEqual([i['filename'] for i in second['images']], ['test3.jpg'])
+        self.assertIsNone(second['next'])
+
+    def test_delete_image_removes_album_entries(self):
+        """Test deleting an image drops it from albums"""
+        album = self._create_album()
+        self.client.post(f"/albums/{album['id']}/images", json={'filenames': self.filenames})
+        self.client.post('/delete-image', json={'filename': 'test0.jpg'})
+
+        data = self._album_filenames(album['slug'])
+        self.assertNotIn('test0.jpg', [i['filename'] for i in data['images']])
+
+if __name__ == '__main__':
+    unittest.main()
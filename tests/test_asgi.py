@@ -0,0 +1,140 @@
+import unittest
+from app import create_app, db, User
+from asgi import AsgiBridge, build_environ
+from werkzeug.datastructures import FileStorage
+from werkzeug.test import encode_multipart
+from PIL import Image
+from io import BytesIO
+import asyncio
+import os
+import shutil
+import tempfile
+import json
+
+class TestAsgi(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.db_path,
+                                'TESTING': True,
+                                'WTF_CSRF_ENABLED': False})
+
+        self.test_upload_folder = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_folder
+        self.bridge = AsgiBridge(self.app, max_threads=2, max_body_size=1024 * 1024)
+
+        with self.app.app_context():
+            db.create_all()
+            test_user = User(username='test_admin')
+            test_user.set_password('test_password')
+            db.session.add(test_user)
+            db.session.commit()
+
+    def tearDown(self):
+        self.bridge.executor.shutdown()
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+        shutil.rmtree(self.test_upload_folder)
+
+    def _request(self, method, path, body=b'', headers=(), chunk_size=None, disconnect=False):
+        """Helper method to run one request through the bridge and collect what it sends"""
+        query = b''
+        if '?' in path:
+            path, query = path.split('?', 1)
+            query = query.encode('latin-1')
+        headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        if body:
+            headers.append((b'content-length', str(len(body)).encode('latin-1')))
+        scope = {'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http',
+                 'path': path, 'query_string': query, 'root_path': '', 'headers': headers,
+                 'client': ('127.0.0.1', 5000), 'server': ('localhost', 80)}
+
+        chunk_size = chunk_size or max(len(body), 1)
+        messages = [{'type': 'http.request', 'body': body[i:i + chunk_size],
+                     'more_body': i + chunk_size < len(body)}
+                    for i in range(0, max(len(body), 1), chunk_size)]
+        if disconnect:
+            messages = messages[:1]
+            messages[0]['more_body'] = True
+            messages.append({'type': 'http.disconnect'})
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.bridge(scope, receive, send))
+        return sent
+
+    def _response(self, sent):
+        start = sent[0]
+        headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in start['headers']}
+        return start['status'], headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+    def test_environ(self):
+        """Test ASGI scopes map onto WSGI environs"""
+        scope = {'type': 'http', 'method': 'GET', 'path': '/café', 'query_string': b'a=1',
+                 'headers': [(b'cookie', b'a=1'), (b'cookie', b'b=2'), (b'content-type', b'text/plain')],
+                 'client': ('10.0.0.1', 1234)}
+        environ = build_environ(scope, BytesIO())
+        self.assertEqual(environ['PATH_INFO'], '/café'.encode('utf-8').decode('latin-1'))
+        self.assertEqual(environ['HTTP_COOKIE'], 'a=1; b=2')
+        self.assertEqual(environ['CONTENT_TYPE'], 'text/plain')
+        self.assertEqual(environ['REMOTE_ADDR'], '10.0.0.1')
+
+    def test_gallery(self):
+        """Test the gallery is served the same way as under WSGI"""
+        Image.new('RGB', (10, 10), color='blue').save(os.path.join(self.test_upload_folder, 'a.jpg'))
+        status, headers, body = self._response(self._request('GET', '/gallery?page=1'))
+        self.assertEqual(status, 200)
+        self.assertIn('X-Gallery-Version'.lower(), headers)
+        self.assertEqual(json.loads(body), json.loads(self.app.test_client().get('/gallery?page=1').data))
+
+    def test_upload_keeps_login_semantics(self):
+        """Test uploads stream in chunks and still require a login session"""
+        buffer = BytesIO()
+        Image.new('RGB', (200, 200), color='red').save(buffer, 'JPEG')
+        boundary, body = encode_multipart({'images': FileStorage(BytesIO(buffer.getvalue()), 'test.jpg')})
+        upload_headers = [('Content-Type', f'multipart/form-data; boundary={boundary}')]
+
+        status, headers, _ = self._response(self._request('POST', '/upload', body, upload_headers, chunk_size=512))
+        self.assertEqual(status, 302)
+        self.assertIn('/login', headers['location'])
+
+        status, headers, _ = self._response(self._request(
+            'POST', '/login', b'username=test_admin&password=test_password',
+            [('Content-Type', 'application/x-www-form-urlencoded')]))
+        self.assertEqual(status, 302)
+        cookie = headers['set-cookie'].split(';', 1)[0]
+
+        status, _, data = self._response(self._request(
+            'POST', '/upload', body, upload_headers + [('Cookie', cookie)], chunk_size=512))
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(data)['uploaded_files'], ['test.jpg'])
+        self.assertTrue(os.path.exists(os.path.join(self.test_upload_folder, 'test.jpg')))
+
+    def test_image_delivery_in_chunks(self):
+        """Test files are sent in several body messages"""
+        data = os.urandom(300 * 1024)
+        with open(os.path.join(self.test_upload_folder, 'big.jpg'), 'wb') as f:
+            f.write(data)
+        sent = self._request('GET', '/static/uploads/big.jpg')
+        status, headers, body = self._response(sent)
+        self.assertEqual(status, 200)
+        self.assertEqual(body, data)
+        self.assertGreater(len(sent), 3)
+        self.assertFalse(sent[-1].get('more_body', False))
+
+    def test_rejects_large_and_abandoned_requests(self):
+        """Test oversized bodies get a 413 and abandoned ones no response"""
+        status, _, _ = self._response(self._request('POST', '/upload', b'x' * (1024 * 1024 + 1),
+                                                    chunk_size=64 * 1024))
+        self.assertEqual(status, 413)
+        self.assertEqual(self._request('POST', '/upload', b'x' * 1024, chunk_size=256, disconnect=True), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import unittest
+from app import create_app, db, ContactMessage
+from outbox import OutboxDispatcher, DebugTransport, SMTPTransport, Transport
+from datetime import datetime, timedelta
+import os
+import shutil
+import socketserver
+import tempfile
+import threading
+import json
+
+class FailingTransport(Transport):
+    def send_batch(self, messages):
+        raise ConnectionRefusedError('mail server down')
+
+class SMTPStandIn(socketserver.StreamRequestHandler):
+    """Just enough of SMTP for smtplib to deliver messages."""
+
+    def handle(self):
+        self.wfile.write(b'220 localhost ESMTP\r\n')
+        lines = None
+        for line in self.rfile:
+            if lines is not None:
+                if line == b'.\r\n':
+                    self.server.messages.append(b''.join(lines))
+                    lines = None
+                    self.wfile.write(b'250 OK\r\n')
+                else:
+                    lines.append(line)
+                continue
+            command = line[:4].upper()
+            if command == b'DATA':
+                lines = []
+                self.wfile.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+            elif command == b'QUIT':
+                self.wfile.write(b'221 Bye\r\n')
+                break
+            else:
+                self.wfile.write(b'250 OK\r\n')
+
+class TestContactOutbox(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.db_path,
+                                'TESTING': True,
+                                'WTF_CSRF_ENABLED': False})
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+
+    def _submit(self, count=1):
+        for i in range(count):
+            response = self.client.post('/contact', json={
+                'name': f'Visitor {i}',
+                'email': f'visitor{i}@example.com',
+                'message': 'I would like to book a session.'
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(json.loads(response.data)['success'])
+
+    def _statuses(self):
+        with self.app.app_context():
+            return [m.status for m in ContactMessage.query.order_by(ContactMessage.id)]
+
+    def test_contact_queues_message(self):
+        """Test the endpoint only stores the message"""
+        self._submit()
+        self.assertEqual(self._statuses(), ['pending'])
+
+    def test_contact_requires_fields(self):
+        """Test incomplete submissions are rejected"""
+        response = self.client.post('/contact', json={'name': 'Visitor'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._statuses(), [])
+
+    def test_contact_rejects_line_breaks_in_headers(self):
+        """Test a name or email with a line break is rejected"""
+        for field in ('name', 'email'):
+            data = {'name': 'Visitor', 'email': 'visitor@example.com', 'message': 'Hello'}
+            data[field] = data[field][:3] + '\nBcc: x@example.com'
+            response = self.client.post('/contact', json=data)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._statuses(), [])
+
+    def test_bad_message_fails_alone(self):
+        """Test a message that can't be built doesn't fail the rest of its batch"""
+        self._submit(2)
+        with self.app.app_context():
+            db.session.add(ContactMessage(name='Bad\nName', email='bad@example.com', message='Hi'))
+            db.session.commit()
+        self._submit(1)
+        dispatcher = OutboxDispatcher(self.app, db, ContactMessage,
+                                      DebugTransport('portfolio@localhost', 'owner@localhost'), max_attempts=1)
+
+        self.assertEqual(dispatcher.dispatch_once(), 4)
+        self.assertEqual(self._statuses(), ['sent', 'sent', 'failed', 'sent'])
+
+    def test_background_tasks_start_on_first_request(self):
+        """Test the dispatcher only runs in the web process when configured to"""
+        self.client.get('/health-check')
+        self.assertNotIn('outbox', self.app.extensions)
+
+        other = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.db_path,
+                            'TESTING': True,
+                            'BACKGROUND_TASKS': True,
+                            'UPLOAD_FOLDER': tempfile.mkdtemp()})
+        try:
+            other.test_client().get('/health-check')
+            self.assertTrue(other.extensions['outbox']._thread.is_alive())
+            self.assertTrue(other.extensions['reconciler']._thread.is_alive())
+        finally:
+            other.extensions['outbox'].stop()
+            other.extensions['reconciler'].stop()
+            shutil.rmtree(other.config['UPLOAD_FOLDER'])
+
+    def test_dispatch_in_batches(self):
+        """Test the dispatcher delivers due messages in batches"""
+        self._submit(3)
+        transport = DebugTransport('portfolio@localhost', 'owner@localhost')
+        dispatcher = OutboxDispatcher(self.app, db, ContactMessage, transport, batch_size=2)
+
+        self.assertEqual(dispatcher.dispatch_once(), 2)
+        self.assertEqual(dispatcher.dispatch_once(), 1)
+        self.assertEqual(dispatcher.dispatch_once(), 0)
+        self.assertEqual(self._statuses(), ['sent'] * 3)
+        self.assertEqual(transport.sent[0]['Reply-To'], 'visitor0@example.com')
+
+    def test_failed_delivery_backs_off_then_gives_up(self):
+        """Test failures are retried later and eventually marked failed"""
+        self._submit()
+        dispatcher = OutboxDispatcher(self.app, db, ContactMessage, FailingTransport('a@b', 'c@d'),
+                                      max_attempts=2, base_delay=60)
+        now = datetime.utcnow()
+        self.assertEqual(dispatcher.dispatch_once(now=now), 1)
+        with self.app.app_context():
+            message = ContactMessage.query.one()
+            self.assertEqual(message.status, 'pending')
+            self.assertGreater(message.next_attempt_at, now + timedelta(seconds=40))
+            self.assertIn('mail server down', message.last_error)
+
+        # Not due yet
+        self.assertEqual(dispatcher.dispatch_once(now=now), 0)
+        self.assertEqual(dispatcher.dispatch_once(now=now + timedelta(hours=1)), 1)
+        self.assertEqual(self._statuses(), ['failed'])
+
+    def test_smtp_transport_against_local_server(self):
+        """Test SMTP delivery against a local stand-in server"""
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPStandIn)
+        server.messages = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            self._submit(2)
+            transport = SMTPTransport('portfolio@localhost', 'owner@localhost',
+                                      host='127.0.0.1', port=server.server_address[1])
+            dispatcher = OutboxDispatcher(self.app, db, ContactMessage, transport)
+            self.assertEqual(dispatcher.dispatch_once(), 2)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(len(server.messages), 2)
+        self.assertIn(b'Reply-To: visitor1@example.com', server.messages[1])
+        self.assertEqual(self._statuses(), ['sent', 'sent'])
+
+if __name__ == '__main__':
+    unittest.main()
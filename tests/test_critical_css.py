@@ -0,0 +1,82 @@
+import unittest
+from critical_css import CriticalCSS, FOLD_MARKER, extract_critical_css
+import os
+import shutil
+import tempfile
+
+CSS = '''
+/* Layout */
+:root { --accent: red; }
+body { margin: 0; }
+.hero { background: url('../images/hero.jpg') center/cover; animation: fadeIn 1s; }
+.hero:hover { color: blue; }
+.footer { padding: 2rem; }
+.card .title, .hero h1 { font-size: 2rem; }
+@media (max-width: 768px) {
+    .hero h1 { font-size: 1rem; }
+    .footer { padding: 1rem; }
+}
+@media print { .footer { display: none; } }
+@keyframes fadeIn { from { opacity: 0; } to { opacity: 1; } }
+@keyframes slideOut { from { left: 0; } to { left: 100%; } }
+'''
+
+HTML = '<body><header class="hero"><h1>Title</h1></header>'
+
+class TestCriticalCSS(unittest.TestCase):
+    def test_keeps_rules_used_above_the_fold(self):
+        """Test only rules matching the fold markup are kept"""
+        css = extract_critical_css(CSS, HTML, '/static/css/style.css')
+        self.assertIn(':root{--accent: red;}', css)
+        self.assertIn('.card .title, .hero h1{font-size: 2rem;}', css)
+        self.assertIn('@media (max-width: 768px){.hero h1{font-size: 1rem;}}', css)
+        self.assertNotIn('.footer', css)
+        self.assertNotIn('@media print', css)
+        self.assertNotIn(':hover', css)
+
+    def test_keyframes_kept_when_used(self):
+        """Test animations referenced by kept rules come along"""
+        css = extract_critical_css(CSS, HTML)
+        self.assertIn('@keyframes fadeIn', css)
+        self.assertNotIn('slideOut', css)
+
+    def test_relative_urls_resolved(self):
+        """Test URLs are rewritten relative to the stylesheet"""
+        css = extract_critical_css(CSS, HTML, '/static/css/style.css')
+        self.assertIn("url('/static/images/hero.jpg')", css)
+
+    def test_extra_classes(self):
+        """Test classes added by scripts can be declared critical"""
+        self.assertIn('.footer', extract_critical_css(CSS, HTML, extra_classes=['footer']))
+
+class TestCriticalCSSCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stylesheet = os.path.join(self.directory, 'style.css')
+        self.template = os.path.join(self.directory, 'index.html')
+        self._write(self.stylesheet, CSS)
+        self._write(self.template, HTML + FOLD_MARKER + '<footer class="footer"></footer>')
+        self.critical = CriticalCSS(self.stylesheet, '/static/css/style.css')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, path, content, mtime_ns=None):
+        with open(path, 'w') as f:
+            f.write(content)
+        if mtime_ns is not None:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def test_fold_marker(self):
+        """Test markup below the fold is ignored"""
+        self.assertNotIn('.footer', self.critical.for_template(self.template))
+
+    def test_recomputed_when_stylesheet_changes(self):
+        """Test the cache follows the stylesheet version"""
+        first = self.critical.for_template(self.template)
+        self.assertIs(self.critical.for_template(self.template), first)
+        self._write(self.stylesheet, '.hero { color: green; }', mtime_ns=1)
+        self.assertEqual(self.critical.for_template(self.template), '.hero{color: green;}')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+from app import create_app, db
+import os
+import shutil
+import tempfile
+from PIL import Image
+import json
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.db_path,
+                                'TESTING': True,
+                                'WTF_CSRF_ENABLED': False})
+
+        self.test_upload_folder = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_folder
+        self.output_dir = tempfile.mkdtemp()
+
+        with self.app.app_context():
+            db.create_all()
+
+        for i in range(3):
+            self._save_image(f'test{i}.jpg')
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+        shutil.rmtree(self.test_upload_folder)
+        shutil.rmtree(self.output_dir)
+
+    def _save_image(self, filename, size=(10, 10)):
+        img = Image.new('RGB', size, color='blue')
+        img.save(os.path.join(self.test_upload_folder, filename), 'JPEG')
+
+    def _export(self):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['export', '--output', self.output_dir, '--per-page', '2'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result.output
+
+    def _read_json(self, *parts):
+        with open(os.path.join(self.output_dir, *parts)) as f:
+            return json.load(f)
+
+    def test_full_export(self):
+        """Test the export writes pages, gallery JSON and images"""
+        self._export()
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'index.html')))
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'static', 'css', 'style.css')))
+        for i in range(3):
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'static', 'uploads', f'test{i}.jpg')))
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'tiles', f'test{i}.jpg')))
+
+        self.assertEqual(len(self._read_json('gallery.json')), 3)
+        page = self._read_json('gallery', 'page-2.json')
+        self.assertEqual(page['pages'], 2)
+        self.assertEqual([i['filename'] for i in page['images']], ['test2.jpg'])
+
+    def test_rerun_is_incremental(self):
+        """Test re-running without changes writes nothing"""
+        self._export()
+        output = self._export()
+        self.assertIn(' 0 written', output)
+        self.assertIn(' 0 removed', output)
+
+    def test_changed_image_rebuilds_affected_outputs(self):
+        """Test a rotated image only rebuilds its own page and asset"""
+        self._export()
+        page_1 = os.path.join(self.output_dir, 'gallery', 'page-1.json')
+        page_1_mtime = os.stat(page_1).st_mtime_ns
+
+        # Simulate a rotate of the last image
+        self._save_image('test2.jpg', size=(20, 10))
+        output = self._export()
+
+        # The image, its tile, gallery.json, index.html and page 2
+        self.assertIn(' 5 written', output)
+        self.assertEqual(os.stat(page_1).st_mtime_ns, page_1_mtime)
+        with Image.open(os.path.join(self.output_dir, 'static', 'uploads', 'test2.jpg')) as img:
+            self.assertEqual(img.size, (20, 10))
+
+    def test_deleted_image_is_removed(self):
+        """Test deleted images and empty pages are removed from the export"""
+        self._export()
+        os.remove(os.path.join(self.test_upload_folder, 'test2.jpg'))
+        output = self._export()
+
+        self.assertIn(' 3 removed', output)
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'static', 'uploads', 'test2.jpg')))
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'tiles', 'test2.jpg')))
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'gallery', 'page-2.json')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,7 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
 import unittest
 import os
-from app import app, db, User
+from app import create_app, db, User
 from werkzeug.security import generate_password_hash
 import tempfile
 import time
@@ -23,11 +23,11 @@ class TestFunctional(unittest.TestCase):
         cls.browser.implicitly_wait(10)
 
         # Create test app
-        cls.db_fd, app.config['DATABASE'] = tempfile.mkstemp()
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + app.config['DATABASE']
-        app.config['TESTING'] = True
-        app.config['WTF_CSRF_ENABLED'] = False
-        app.config['SERVER_NAME'] = 'localhost:5000'
+        cls.db_fd, cls.db_path = tempfile.mkstemp()
+        app = cls.flask_app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + cls.db_path,
+                                          'TESTING': True,
+                                          'WTF_CSRF_ENABLED': False,
+                                          'SERVER_NAME': 'localhost:5000'})
         cls.app = app.test_client()
         
         # Create database and test user
@@ -46,11 +46,11 @@ class TestFunctional(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         cls.browser.quit()
-        with app.app_context():
+        with cls.flask_app.app_context():
             db.session.remove()
             db.drop_all()
         os.close(cls.db_fd)
-        os.unlink(app.config['DATABASE'])
+        os.unlink(cls.db_path)
 
     def test_navigation_links(self):
         """Test that navigation links work correctly"""
@@ -1,6 +1,10 @@
 import unittest
-from app import app, db, User
+from unittest import mock
+import app as app_module
+import derivatives
+from app import create_app, db, User, Photo, image_lock
 import os
+import shutil
 import tempfile
 from PIL import Image
 from io import BytesIO
@@ -9,21 +13,21 @@ import json
 class TestImageHandling(unittest.TestCase):
     def setUp(self):
         # Create a temporary database and upload folder
-        self.db_fd, app.config['DATABASE'] = tempfile.mkstemp()
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + app.config['DATABASE']
-        app.config['TESTING'] = True
-        app.config['WTF_CSRF_ENABLED'] = False
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.db_path,
+                                'TESTING': True,
+                                'WTF_CSRF_ENABLED': False})
         
         # Create temporary upload folder
         self.test_upload_folder = tempfile.mkdtemp()
-        app.config['UPLOAD_FOLDER'] = self.test_upload_folder
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_folder
         
-        self.client = app.test_client()
+        self.client = self.app.test_client()
         
         # Create test image
         self.test_image = self._create_test_image()
         
-        with app.app_context():
+        with self.app.app_context():
             db.create_all()
             # Create and login test user
             test_user = User(username='test_admin')
@@ -38,20 +42,18 @@ class TestImageHandling(unittest.TestCase):
         })
 
     def tearDown(self):
-        with app.app_context():
+        with self.app.app_context():
             db.session.remove()
             db.drop_all()
         os.close(self.db_fd)
-        os.unlink(app.config['DATABASE'])
+        os.unlink(self.db_path)
         
         # Clean up test upload folder
-        for file in os.listdir(self.test_upload_folder):
-            os.remove(os.path.join(self.test_upload_folder, file))
-        os.rmdir(self.test_upload_folder)
+        shutil.rmtree(self.test_upload_folder)
 
-    def _create_test_image(self):
+    def _create_test_image(self, size=(100, 100)):
         """Helper method to create a test image"""
-        img = Image.new('RGB', (100, 100), color='red')
+        img = Image.new('RGB', size, color='red')
         img_io = BytesIO()
         img.save(img_io, 'JPEG', quality=70)
         img_io.seek(0)
@@ -112,6 +114,24 @@ class TestImageHandling(unittest.TestCase):
         # Verify file is deleted
         self.assertFalse(os.path.exists(os.path.join(self.test_upload_folder, filename)))
 
+    def test_delete_images_batch(self):
+        """Test deleting several images in one request"""
+        for name in ['test1.jpg', 'test2.jpg', 'test3.jpg']:
+            self.client.post('/upload', data={
+                'images': [(self._create_test_image(), name)]
+            }, content_type='multipart/form-data')
+
+        response = self.client.post('/delete-images',
+                                  json={'filenames': ['test1.jpg', 'test3.jpg']},
+                                  content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(sorted(data['deleted']), ['test1.jpg', 'test3.jpg'])
+        self.assertEqual(sorted(os.listdir(self.test_upload_folder)), ['derivatives', 'test2.jpg'])
+        self.assertEqual(os.listdir(os.path.join(self.test_upload_folder, 'derivatives', 'thumb')),
+                         ['test2.jpg'])
+
     def test_rotate_image(self):
         """Test image rotation"""
         # First upload an image
@@ -142,6 +162,22 @@ class TestImageHandling(unittest.TestCase):
             self.assertEqual(original_size[0], rotated_size[1])
             self.assertEqual(original_size[1], rotated_size[0])
 
+    def test_rotate_waits_for_lock(self):
+        """Test an image being edited elsewhere is not rotated concurrently"""
+        self.client.post('/upload', data={
+            'images': [(self.test_image, 'test.jpg')]
+        }, content_type='multipart/form-data')
+
+        self.app.config['LOCK_TIMEOUT'] = 0.05
+        try:
+            with self.app.app_context(), image_lock('test.jpg'):
+                response = self.client.post('/rotate-image',
+                                          json={'filename': 'test.jpg', 'degrees': 90})
+        finally:
+            self.app.config['LOCK_TIMEOUT'] = 10
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(sorted(os.listdir(self.test_upload_folder)), ['derivatives', 'test.jpg'])
+
     def test_get_images(self):
         """Test retrieving image list"""
         # Upload multiple images
@@ -169,6 +205,192 @@ class TestImageHandling(unittest.TestCase):
             self.assertTrue('url' in image)
             self.assertTrue(image['url'].startswith('/static/uploads/'))
 
+    def test_gallery_pagination(self):
+        """Test the gallery endpoint returns pages when asked"""
+        for i in range(3):
+            self.client.post('/upload', data={
+                'images': [(self._create_test_image(), f'test{i}.jpg')]
+            }, content_type='multipart/form-data')
+
+        # Entries are only built for the requested page
+        with mock.patch('app.image_entry', wraps=app_module.image_entry) as image_entry:
+            response = self.client.get('/gallery?page=2&per_page=2')
+        self.assertEqual(image_entry.call_count, 1)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(data['pages'], 2)
+        self.assertEqual([image['filename'] for image in data['images']], ['test2.jpg'])
+
+    def test_index_renders_first_page_only(self):
+        """Test the landing page only renders the first gallery page"""
+        for i in range(3):
+            self.client.post('/upload', data={
+                'images': [(self._create_test_image(), f'test{i}.jpg')]
+            }, content_type='multipart/form-data')
+
+        self.app.config['GALLERY_PAGE_SIZE'] = 2
+        try:
+            response = self.client.get('/')
+        finally:
+            self.app.config['GALLERY_PAGE_SIZE'] = 24
+        self.assertIn(b'data-total="3"', response.data)
+        self.assertIn(b'test1.jpg', response.data)
+        self.assertNotIn(b'test2.jpg', response.data)
+        # The first row is preloaded
+        self.assertIn('/tiles/test0.jpg?v=', response.headers['Link'])
+
+    def test_gallery_version_changes_on_rotate(self):
+        """Test the gallery version header tracks image changes"""
+        self.client.post('/upload', data={
+            'images': [(self.test_image, 'test.jpg')]
+        }, content_type='multipart/form-data')
+
+        before = self.client.get('/gallery')
+        self.assertTrue(before.headers['X-Gallery-Version'])
+        self.assertEqual(self.client.get('/gallery?page=1').headers['X-Gallery-Version'],
+                         before.headers['X-Gallery-Version'])
+
+        # Make sure the rewritten file gets a new mtime
+        os.utime(os.path.join(self.test_upload_folder, 'test.jpg'), ns=(0, 0))
+        self.client.post('/rotate-image', json={'filename': 'test.jpg', 'degrees': 90})
+        after = self.client.get('/gallery')
+        self.assertNotEqual(after.headers['X-Gallery-Version'], before.headers['X-Gallery-Version'])
+        self.assertNotEqual(json.loads(after.data)[0]['url'], json.loads(before.data)[0]['url'])
+
+    def test_versioned_image_is_cacheable(self):
+        """Test versioned gallery URLs are served with long-lived cache headers"""
+        self.client.post('/upload', data={
+            'images': [(self.test_image, 'test.jpg')]
+        }, content_type='multipart/form-data')
+
+        url = json.loads(self.client.get('/gallery').data)[0]['url']
+        self.assertIn('?v=', url)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+    def test_admin_pagination(self):
+        """Test the admin page renders one page of thumbnails"""
+        for i in range(3):
+            self.client.post('/upload', data={
+                'images': [(self._create_test_image(), f'test{i}.jpg')]
+            }, content_type='multipart/form-data')
+
+        response = self.client.get('/admin?page=2&per_page=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Page 2 of 2', response.data)
+        self.assertIn(b'/thumbnails/test2.jpg?v=', response.data)
+        self.assertNotIn(b'test1.jpg', response.data)
+
+    def test_thumbnail_generated_on_demand(self):
+        """Test missing thumbnails are generated when requested"""
+        self.client.post('/upload', data={
+            'images': [(self._create_test_image((1200, 800)), 'test.jpg')]
+        }, content_type='multipart/form-data')
+        thumb_path = os.path.join(self.test_upload_folder, 'derivatives', 'thumb', 'test.jpg')
+        self.assertTrue(os.path.exists(thumb_path))
+        os.remove(thumb_path)
+
+        response = self.client.get('/thumbnails/test.jpg?v=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        with Image.open(BytesIO(response.data)) as img:
+            self.assertEqual(img.size, (480, 320))
+        self.assertTrue(os.path.exists(thumb_path))
+
+        self.assertEqual(self.client.get('/thumbnails/missing.jpg').status_code, 404)
+
+    def test_thumbnail_follows_rotate(self):
+        """Test rotating an image refreshes its thumbnail"""
+        self.client.post('/upload', data={
+            'images': [(self._create_test_image((1200, 800)), 'test.jpg')]
+        }, content_type='multipart/form-data')
+        thumb_path = os.path.join(self.test_upload_folder, 'derivatives', 'thumb', 'test.jpg')
+        os.utime(thumb_path, ns=(0, 0))
+
+        response = self.client.post('/rotate-image', json={'filename': 'test.jpg', 'degrees': 90})
+        thumbnail_url = json.loads(response.data)['thumbnail_url']
+        with Image.open(BytesIO(self.client.get(thumbnail_url).data)) as img:
+            self.assertEqual(img.size, (320, 480))
+
+    def test_thumbnail_rendered_during_rotate_is_discarded(self):
+        """Test a thumbnail rendered from the pre-rotate image does not survive the rotate"""
+        self.client.post('/upload', data={
+            'images': [(self._create_test_image((1200, 800)), 'test.jpg')]
+        }, content_type='multipart/form-data')
+        os.remove(os.path.join(self.test_upload_folder, 'derivatives', 'thumb', 'test.jpg'))
+
+        render = derivatives.render
+        def render_then_rotate(*args, **kwargs):
+            # The rotate lands after the original was decoded
+            rendered = render(*args, **kwargs)
+            if not rotated:
+                rotated.append(self.client.post('/rotate-image', json={'filename': 'test.jpg', 'degrees': 90}))
+            return rendered
+
+        rotated = []
+        with mock.patch('derivatives.render', side_effect=render_then_rotate):
+            response = self.client.get('/thumbnails/test.jpg')
+        self.assertEqual(rotated[0].status_code, 200)
+        with Image.open(BytesIO(response.data)) as img:
+            self.assertEqual(img.size, (320, 480))
+        with Image.open(BytesIO(self.client.get('/thumbnails/test.jpg').data)) as img:
+            self.assertEqual(img.size, (320, 480))
+
+    def test_thin_image_upload(self):
+        """Test a banner a few pixels tall uploads and gets a tile"""
+        response = self.client.post('/upload', data={
+            'images': [(self._create_test_image((2000, 7)), 'banner.jpg')]
+        }, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.data)['success'])
+
+        os.remove(os.path.join(self.test_upload_folder, 'derivatives', 'tile', 'banner.jpg'))
+        with self.app.app_context():
+            Photo.query.filter_by(filename='banner.jpg').delete()
+            db.session.commit()
+        response = self.client.get('/tiles/banner.jpg')
+        self.assertEqual(response.status_code, 200)
+        with Image.open(BytesIO(response.data)) as img:
+            self.assertEqual(img.size, (7, 7))
+
+    def test_tile_cropped_and_cached(self):
+        """Test gallery tiles are square crops whose box is kept in the catalog"""
+        self.client.post('/upload', data={
+            'images': [(self._create_test_image((1200, 800)), 'test.jpg')]
+        }, content_type='multipart/form-data')
+        with self.app.app_context():
+            left, top, right, bottom = Photo.query.filter_by(filename='test.jpg').first().crop
+        # A flat image is cropped (near enough) in the middle
+        self.assertEqual((right - left, top, bottom), (800, 0, 800))
+        self.assertAlmostEqual(left, 200, delta=5)
+
+        tile_path = os.path.join(self.test_upload_folder, 'derivatives', 'tile', 'test.jpg')
+        os.remove(tile_path)
+        response = self.client.get('/tiles/test.jpg?v=1')
+        self.assertEqual(response.status_code, 200)
+        with Image.open(BytesIO(response.data)) as img:
+            self.assertEqual(img.size, (600, 600))
+        self.assertTrue(os.path.exists(tile_path))
+
+        # Rotating invalidates the cached crop
+        response = self.client.post('/rotate-image', json={'filename': 'test.jpg', 'degrees': 90})
+        with Image.open(BytesIO(self.client.get(json.loads(response.data)['tile_url']).data)) as img:
+            self.assertEqual(img.size, (600, 600))
+        with self.app.app_context():
+            left, top, right, bottom = Photo.query.filter_by(filename='test.jpg').first().crop
+        self.assertEqual((left, right, bottom - top), (0, 800, 800))
+
+        self.assertEqual(self.client.get('/tiles/missing.jpg').status_code, 404)
+
+    def test_service_worker_served_from_root(self):
+        """Test the service worker is served from the site root"""
+        response = self.client.get('/sw.js')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('javascript', response.headers['Content-Type'])
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+
     def test_static_file_headers(self):
         """Test static file response headers"""
         # Upload an image
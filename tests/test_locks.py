@@ -0,0 +1,70 @@
+import unittest
+from locks import ImageLocks
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+class TestImageLocks(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.locks = ImageLocks(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_excludes_other_threads(self):
+        """Test a second holder waits until the lock is released"""
+        events = []
+        acquired = threading.Event()
+
+        def hold():
+            with self.locks.lock('a.jpg'):
+                acquired.set()
+                time.sleep(0.1)
+                events.append('first released')
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        acquired.wait()
+        with self.locks.lock('a.jpg', timeout=5):
+            events.append('second acquired')
+        thread.join()
+        self.assertEqual(events, ['first released', 'second acquired'])
+
+    def test_timeout(self):
+        """Test waiting for a held lock times out"""
+        with self.locks.lock('a.jpg'):
+            with self.assertRaises(TimeoutError):
+                with self.locks.lock('a.jpg', timeout=0.05):
+                    pass
+
+    def test_images_lock_independently(self):
+        """Test locks on different images do not block each other"""
+        with self.locks.lock('a.jpg'):
+            with self.locks.lock('b.jpg', timeout=0):
+                pass
+
+    def test_excludes_other_processes(self):
+        """Test the lock is honoured by another process"""
+        code = ('import sys; from locks import ImageLocks\n'
+                'with ImageLocks(sys.argv[1]).lock("a.jpg"):\n'
+                '    print("locked", flush=True); sys.stdin.read()\n')
+        child = subprocess.Popen([sys.executable, '-c', code, self.directory],
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                 cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        try:
+            self.assertEqual(child.stdout.readline().strip(), b'locked')
+            with self.assertRaises(TimeoutError):
+                with self.locks.lock('a.jpg', timeout=0.05):
+                    pass
+        finally:
+            child.communicate()
+        with self.locks.lock('a.jpg', timeout=5):
+            pass
+
+if __name__ == '__main__':
+    unittest.main()
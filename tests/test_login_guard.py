@@ -0,0 +1,140 @@
+import unittest
+from app import create_app, db, User
+from login_guard import LoginGuard, Overloaded, PasswordVerifier, TokenBuckets
+import os
+import tempfile
+import threading
+
+class TestLoginGuard(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.db_path,
+                                'TESTING': True,
+                                'WTF_CSRF_ENABLED': False})
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            test_user = User(username='test_admin')
+            test_user.set_password('test_password')
+            db.session.add(test_user)
+            db.session.commit()
+
+        self.guard = LoginGuard(TokenBuckets(3, 60), TokenBuckets(2, 60), PasswordVerifier(1, 0))
+        self.app.extensions['login_guard'] = self.guard
+
+    def tearDown(self):
+        self.app.extensions.pop('login_guard', None)
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+
+    def _login(self, password, username='test_admin'):
+        return self.client.post('/login', data={'username': username, 'password': password})
+
+    def test_token_buckets(self):
+        """Test buckets empty, refill over time and forget idle keys"""
+        buckets = TokenBuckets(2, 60, max_keys=2)
+        self.assertEqual(buckets.take('a', now=0), 0)
+        self.assertEqual(buckets.take('a', now=0), 0)
+        self.assertAlmostEqual(buckets.take('a', now=0), 1)
+        self.assertEqual(buckets.take('a', now=1), 0)
+
+        buckets.give_back('a', now=1)
+        self.assertEqual(buckets.take('a', now=1), 0)
+
+        # 'a' has refilled by the time the table is full
+        buckets.take('b', now=5)
+        buckets.take('c', now=5)
+        self.assertNotIn('a', buckets._buckets)
+
+    def test_spraying_keys_keeps_draining_buckets(self):
+        """Test new keys can't evict a bucket that is still throttled"""
+        buckets = TokenBuckets(2, 60, max_keys=3)
+        buckets.take('victim', now=0)
+        buckets.take('victim', now=0)
+        for i in range(10):
+            buckets.take(f'spray{i}', now=0)
+        self.assertIn('victim', buckets._buckets)
+        self.assertAlmostEqual(buckets.take('victim', now=0), 1)
+        # The table is full of draining buckets, so new keys share the overflow bucket
+        self.assertEqual(len(buckets._buckets), 3)
+        self.assertAlmostEqual(buckets.take('new', now=0), 1)
+        self.assertAlmostEqual(buckets.take('other', now=0), 1)
+        self.assertEqual(buckets.take('new', now=2), 0)
+        self.assertIn('new', buckets._buckets)
+
+    def test_refill_heap_stays_bounded(self):
+        """Test repeated attempts on tracked keys don't grow the refill heap"""
+        buckets = TokenBuckets(2, 60, max_keys=3)
+        for i in range(100):
+            buckets.take(f'key{i % 3}', now=i / 10)
+            buckets.give_back(f'key{i % 3}', now=i / 10)
+        self.assertLessEqual(len(buckets._refills), 6)
+        self.assertEqual(buckets.take('new', now=20), 0)
+        self.assertEqual(len(buckets._buckets), 3)
+
+    def test_verifier_refuses_when_full(self):
+        """Test checks beyond the pool and queue are refused without waiting"""
+        verifier = PasswordVerifier(workers=1, queue_limit=0, timeout=0.05)
+        release = threading.Event()
+        self.assertTrue(verifier.verify(lambda: True))
+
+        self.assertRaises(Overloaded, verifier.verify, release.wait)
+        # Still running, so the slot stays taken
+        self.assertRaises(Overloaded, verifier.verify, lambda: True)
+        release.set()
+        for _ in range(100):
+            try:
+                self.assertTrue(verifier.verify(lambda: True))
+                break
+            except Overloaded:
+                threading.Event().wait(0.01)
+        else:
+            self.fail('Slot was never released')
+
+    def test_failed_logins_are_throttled(self):
+        """Test repeated failures are rejected before the password is checked"""
+        for _ in range(2):
+            self.assertEqual(self._login('wrong').status_code, 200)
+        response = self._login('test_password')
+        self.assertEqual(response.status_code, 429)
+        # One token a second
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertIn(b'Too many login attempts', response.data)
+
+        # The IP still has a token for other usernames
+        self.assertEqual(self._login('wrong', username='someone').status_code, 200)
+        self.assertEqual(self._login('wrong', username='someone else').status_code, 429)
+
+    def test_successful_login_is_not_counted(self):
+        """Test successful logins give their tokens back"""
+        for _ in range(5):
+            self.assertEqual(self._login('test_password').status_code, 302)
+            self.client.get('/logout')
+
+    def test_busy_verifier_returns_503(self):
+        """Test logins are refused while every verifier slot is busy"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_check():
+            started.set()
+            return release.wait()
+
+        worker = threading.Thread(target=self.guard.verifier.verify, args=(slow_check,))
+        worker.start()
+        try:
+            started.wait()
+            response = self._login('test_password')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '1')
+            self.assertIn(b'The server is busy', response.data)
+        finally:
+            release.set()
+            worker.join()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import unittest
+from app import create_app, db, User, Photo
+from optimize import recompress, ssim, DEFAULT_POLICY
+from PIL import Image
+from io import BytesIO
+import numpy as np
+import os
+import shutil
+import tempfile
+import json
+
+class TestOptimize(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.db_path,
+                                'TESTING': True,
+                                'WTF_CSRF_ENABLED': False})
+
+        self.test_upload_folder = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_folder
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            test_user = User(username='test_admin')
+            test_user.set_password('test_password')
+            db.session.add(test_user)
+            db.session.commit()
+        self.client.post('/login', data={'username': 'test_admin', 'password': 'test_password'})
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+        shutil.rmtree(self.test_upload_folder)
+        shutil.rmtree(os.path.dirname(self.checkpoint))
+
+    def _photo(self, size=(320, 240)):
+        """Helper method to create a smooth, photo-like image"""
+        y, x = np.mgrid[0:size[1], 0:size[0]]
+        pixels = np.stack([x * 255 // size[0], y * 255 // size[1], (x + y) % 256], axis=-1)
+        return Image.fromarray(pixels.astype(np.uint8))
+
+    def _path(self, *parts):
+        return os.path.join(self.test_upload_folder, *parts)
+
+    def _optimize(self, *args):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['optimize-library', '--workers', '1', '--checkpoint', self.checkpoint, *args])
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result.output
+
+    def test_ssim(self):
+        """Test the perceptual score drops as images diverge"""
+        a = np.asarray(self._photo().convert('L'), dtype=np.float32)
+        noisy = a + np.random.default_rng(0).normal(0, 20, a.shape)
+        self.assertAlmostEqual(ssim(a, a), 1.0)
+        self.assertLess(ssim(a, noisy), 0.9)
+
+    def test_recompress_policy(self):
+        """Test JPEGs come back progressive and smaller, or not at all"""
+        buffer = BytesIO()
+        self._photo().save(buffer, 'JPEG', quality=95)
+        result = recompress(buffer.getvalue(), DEFAULT_POLICY)
+        self.assertLess(len(result), len(buffer.getvalue()))
+        with Image.open(BytesIO(result)) as img:
+            self.assertTrue(img.info.get('progressive'))
+            self.assertGreaterEqual(ssim(np.asarray(self._photo().convert('L'), dtype=np.float32),
+                                         np.asarray(img.convert('L'), dtype=np.float32)), 0.985)
+
+        # Already as small as the policy allows
+        self.assertIsNone(recompress(result, DEFAULT_POLICY))
+
+    def test_optimizes_library(self):
+        """Test originals and derivatives are rewritten and the catalog follows"""
+        buffer = BytesIO()
+        self._photo().save(buffer, 'JPEG', quality=95)
+        buffer.seek(0)
+        self.client.post('/upload', data={'images': [(buffer, 'test.jpg')]},
+                         content_type='multipart/form-data')
+        self._photo().save(self._path('big.jpg'), 'JPEG', quality=95)
+        self._photo().save(self._path('flat.png'))
+        before = os.path.getsize(self._path('big.jpg'))
+
+        output = self._optimize()
+        self.assertIn('of 5 files', output)
+        self.assertLess(os.path.getsize(self._path('big.jpg')), before)
+        with Image.open(self._path('big.jpg')) as img:
+            self.assertTrue(img.info.get('progressive'))
+            self.assertEqual(img.size, (320, 240))
+        with self.app.app_context():
+            photo = Photo.query.filter_by(filename='test.jpg').first()
+            self.assertEqual(photo.size, os.path.getsize(self._path('test.jpg')))
+            self.assertIsNotNone(photo.crop)
+
+        with open(self.checkpoint) as f:
+            files = json.load(f)['files']
+        self.assertEqual(sorted(files), ['big.jpg', 'derivatives/thumb/test.jpg',
+                                         'derivatives/tile/test.jpg', 'flat.png', 'test.jpg'])
+        saved = sum(entry['before'] - entry['after'] for entry in files.values())
+        self.assertIn(f'{saved} bytes saved', output)
+        self.assertGreater(saved, 0)
+
+        # Optimized derivatives are newer than their original, so they are kept
+        thumb_mtime = os.stat(self._path('derivatives', 'thumb', 'test.jpg')).st_mtime_ns
+        self.client.get('/thumbnails/test.jpg')
+        self.assertEqual(os.stat(self._path('derivatives', 'thumb', 'test.jpg')).st_mtime_ns, thumb_mtime)
+
+    def test_derivatives_not_left_older_than_originals(self):
+        """Test a derivative that can't shrink is kept but made current again"""
+        buffer = BytesIO()
+        self._photo().save(buffer, 'JPEG', quality=95)
+        buffer.seek(0)
+        self.client.post('/upload', data={'images': [(buffer, 'test.jpg')]},
+                         content_type='multipart/form-data')
+        thumb = self._path('derivatives', 'thumb', 'test.jpg')
+        # Already as small as the policy allows
+        with open(thumb, 'rb') as f:
+            data = f.read()
+        data = recompress(data, DEFAULT_POLICY) or data
+        with open(thumb, 'wb') as f:
+            f.write(data)
+
+        self._optimize()
+        with open(thumb, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        thumb_mtime = os.stat(thumb).st_mtime_ns
+        self.assertGreaterEqual(thumb_mtime, os.stat(self._path('test.jpg')).st_mtime_ns)
+        with open(self.checkpoint) as f:
+            entry = json.load(f)['files']['derivatives/thumb/test.jpg']
+        self.assertEqual(entry['status'], 'unchanged')
+
+        self.client.get('/thumbnails/test.jpg')
+        self.assertEqual(os.stat(thumb).st_mtime_ns, thumb_mtime)
+
+    def test_resumes_from_checkpoint(self):
+        """Test files recorded in the checkpoint are skipped until they change"""
+        for name in ['a.jpg', 'b.jpg']:
+            self._photo().save(self._path(name), 'JPEG', quality=95)
+        self._optimize()
+        mtimes = {name: os.stat(self._path(name)).st_mtime_ns for name in ['a.jpg', 'b.jpg']}
+        # Totals cover the whole job, including earlier runs
+        self.assertIn('Optimized 2 of 2 files', self._optimize())
+        self.assertEqual(os.stat(self._path('a.jpg')).st_mtime_ns, mtimes['a.jpg'])
+        self.assertEqual(os.stat(self._path('b.jpg')).st_mtime_ns, mtimes['b.jpg'])
+
+        self._photo((200, 200)).save(self._path('b.jpg'), 'JPEG', quality=95)
+        size = os.path.getsize(self._path('b.jpg'))
+        self._optimize()
+        self.assertLess(os.path.getsize(self._path('b.jpg')), size)
+        self.assertEqual(os.stat(self._path('a.jpg')).st_mtime_ns, mtimes['a.jpg'])
+
+        # A restart forgets the checkpoint and starts new totals
+        sizes = {name: os.path.getsize(self._path(name)) for name in ['a.jpg', 'b.jpg']}
+        self._optimize('--restart')
+        with open(self.checkpoint) as f:
+            files = json.load(f)['files']
+        self.assertEqual({name: entry['before'] for name, entry in files.items()}, sizes)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+from app import create_app, db, User, Photo
+from palette import PaletteIndex, extract_palette, pack_palette, parse_color, unpack_palette
+from PIL import Image
+from io import BytesIO
+import os
+import shutil
+import tempfile
+import json
+
+class TestPalette(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.db_path,
+                                'TESTING': True,
+                                'WTF_CSRF_ENABLED': False})
+
+        self.test_upload_folder = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_folder
+        self.client = self.app.test_client()
+        self.app.extensions.pop('palette_index', None)
+
+        with self.app.app_context():
+            db.create_all()
+            test_user = User(username='test_admin')
+            test_user.set_password('test_password')
+            db.session.add(test_user)
+            db.session.commit()
+        self.client.post('/login', data={'username': 'test_admin', 'password': 'test_password'})
+
+    def tearDown(self):
+        self.app.extensions.pop('palette_index', None)
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+        shutil.rmtree(self.test_upload_folder)
+
+    def _two_tone(self, main, accent, size=(100, 100)):
+        """Helper method to create an image that is 3/4 one colour"""
+        img = Image.new('RGB', size, color=main)
+        img.paste(accent, (0, 0, size[0], size[1] // 4))
+        return img
+
+    def _upload(self, filename, img):
+        buffer = BytesIO()
+        img.save(buffer, 'PNG')
+        buffer.seek(0)
+        self.client.post('/upload', data={'images': [(buffer, filename)]},
+                         content_type='multipart/form-data')
+
+    def test_extract_palette(self):
+        """Test k-means finds the dominant colours and their shares"""
+        colors, weights = unpack_palette(extract_palette(self._two_tone((200, 20, 20), (20, 20, 200))))
+        self.assertEqual(len(colors), 2)
+        self.assertEqual(tuple(colors[0]), (200, 20, 20))
+        self.assertEqual(tuple(colors[1]), (20, 20, 200))
+        self.assertAlmostEqual(weights[0], 0.75, delta=0.01)
+
+        packed = pack_palette([(1, 2, 3)], [0.5])
+        self.assertEqual(len(packed), 4)
+        self.assertEqual(parse_color('#f80'), (255, 136, 0))
+        self.assertRaises(ValueError, parse_color, 'red')
+
+    def test_index_nearest_and_hue_order(self):
+        """Test colour queries and hue ordering over the index"""
+        index = PaletteIndex()
+        rows = [('blue.png', 1, extract_palette(Image.new('RGB', (8, 8), (30, 60, 220)))),
+                ('grey.png', 1, extract_palette(Image.new('RGB', (8, 8), (128, 128, 128)))),
+                ('red.png', 1, extract_palette(self._two_tone((220, 30, 30), (30, 60, 220)))),
+                ('green.png', 1, extract_palette(Image.new('RGB', (8, 8), (40, 200, 60))))]
+        index.refresh('v1', lambda: rows)
+
+        matches = index.nearest((30, 60, 220))
+        self.assertEqual([entry[0] for entry, _ in matches][:2], ['blue.png', 'red.png'])
+        # Blue only covers a quarter of red.png
+        self.assertLess(matches[0][1], matches[1][1])
+        self.assertEqual([entry[0] for entry, _ in index.nearest((30, 60, 220), max_distance=30)],
+                         ['blue.png', 'red.png'])
+        self.assertEqual([entry[0] for entry in index.by_hue()],
+                         ['red.png', 'green.png', 'blue.png', 'grey.png'])
+
+        # Same version: not reloaded
+        index.refresh('v1', lambda: [])
+        self.assertEqual(len(index.entries), 4)
+
+    def test_browse_by_color(self):
+        """Test the colour endpoint uses palettes computed at upload"""
+        self._upload('red.png', Image.new('RGB', (40, 40), (220, 30, 30)))
+        self._upload('blue.png', Image.new('RGB', (40, 40), (30, 60, 220)))
+        self._upload('mixed.png', self._two_tone((30, 60, 220), (220, 30, 30)))
+
+        data = json.loads(self.client.get('/colors?color=dc1e1e').data)
+        self.assertEqual([image['filename'] for image in data['images']], ['red.png', 'mixed.png'])
+        self.assertEqual(data['images'][0]['palette'], ['#dc1e1e'])
+        self.assertIn('?v=', data['images'][0]['tile_url'])
+
+        data = json.loads(self.client.get('/colors?per_page=2').data)
+        self.assertEqual(data['total'], 3)
+        self.assertEqual([image['filename'] for image in data['images']], ['red.png', 'blue.png'])
+        self.assertEqual(self.client.get('/colors?color=nope').status_code, 400)
+
+        # The index follows deletes
+        self.client.post('/delete-image', json={'filename': 'red.png'})
+        data = json.loads(self.client.get('/colors?color=dc1e1e').data)
+        self.assertEqual([image['filename'] for image in data['images']], ['mixed.png'])
+
+    def test_index_colors_backfill(self):
+        """Test catalog rows without a palette are backfilled"""
+        Image.new('RGB', (40, 40), (40, 200, 60)).save(os.path.join(self.test_upload_folder, 'green.png'))
+        with self.app.app_context():
+            db.session.add(Photo(filename='green.png', size=1, mtime_ns=1))
+            db.session.add(Photo(filename='missing.png', size=1, mtime_ns=1))
+            db.session.commit()
+
+        result = self.app.test_cli_runner().invoke(args=['index-colors'])
+        self.assertIn('Indexed colors of 1 images', result.output)
+        data = json.loads(self.client.get('/colors?color=28c83c').data)
+        self.assertEqual([image['filename'] for image in data['images']], ['green.png'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+from unittest import mock
+from app import create_app, db, User
+import os
+import pstats
+import shutil
+import tempfile
+import json
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.db_path,
+                                'TESTING': True,
+                                'WTF_CSRF_ENABLED': False})
+
+        self.profile_dir = tempfile.mkdtemp()
+        self.app.config['PROFILE_DIR'] = self.profile_dir
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            test_user = User(username='test_admin')
+            test_user.set_password('test_password')
+            db.session.add(test_user)
+            db.session.commit()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+        shutil.rmtree(self.profile_dir)
+
+    def _login(self):
+        self.client.post('/login', data={
+            'username': 'test_admin',
+            'password': 'test_password'
+        })
+
+    def _read_metadata(self, profile_id):
+        with open(os.path.join(self.profile_dir, profile_id + '.json')) as f:
+            return json.load(f)
+
+    def test_not_profiled_by_default(self):
+        """Test requests are not profiled unless a trigger fires"""
+        response = self.client.get('/', headers={'X-Profile': '1'})
+        self.assertNotIn('X-Profile-Id', response.headers)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_profile_always(self):
+        """Test the config trigger writes pstats and metadata"""
+        self.app.config['PROFILE_ALWAYS'] = True
+        response = self.client.get('/?page=1')
+        profile_id = response.headers['X-Profile-Id']
+
+        metadata = self._read_metadata(profile_id)
+        self.assertEqual(metadata['endpoint'], 'main.index')
+        self.assertEqual(metadata['path'], '/?page=1')
+        self.assertEqual(metadata['status'], 200)
+        self.assertGreater(metadata['duration_ms'], 0)
+        stats = pstats.Stats(os.path.join(self.profile_dir, profile_id + '.pstats'))
+        self.assertGreater(stats.total_calls, 0)
+
+    def test_only_selected_endpoints(self):
+        """Test endpoints outside PROFILE_ENDPOINTS are never profiled"""
+        self.app.config['PROFILE_ALWAYS'] = True
+        response = self.client.get('/health-check')
+        self.assertNotIn('X-Profile-Id', response.headers)
+
+    def test_header_trigger_requires_login(self):
+        """Test the header only works for authenticated users"""
+        self._login()
+        response = self.client.get('/admin', headers={'X-Profile': '1'})
+        self.assertEqual(self._read_metadata(response.headers['X-Profile-Id'])['endpoint'], 'main.admin')
+
+    def test_sampling_mode_writes_collapsed_stacks(self):
+        """Test the sampling profiler writes collapsed stacks"""
+        self.app.config.update(PROFILE_SAMPLE_RATE=1.0, PROFILE_MODE='sample')
+        response = self.client.get('/')
+        profile_id = response.headers['X-Profile-Id']
+
+        self.assertEqual(self._read_metadata(profile_id)['output'], 'collapsed')
+        with open(os.path.join(self.profile_dir, profile_id + '.collapsed')) as f:
+            for line in f:
+                stack, count = line.rsplit(' ', 1)
+                self.assertTrue(stack)
+                self.assertGreater(int(count), 0)
+
+    def test_busy_cprofile_falls_back_to_sampling(self):
+        """Test a request overlapping another cProfile session is sampled, not failed"""
+        self.app.config['PROFILE_ALWAYS'] = True
+        with mock.patch('profiling.cProfile.Profile') as profile:
+            profile.return_value.enable.side_effect = ValueError('Another profiling tool is already active')
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._read_metadata(response.headers['X-Profile-Id'])['output'], 'collapsed')
+
+    def test_old_profiles_are_pruned(self):
+        """Test only the newest PROFILE_KEEP profiles are kept"""
+        self.app.config.update(PROFILE_ALWAYS=True, PROFILE_KEEP=2)
+        ids = [self.client.get('/').headers['X-Profile-Id'] for _ in range(4)]
+        self.assertEqual(sorted(os.listdir(self.profile_dir)),
+                         sorted(f'{profile_id}{suffix}' for profile_id in ids[2:]
+                                for suffix in ('.json', '.pstats')))
+
+if __name__ == '__main__':
+    unittest.main()
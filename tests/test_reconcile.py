@@ -0,0 +1,172 @@
+import unittest
+from app import create_app, db, User, Album, AlbumImage, Photo, allowed_file, forget_catalog, get_storage
+from reconcile import Reconciler
+from PIL import Image
+from io import BytesIO
+import os
+import shutil
+import tempfile
+import json
+
+class TestReconcile(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.db_path,
+                                'TESTING': True,
+                                'WTF_CSRF_ENABLED': False})
+
+        self.test_upload_folder = tempfile.mkdtemp()
+        self.app.config['UPLOAD_FOLDER'] = self.test_upload_folder
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            test_user = User(username='test_admin')
+            test_user.set_password('test_password')
+            db.session.add(test_user)
+            db.session.commit()
+
+        # Small batches so that every pass crosses batch boundaries
+        self.reconciler = Reconciler(self.app, db, Photo, get_storage, allowed_file, forget_catalog,
+                                     batch_size=2, pause=0, max_remove=1)
+        self.app.extensions['reconciler'] = self.reconciler
+
+    def tearDown(self):
+        self.app.extensions.pop('reconciler', None)
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        os.close(self.db_fd)
+        os.unlink(self.db_path)
+        shutil.rmtree(self.test_upload_folder)
+
+    def _path(self, *parts):
+        return os.path.join(self.test_upload_folder, *parts)
+
+    def _write_image(self, filename, size=(64, 64)):
+        Image.new('RGB', size, color='blue').save(self._path(filename))
+
+    def _upload(self, filename):
+        with open(self._path(filename), 'rb') as f:
+            data = f.read()
+        os.remove(self._path(filename))
+        self.client.post('/upload', data={'images': [(BytesIO(data), filename)]},
+                         content_type='multipart/form-data')
+
+    def _catalog(self):
+        with self.app.app_context():
+            return [photo.filename for photo in Photo.query.order_by(Photo.filename)]
+
+    def test_backfills_catalog_and_derivatives(self):
+        """Test images missing from the catalog are added with their thumbnails"""
+        for name in ['a.jpg', 'b.jpg', 'c.jpg']:
+            self._write_image(name)
+
+        report = self.reconciler.reconcile_once()
+        self.assertEqual(report['images'], 3)
+        self.assertEqual(report['catalog_added'], 3)
+        # A thumbnail and a tile each
+        self.assertEqual(report['derivatives_generated'], 6)
+        self.assertEqual(self._catalog(), ['a.jpg', 'b.jpg', 'c.jpg'])
+        self.assertEqual(sorted(os.listdir(self._path('derivatives', 'thumb'))),
+                         ['a.jpg', 'b.jpg', 'c.jpg'])
+        self.assertEqual(sorted(os.listdir(self._path('derivatives', 'tile'))),
+                         ['a.jpg', 'b.jpg', 'c.jpg'])
+
+        self.assertEqual(self.reconciler.reconcile_once()['drift'], 0)
+
+    def test_removes_dangling_rows_and_orphans(self):
+        """Test rows and derivatives of images deleted by hand are cleaned up"""
+        self.client.post('/login', data={'username': 'test_admin', 'password': 'test_password'})
+        for name in ['a.jpg', 'b.jpg', 'c.jpg']:
+            self._write_image(name)
+            self._upload(name)
+        with self.app.app_context():
+            album = Album(title='Trip', slug='trip')
+            db.session.add(album)
+            db.session.flush()
+            db.session.add(AlbumImage(album_id=album.id, filename='b.jpg', position='i'))
+            db.session.add_all([Photo(filename=name, size=1, mtime_ns=1) for name in ['x.jpg', 'y.jpg', 'z.jpg']])
+            db.session.commit()
+        os.remove(self._path('b.jpg'))
+
+        report = self.reconciler.reconcile_once()
+        self.assertEqual(report['catalog_removed'], 4)
+        self.assertEqual(report['derivatives_removed'], 2)
+        self.assertEqual(self._catalog(), ['a.jpg', 'c.jpg'])
+        self.assertEqual(sorted(os.listdir(self._path('derivatives', 'thumb'))), ['a.jpg', 'c.jpg'])
+        with self.app.app_context():
+            # Album entries outlive the catalog row in case the file comes back
+            self.assertEqual(AlbumImage.query.count(), 1)
+
+        response = self.client.get('/reconcile-status')
+        self.assertEqual(json.loads(response.data)['report']['drift'], report['drift'])
+
+    def test_unavailable_storage_changes_nothing(self):
+        """Test a missing or empty upload folder doesn't wipe the catalog"""
+        for name in ['a.jpg', 'b.jpg']:
+            self._write_image(name)
+        self.reconciler.reconcile_once()
+
+        for name in ['a.jpg', 'b.jpg']:
+            os.remove(self._path(name))
+        report = self.reconciler.reconcile_once()
+        self.assertIn('no images', report['aborted'])
+        self.assertEqual(sorted(os.listdir(self._path('derivatives', 'thumb'))), ['a.jpg', 'b.jpg'])
+
+        shutil.rmtree(self.test_upload_folder)
+        report = self.reconciler.reconcile_once()
+        self.assertEqual(report['aborted'], 'storage is unavailable')
+        self.assertEqual(report['catalog_removed'], 0)
+        self.assertEqual(self._catalog(), ['a.jpg', 'b.jpg'])
+        os.makedirs(self.test_upload_folder)
+
+    def test_removals_are_capped(self):
+        """Test one pass removes at most max_remove of the catalog"""
+        for name in ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg']:
+            self._write_image(name)
+        self.reconciler.max_remove = 0.5
+        self.reconciler.reconcile_once()
+        for name in ['a.jpg', 'b.jpg', 'c.jpg']:
+            os.remove(self._path(name))
+
+        report = self.reconciler.reconcile_once()
+        self.assertEqual(report['catalog_removed'], 2)
+        self.assertEqual(report['removals_skipped'], 1)
+        self.assertEqual(self._catalog(), ['c.jpg', 'd.jpg'])
+
+    def test_refreshes_changed_images(self):
+        """Test rows and thumbnails follow images rewritten outside the app"""
+        self._write_image('a.jpg')
+        self.reconciler.reconcile_once()
+        os.utime(self._path('derivatives', 'thumb', 'a.jpg'), ns=(0, 0))
+        os.utime(self._path('derivatives', 'tile', 'a.jpg'), ns=(0, 0))
+        self._write_image('a.jpg', size=(128, 32))
+
+        report = self.reconciler.reconcile_once()
+        self.assertEqual(report['catalog_updated'], 1)
+        self.assertEqual(report['derivatives_generated'], 2)
+        with Image.open(self._path('derivatives', 'thumb', 'a.jpg')) as img:
+            self.assertEqual(img.size, (128, 32))
+        with Image.open(self._path('derivatives', 'tile', 'a.jpg')) as img:
+            self.assertEqual(img.size, (32, 32))
+
+    def test_removes_stale_spool_files(self):
+        """Test only spool files older than the cutoff are removed"""
+        self._write_image('a.jpg')
+        os.makedirs(self._path('derivatives', 'thumb'))
+        for name in ['.a.jpg.1.tmp', '.b.jpg.2.tmp', os.path.join('derivatives', 'thumb', '.a.jpg.3.tmp')]:
+            with open(self._path(name), 'wb') as f:
+                f.write(b'partial')
+            os.utime(self._path(name), ns=(0, 0))
+        with open(self._path('.c.jpg.4.tmp'), 'wb') as f:
+            f.write(b'still being written')
+
+        report = self.reconciler.reconcile_once()
+        self.assertEqual(report['spool_removed'], 3)
+        self.assertEqual(report['derivatives_removed'], 0)
+        self.assertEqual(sorted(os.listdir(self.test_upload_folder)), ['.c.jpg.4.tmp', 'a.jpg', 'derivatives'])
+        self.assertEqual(os.listdir(self._path('derivatives', 'thumb')), ['a.jpg'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
-from app import app, db, User
+from app import create_app, db, User
 import os
+import shutil
 import tempfile
 from werkzeug.security import generate_password_hash
 from io import BytesIO
@@ -8,13 +9,13 @@ from io import BytesIO
 class TestRoutes(unittest.TestCase):
     def setUp(self):
         # Create a temporary database
-        self.db_fd, app.config['DATABASE'] = tempfile.mkstemp()
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + app.config['DATABASE']
-        app.config['TESTING'] = True
-        app.config['WTF_CSRF_ENABLED'] = False
-        self.client = app.test_client()
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + self.db_path,
+                                'TESTING': True,
+                                'WTF_CSRF_ENABLED': False})
+        self.client = self.app.test_client()
         
-        with app.app_context():
+        with self.app.app_context():
             db.create_all()
             # Create test user
             test_user = User(username='test_admin')
@@ -23,11 +24,11 @@ class TestRoutes(unittest.TestCase):
             db.session.commit()
 
     def tearDown(self):
-        with app.app_context():
+        with self.app.app_context():
             db.session.remove()
             db.drop_all()
         os.close(self.db_fd)
-        os.unlink(app.config['DATABASE'])
+        os.unlink(self.db_path)
 
     def test_index_page(self):
         """Test the landing page loads correctly"""
@@ -38,6 +39,32 @@ class TestRoutes(unittest.TestCase):
         self.assertIn(b'About', response.data)
         self.assertIn(b'Contact', response.data)
 
+    def test_index_inlines_critical_css(self):
+        """Test the landing page inlines critical CSS and preloads the hero"""
+        hints = []
+        response = self.client.get('/', environ_base={'wsgi.early_hints': hints.extend})
+        self.assertIn(b'<style>', response.data)
+        self.assertIn(b"url('/static/images/hero-bg.jpg')", response.data)
+        self.assertIn(b'rel="preload" href="/static/css/style.css" as="style"', response.data)
+        self.assertIn('</static/images/hero-bg.jpg>; rel=preload; as=image', response.headers['Link'])
+        self.assertEqual(hints, [('Link', '</static/images/hero-bg.jpg>; rel=preload; as=image, '
+                                          '</static/css/style.css>; rel=preload; as=style')])
+
+    def test_create_app(self):
+        """Test the factory builds independent, fully wired apps"""
+        cache_folder = tempfile.mkdtemp()
+        other = create_app({'TESTING': True, 'TEMPLATE_CACHE_FOLDER': cache_folder})
+        self.assertIsNot(other, self.app)
+        self.assertEqual({rule.endpoint for rule in other.url_map.iter_rules()},
+                         {rule.endpoint for rule in self.app.url_map.iter_rules()})
+        self.assertIn('precompile-templates', other.cli.commands)
+
+        runner = other.test_cli_runner()
+        result = runner.invoke(args=['precompile-templates'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertTrue(os.listdir(cache_folder))
+        shutil.rmtree(cache_folder)
+
     def test_login_page(self):
         """Test the login page loads correctly"""
         response = self.client.get('/login')
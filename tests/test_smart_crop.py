@@ -0,0 +1,61 @@
+import unittest
+from smart_crop import best_window, find_crop, summed_area_table, window_sums
+from PIL import Image, ImageDraw
+import numpy as np
+
+class TestSmartCrop(unittest.TestCase):
+    def _scene(self, size, subject):
+        """Helper method to draw a textured subject on a flat background"""
+        img = Image.new('RGB', size, color=(200, 210, 220))
+        draw = ImageDraw.Draw(img)
+        left, top, right, bottom = subject
+        draw.rectangle(subject, fill=(180, 30, 30))
+        for x in range(left, right, 8):
+            draw.line([(x, top), (x, bottom)], fill=(20, 20, 20), width=2)
+        return img
+
+    def test_window_sums_match_brute_force(self):
+        """Test summed-area window sums equal direct sums"""
+        values = np.random.default_rng(1).random((7, 9))
+        sums = window_sums(summed_area_table(values), 4, 3)
+        self.assertEqual(sums.shape, (5, 6))
+        self.assertAlmostEqual(sums[2, 3], values[2:5, 3:7].sum())
+
+    def test_flat_image_is_center_cropped(self):
+        """Test ties between windows go to the most central one"""
+        self.assertEqual(best_window(np.ones((10, 20)), 10, 10), (5, 0))
+        img = Image.new('RGB', (300, 100), color='blue')
+        left, top, right, bottom = find_crop(img)
+        self.assertEqual((right - left, top, bottom), (100, 0, 100))
+        self.assertAlmostEqual(left, 100, delta=2)
+
+    def test_crop_follows_subject(self):
+        """Test the crop window moves over the salient region"""
+        img = self._scene((1200, 400), (40, 100, 240, 300))
+        left, top, right, bottom = find_crop(img)
+        self.assertEqual((right - left, bottom - top), (400, 400))
+        self.assertEqual(top, 0)
+        self.assertLessEqual(left, 40)
+
+        img = self._scene((300, 900), (60, 700, 240, 860))
+        left, top, right, bottom = find_crop(img)
+        self.assertEqual((left, right), (0, 300))
+        self.assertGreaterEqual(bottom, 860)
+        self.assertLessEqual(top, 700)
+
+    def test_other_aspect_ratios(self):
+        """Test crops keep the requested aspect ratio inside the image"""
+        img = self._scene((640, 480), (400, 50, 600, 200))
+        left, top, right, bottom = find_crop(img, aspect=16 / 9)
+        self.assertEqual((right - left, bottom - top), (640, 360))
+        self.assertGreaterEqual(top, 0)
+        self.assertLessEqual(bottom, 480)
+        self.assertEqual(find_crop(Image.new('RGB', (50, 50)), aspect=1.0), (0, 0, 50, 50))
+
+    def test_thin_images_are_center_cropped(self):
+        """Test images too thin to analyse get a centre crop instead of an error"""
+        self.assertEqual(find_crop(Image.new('RGB', (2000, 7))), (996, 0, 1003, 7))
+        self.assertEqual(find_crop(Image.new('RGB', (5, 900))), (0, 447, 5, 452))
+
+if __name__ == '__main__':
+    unittest.main()
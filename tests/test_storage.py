@@ -0,0 +1,203 @@
+import unittest
+from storage import LocalStorage, S3Storage, StorageError
+from datetime import datetime, timezone
+import os
+import shutil
+import tempfile
+import threading
+from io import BytesIO
+
+class NotFound(Exception):
+    response = {'Error': {'Code': '404'}}
+
+class LocalS3(object):
+    """In-memory stand-in for the subset of the S3 client API we use."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+        self.locked = set()
+        self.lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body):
+        self.calls.append('put_object')
+        self.objects[Key] = bytes(Body)
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.calls.append('create_multipart_upload')
+        upload_id = f'upload-{len(self.uploads)}'
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with self.lock:
+            self.calls.append('upload_part')
+            self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {'ETag': f'etag-{PartNumber}'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        assert numbers == sorted(numbers)
+        self.objects[Key] = b''.join(parts[number] for number in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise NotFound()
+        return {'Body': BytesIO(self.objects[Key])}
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise NotFound()
+        return {'ContentLength': len(self.objects[Key]),
+                'LastModified': datetime(2024, 1, 1, tzinfo=timezone.utc)}
+
+    def delete_objects(self, Bucket, Delete):
+        self.calls.append('delete_objects')
+        errors = []
+        for obj in Delete['Objects']:
+            if obj['Key'] in self.locked:
+                errors.append({'Key': obj['Key'], 'Code': 'AccessDenied', 'Message': 'Access Denied'})
+            else:
+                self.objects.pop(obj['Key'], None)
+        return {'Errors': errors} if errors else {}
+
+    def list_objects_v2(self, Bucket, Prefix, Delimiter, ContinuationToken=None):
+        keys = sorted(key for key in self.objects
+                      if key.startswith(Prefix) and Delimiter not in key[len(Prefix):])
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + 2]
+        response = {'Contents': [{'Key': key, 'Size': len(self.objects[key]),
+                                  'LastModified': datetime(2024, 1, 1, tzinfo=timezone.utc)}
+                                 for key in page],
+                    'IsTruncated': start + 2 < len(keys)}
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + 2)
+        return response
+
+class StorageContract(object):
+    """Behaviour shared by every storage backend."""
+
+    def test_save_and_read(self):
+        """Test bytes and file objects round-trip"""
+        self.storage.save('a.jpg', b'data')
+        self.storage.save('b.jpg', BytesIO(b'more data'))
+        self.assertEqual(self.storage.read('a.jpg'), b'data')
+        self.assertEqual(b''.join(self.storage.stream('b.jpg', chunk_size=2)), b'more data')
+        self.assertEqual(self.storage.stat('b.jpg')[0], 9)
+
+    def test_list_is_sorted_and_excludes_nested(self):
+        """Test listing only returns direct children, sorted"""
+        for name in ['c.jpg', 'a.jpg', 'b.jpg', 'thumbs/a.jpg']:
+            self.storage.save(name, b'x')
+        self.assertEqual(self.storage.list(), ['a.jpg', 'b.jpg', 'c.jpg'])
+        self.assertEqual(self.storage.list('thumbs/'), ['thumbs/a.jpg'])
+        self.assertEqual([entry[:2] for entry in self.storage.scan()],
+                         [('a.jpg', 1), ('b.jpg', 1), ('c.jpg', 1)])
+        self.assertEqual(list(self.storage.iter_scan()), self.storage.scan())
+        self.assertEqual([entry[0] for entry in self.storage.iter_scan('thumbs/')], ['thumbs/a.jpg'])
+
+    def test_delete_many(self):
+        """Test deleting several files at once"""
+        for name in ['a.jpg', 'b.jpg', 'c.jpg']:
+            self.storage.save(name, b'x')
+        self.storage.delete_many(['a.jpg', 'c.jpg'])
+        self.assertEqual(self.storage.list(), ['b.jpg'])
+        self.assertFalse(self.storage.exists('a.jpg'))
+
+    def test_missing_file(self):
+        """Test missing files are reported"""
+        self.assertFalse(self.storage.exists('missing.jpg'))
+        with self.assertRaises(FileNotFoundError):
+            self.storage.read('missing.jpg')
+
+    def test_rejects_path_traversal(self):
+        """Test names cannot escape the storage root"""
+        for name in ['../secret.jpg', '/etc/passwd', 'a/../../b.jpg', '']:
+            with self.assertRaises(StorageError):
+                self.storage.save(name, b'x')
+
+class TestLocalStorage(StorageContract, unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage = LocalStorage(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_save_is_atomic(self):
+        """Test a failed write leaves the previous file and no spool file"""
+        class Broken(object):
+            def read(self, size=-1):
+                raise IOError('client went away')
+
+        self.storage.save('a.jpg', b'original')
+        with self.assertRaises(IOError):
+            self.storage.save('a.jpg', Broken())
+        self.assertEqual(self.storage.read('a.jpg'), b'original')
+        self.assertEqual(os.listdir(self.root), ['a.jpg'])
+
+    def test_fsync_policies(self):
+        """Test every fsync policy writes the file"""
+        for policy in LocalStorage.FSYNC_POLICIES:
+            storage = LocalStorage(self.root, fsync=policy)
+            storage.save(f'{policy}/a.jpg', b'data')
+            self.assertEqual(storage.read(f'{policy}/a.jpg'), b'data')
+        with self.assertRaises(ValueError):
+            LocalStorage(self.root, fsync='sometimes')
+
+    def test_url_and_path(self):
+        """Test local URLs match the static uploads route"""
+        self.assertEqual(self.storage.url('a.jpg'), '/static/uploads/a.jpg')
+        self.assertEqual(self.storage.path('a.jpg'), os.path.join(self.root, 'a.jpg'))
+
+class TestS3Storage(StorageContract, unittest.TestCase):
+    def setUp(self):
+        self.client = LocalS3()
+        self.storage = S3Storage(self.client, 'portfolio', prefix='uploads',
+                                 public_url='https://cdn.example.com', part_size=4, max_workers=3)
+
+    def test_multipart_upload(self):
+        """Test large uploads are split into parallel parts"""
+        data = bytes(range(50))
+        self.storage.save('big.jpg', BytesIO(data))
+        self.assertEqual(self.client.objects['uploads/big.jpg'], data)
+        self.assertEqual(self.client.calls.count('upload_part'), 13)
+        self.assertNotIn('put_object', self.client.calls)
+
+    def test_small_upload_is_single_put(self):
+        """Test small uploads skip multipart"""
+        self.storage.save('small.jpg', b'abc')
+        self.assertEqual(self.client.calls, ['put_object'])
+
+    def test_batched_delete(self):
+        """Test deletes are sent in batches"""
+        self.storage.DELETE_BATCH = 2
+        for i in range(5):
+            self.storage.save(f'{i}.jpg', b'x')
+        self.storage.delete_many([f'{i}.jpg' for i in range(5)])
+        self.assertEqual(self.client.calls.count('delete_objects'), 3)
+        self.assertEqual(self.client.objects, {})
+
+    def test_failed_delete_not_reported(self):
+        """Test keys S3 failed to delete are left out of the result"""
+        self.storage.DELETE_BATCH = 2
+        for i in range(3):
+            self.storage.save(f'{i}.jpg', b'x')
+        self.client.locked.add('uploads/1.jpg')
+        with self.assertLogs('storage', 'WARNING'):
+            deleted = self.storage.delete_many([f'{i}.jpg' for i in range(3)])
+        self.assertEqual(deleted, ['0.jpg', '2.jpg'])
+        self.assertEqual(list(self.client.objects), ['uploads/1.jpg'])
+        self.assertFalse(self.storage.delete('1.jpg'))
+
+    def test_url(self):
+        """Test URLs point at the public bucket URL"""
+        self.assertEqual(self.storage.url('a.jpg'), 'https://cdn.example.com/uploads/a.jpg')
+
+if __name__ == '__main__':
+    unittest.main()